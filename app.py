@@ -1,21 +1,28 @@
 from logging import getLogger, StreamHandler, DEBUG, Formatter
 from math import ceil
 from pathlib import Path
+from typing import List
 import os
-from elasticsearch import Elasticsearch
-import MeCab
+import atexit
+from threading import Lock
 
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, render_template, request, redirect, url_for, jsonify
 from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager, login_required, login_user, logout_user, current_user
 from flask_bcrypt import Bcrypt
 
 from backend.schedule import run_schedule
 from backend.openbd import OpenBD
+from backend.tokenizer import Tokenizer
 from backend.doc2vecwrapper import Doc2VecWrapper
-from backend.db import LoginUser, record_history, get_user_history, change_session, get_guest_uIds
+from backend.db import LoginUser, record_history, get_user_history, change_session, get_guest_uIds, get_closed_history_df
 from backend.sbrs import get_prop_sbrs
-from config import get_config
+from backend.esclient import init_app as init_es, get_es
+from backend.bookrepo import BookRepository
+from backend.retrain import RetrainWorker
+from backend.tokenstore import get_token_store
+from backend.corpus import split_description
+from config import get_config, get_sbrs_config
 
 
 # ロガー設定
@@ -29,8 +36,8 @@ handler.setFormatter(Formatter('[shisho] %(message)s'))
 
 
 config = get_config()   # 司書設定
-# MeCab設定: NEologd（MeCab用システム辞書）を使った分かち書き
-mecab = MeCab.Tagger('-Ochasen -r /etc/mecabrc -d /usr/lib/x86_64-linux-gnu/mecab/dic/mecab-ipadic-neologd')
+# 書籍説明テキストの前処理: NEologd（MeCab用システム辞書）を使った分かち書き
+tokenizer = Tokenizer()
 # Doc2Vecモデル読み込み（パスが存在しない -> 未訓練状態）
 d2v = Doc2VecWrapper(model_path=Path('/projects/model/d2v.model'))
 guest_uIds_set = set(get_guest_uIds())  # ゲストアカウント ユーザID集合
@@ -42,9 +49,57 @@ login_manager.login_view = 'login'          # ログインページ
 app.config['SECRET_KEY'] = os.urandom(24)   # セッション情報暗号化
 csrf = CSRFProtect(app)                     # flask-wtfによるCSRF対策
 bcrypt = Bcrypt(app)                        # flask-bcryptパスワードハッシュ化
+init_es(app)                                # 共有Elasticsearchクライアント（リクエストごとの往復回数計測）
+book_repo = BookRepository()                # 書籍情報取得
+token_store = get_token_store()             # 分かち書き済コーパス（Doc2Vecモデル訓練用，設定なし -> None）
 
 prop_sbrs = get_prop_sbrs(d2v=d2v)  # 提案SBRS
-run_schedule()                      # 定期実行ジョブのスケジューリング
+models_lock = Lock()                # Doc2Vecモデル・提案SBRSの排他制御（書籍の登録・削除・閲覧，再訓練後の差し替え）
+
+
+def swap_models(new_d2v: Doc2VecWrapper, new_prop_sbrs) -> None:
+    """稼働中のDoc2Vecモデル・提案SBRSの差し替え（再訓練完了時，models_lock取得済で呼び出される）
+
+    Args:
+        new_d2v (Doc2VecWrapper): 再訓練したDoc2Vecモデル
+        new_prop_sbrs (ProposalSystem): 再訓練した提案SBRS
+    """
+    global d2v, prop_sbrs
+    # 再訓練中（訓練開始以降）に登録された書籍を引き継ぎ（再訓練したモデルで書籍ベクトルを再推論，削除済書籍は除く）
+    for isbn10, (added_at, description) in d2v.added.items():
+        if (added_at >= new_d2v.trained_at) and (isbn10 not in d2v.deleted):
+            new_d2v.add_book(isbn10=isbn10, description=description)
+            new_prop_sbrs.add_book(bId=isbn10)
+    # 再訓練中に削除された書籍のトゥームストーンを引き継ぎ
+    for isbn10 in d2v.deleted:
+        if new_d2v.delete_book(isbn10=isbn10):
+            new_prop_sbrs.delete_book(bId=isbn10)
+    d2v, prop_sbrs = new_d2v, new_prop_sbrs
+
+
+def close_sessions(uIds: List[str]) -> None:
+    """セッションを変更したユーザの末尾未確定ログの確定（次のログを待たずにユーザ表現を構築/更新）
+
+    Args:
+        uIds (List[str]): セッションを変更したユーザID
+    """
+    with models_lock:   # 書籍閲覧（提案SBRS更新）・再訓練後の差し替えと排他
+        open_log_ids = [prop_sbrs.open_log_ids[uId] for uId in uIds if uId in prop_sbrs.open_log_ids]
+        if len(open_log_ids):
+            prop_sbrs.close_sessions(closed_df=get_closed_history_df(ids=open_log_ids))
+
+
+run_schedule(on_session_close=close_sessions)   # 定期実行ジョブのスケジューリング（セッション切れ -> ユーザ表現の構築/更新）
+
+
+# バックグラウンド再訓練（リクエスト処理をブロックしない）
+retrain_worker = RetrainWorker(model_path=Path('/projects/model/d2v.model'), on_swap=swap_models,
+                               lock=models_lock)
+# 終了時に未保存の追加書籍（書籍ベクトル・類似書籍テーブル）を保存
+atexit.register(lambda: d2v.flush())
+# 終了時に提案SBRSスナップショット保存（次回起動時はそれ以降の閲覧履歴のみ反映，パス指定なし -> 保存しない）
+if get_sbrs_config().snapshot.path is not None:
+    atexit.register(lambda: prop_sbrs.save_snapshot(path=get_sbrs_config().snapshot.path))
 
 
 @login_manager.user_loader
@@ -80,11 +135,10 @@ def index():
     title = get_title('トップ')
 
     # bookインデックスのdocument（書籍）からランダムピックアップ
-    es = Elasticsearch('elasticsearch')
+    es = get_es()
     es_params = {'size': 6}
     body = {'query': {'function_score': {"query": {"match_all": {}}, "random_score": {}}}}
     response = es.search(index='book', body=body, params=es_params)['hits']['hits']
-    es.close()
 
     picked_books = [sr['_source'] for sr in response]   # ピックアップ書籍
     return render_template('index.html', shishosan=config['shishosan'], title=title, picked_books=picked_books)
@@ -144,7 +198,6 @@ def history():
     hisotry_max_size, unique_user_history, bIds_set = 30, [], set()
 
     # 最新順（タイムスタンプ降順）取得 -> 重複履歴除外
-    es = Elasticsearch('elasticsearch')
     for lId, log in sorted(user_history.items(), reverse=True):
         if len(unique_user_history) == hisotry_max_size:
             break
@@ -154,8 +207,12 @@ def history():
 
         bIds_set.add(log['bId'])
         unique_user_history.append(log)
-        unique_user_history[-1]['book'] = es.get_source(index='book', id=log['bId'])    # 書籍情報取得
-    es.close()
+
+    # 書籍情報一括取得（削除済書籍の履歴は除外）
+    books = book_repo.mget(isbn10s=[log['bId'] for log in unique_user_history])
+    for log, book in zip(unique_user_history, books):
+        log['book'] = book
+    unique_user_history = [log for log in unique_user_history if log['book'] is not None]
 
     # 閲覧書籍0冊 -> None
     if len(user_history) == 0:
@@ -169,6 +226,7 @@ def history():
 def logout():
     # "GET /logout" -> ログアウト処理
     change_session(user=current_user)   # セッション変更
+    close_sessions(uIds=[current_user.uId])
     logout_user()                       # ログアウト
     return redirect(url_for('login'))
 
@@ -187,7 +245,7 @@ def register_inquire():
     # "POST /register" -> "register.html"のレンダリング（リクエスト結果付与）
     title = get_title('書籍問い合わせ結果')
     isbn10 = request.form['isbn10']             # 問い合わせ対象書籍ISBN-10コード
-    book = OpenBD(isbn10=isbn10, mecab=mecab)   # openBDリクエスト
+    book = OpenBD(isbn10=isbn10, tokenizer=tokenizer)   # openBDリクエスト
     result = book.result                      # リクエスト結果
 
     if current_user.uId in guest_uIds_set:
@@ -208,22 +266,28 @@ def register_post():
     # "POST /register/post" -> "registered.html"のレンダリング
     title = get_title('登録完了')
     isbn10 = request.form['isbn10']  # 登録対象書籍のISBN-10コード
-    book_info = OpenBD(isbn10=isbn10, mecab=mecab).get_std_info()   # 登録書籍基本情報
+    # 登録書籍基本情報（問い合わせ時のopenBDレスポンスをキャッシュから再利用 -> 再リクエストなし）
+    book_info = OpenBD(isbn10=isbn10, tokenizer=tokenizer).get_std_info()
 
-    es = Elasticsearch('elasticsearch')
+    es = get_es()
     es.index(index='book', doc_type='_doc', body=book_info, id=isbn10)  # bookインデックスに登録
+    book_repo.invalidate(isbn10s=[isbn10])  # 書籍情報キャッシュ無効化（再登録時）
+    if token_store is not None:
+        token_store.append(isbn10=isbn10, words=split_description(book_info['description']))  # 分かち書き済コーパスに追記
     logger.debug('書籍の登録に成功しました (ISBN-10: {})'.format(isbn10))
 
     es.indices.refresh(index='book')    # bookインデックス更新 <- 反映には1秒のラグがあるため
     n_book = es.count(index='book')['count']    # 登録書籍総数
-    es.close()
 
-    # 書籍総数が10の倍数（TODO: 値はconfigで弄れるようにする）
+    # Doc2Vecモデル訓練済 -> 書籍説明から書籍ベクトルを推論して即時に類似書籍・推薦対象へ追加（再訓練なし）
+    with models_lock:   # 再訓練後の差し替えと排他（Doc2Vecモデル・提案SBRSを揃えて更新）
+        if d2v.is_trained:
+            d2v.add_book(isbn10=isbn10, description=book_info['description'])
+            prop_sbrs.add_book(bId=isbn10)
+
+    # 書籍総数が10の倍数（TODO: 値はconfigで弄れるようにする） -> Doc2Vecモデル・提案システム再構築（バックグラウンド）
     if n_book % 10 == 0:
-        global d2v, prop_sbrs
-        d2v = Doc2VecWrapper(model_path=Path('/projects/model/d2v.model'), initialize=True)
-        d2v.train()                         # Doc2Vecモデル再構築
-        prop_sbrs = get_prop_sbrs(d2v=d2v)  # 提案システム再構築
+        retrain_worker.request(reason='register:{}'.format(isbn10))
 
     return render_template('registered.html', shishosan=config['shishosan'], title=title, isbn10=isbn10, book_info=book_info)
 
@@ -238,9 +302,7 @@ def delete_inquire():
         isbn10 = request.args['isbn10']  # 削除対象書籍ISBN-10コード
 
         # 削除問い合わせ対象書籍情報取得
-        es = Elasticsearch('elasticsearch')
-        book = es.get_source(index='book', id=isbn10)
-        es.close()
+        book = book_repo.get(isbn10=isbn10)
 
         return render_template('delete.html', shishosan=config['shishosan'], title=title, isbn10=isbn10, book=book)
     else:
@@ -256,18 +318,25 @@ def delete_post():
     title = get_title('削除完了')
     isbn10 = request.form['isbn10']  # 削除対象書籍ISBN-10コード
 
-    es = Elasticsearch('elasticsearch')
-    book_title = es.get_source(index='book', id=isbn10)['title']    # 削除対象書籍タイトル
+    es = get_es()
+    book_title = book_repo.get(isbn10=isbn10)['title']  # 削除対象書籍タイトル
     es.delete(index='book', id=isbn10)  # bookインデックスから対象書籍削除
+    book_repo.invalidate(isbn10s=[isbn10])  # 書籍情報キャッシュ無効化
+    if token_store is not None:
+        token_store.delete(isbn10=isbn10)   # 分かち書き済コーパスから削除
+
+    # 削除した書籍を推薦対象外とする（トゥームストーン，再訓練なし）
+    with models_lock:   # 再訓練後の差し替えと排他（Doc2Vecモデル・提案SBRSを揃えて更新）
+        d2v.delete_book(isbn10=isbn10)
+        prop_sbrs.delete_book(bId=isbn10)
+        n_deleted = len(d2v.deleted)
     logger.debug('書籍の削除に成功しました (ISBN-10: {})'.format(isbn10))
 
     es.indices.refresh(index='book')    # bookインデックス更新 <- 後のD2Vモデル再訓練時に削除した書籍が混入しないようにするため
-    es.close()
 
-    # 削除した書籍を推薦対象外とするため，削除ごとにDoc2Vecモデルを再構築
-    global d2v
-    d2v = Doc2VecWrapper(model_path=Path('/projects/model/d2v.model'), initialize=True)
-    d2v.train()
+    # 削除書籍数が閾値以上 -> Doc2Vecモデル・提案システム再構築（バックグラウンド，トゥームストーンのコンパクション）
+    if n_deleted >= get_config()['doc2vec']['compact_deleted']:
+        retrain_worker.request(reason='compact:{}'.format(n_deleted))
 
     return render_template('deleted.html', shishosan=config['shishosan'], title=title, isbn10=isbn10, book_title=book_title)
 
@@ -291,10 +360,9 @@ def shelf(page=None):
 
     # pページ目 -> 全登録書籍のうち，((p - 1) * 表示数)番目から(表示数)個取得
     es_params = {'from': (page - 1) * display, 'size': display}
-    es = Elasticsearch('elasticsearch')
+    es = get_es()
     books = es.search(index='book', params=es_params)['hits']['hits']
     n_book = es.count(index='book')['count']    # 書籍総数
-    es.close()
 
     n_shelf = ceil(n_book / display)     # 本棚（ページ）数 -> ceil(書籍総数 / 表示数) (ceil: 天井関数)
     title = get_title('本棚 ({0}/{1})'.format(page, n_shelf))
@@ -325,14 +393,13 @@ def search():
         return render_template('search.html', shishosan=config['shishosan'], title=title, search_title=search_title, q='',
                                page=page, display=display)
 
-    es = Elasticsearch('elasticsearch')
+    es = get_es()
     # pページ目 -> 全登録書籍のうち，((p - 1) * 表示数)番目から(表示数)個取得
     es_params = {'from': (page - 1) * display, 'size': display}
 
     response = es.search(index='book', body=body, params=es_params)['hits']  # ヒット書籍情報取得
     n_hit = response['total']['value']  # 検索ヒット数
     n_page = ceil(n_hit / display)  # 本棚（ページ）数 -> ceil(書籍総数 / 表示数) (ceil: 天井関数)
-    es.close()
     result = [sr['_source'] for sr in response['hits']]
 
     if len(result):
@@ -355,36 +422,44 @@ def book(isbn10=None):
 
     title = get_title('本:{0}'.format(isbn10))
 
-    es = Elasticsearch('elasticsearch')
-    book = es.get_source(index='book', id=isbn10)   # bookインデックスから取得
-    n_book = es.count(index='book')['count']    # 書籍総数
+    book = book_repo.get(isbn10=isbn10)    # bookインデックスから取得
 
-    if n_book >= 10:
-        # 10冊以上 -> D2Vモデル構築済み -> 非パーソナライズ推薦（類似書籍取得）
-        try:
-            sim_books_isbn10 = d2v.get_similar_books(isbn10=isbn10, topn=6, verbose=False)  # 類似書籍ISBN-10
-            sim_books = [es.get_source(index='book', id=sb[0]) for sb in sim_books_isbn10]  # 類似書籍情報取得
-        except KeyError:
-            # 分散表現未構築（モデル再構築前） -> 非パーソナライズ推薦キャンセル
-            sim_books = None
-    else:
-        sim_books = None
+    # 書籍の登録・削除，再訓練後の差し替えと排他（追加途中の書籍ベクトル・類似書籍テーブル・書籍KNNモデルを参照しない）
+    # 閲覧履歴の記録もロック内で行う（差し替え直前のcatch_upと提案SBRS更新で同じログを二重に反映しない）
+    with models_lock:
+        log = record_history(user=current_user, bId=isbn10)     # 書籍閲覧履歴記録
 
-    log = record_history(user=current_user, bId=isbn10)     # 書籍閲覧履歴記録
-    rec_books_isbn10 = prop_sbrs.update(log=log)            # 推薦書籍ISBN-10
+        if d2v.is_trained:
+            # D2Vモデル構築済み -> 非パーソナライズ推薦（類似書籍取得）
+            try:
+                sim_books_isbn10 = [sb[0] for sb in d2v.get_similar_books(isbn10=isbn10, topn=6, verbose=False)]  # 類似書籍ISBN-10
+            except KeyError:
+                # 分散表現未構築（モデル再構築前） -> 非パーソナライズ推薦キャンセル
+                sim_books_isbn10 = None
+        else:
+            sim_books_isbn10 = None
 
+        rec_books_isbn10 = prop_sbrs.update(log=log)        # 推薦書籍ISBN-10
+
+    # 類似書籍・推薦書籍の書籍情報を一括取得
     # 推薦書籍なし（各情報不足により提案SBRSが推薦生成できず） -> 類似書籍のみ表示
-    if rec_books_isbn10 is None:
-        rec_books = None
-    else:
-        # ISBN-10に対応する書籍情報習得
-        rec_books = [es.get_source(index='book', id=isbn10) for isbn10 in rec_books_isbn10]
-    es.close()
+    rec_books_isbn10 = None if rec_books_isbn10 is None else list(rec_books_isbn10)
+    n_sim = 0 if sim_books_isbn10 is None else len(sim_books_isbn10)
+    books = book_repo.mget(isbn10s=(sim_books_isbn10 or []) + (rec_books_isbn10 or []))
+    sim_books = None if sim_books_isbn10 is None else [b for b in books[:n_sim] if b is not None]
+    rec_books = None if rec_books_isbn10 is None else [b for b in books[n_sim:] if b is not None]
 
     return render_template('book.html', shishosan=config['shishosan'], title=title, isbn10=isbn10, book=book,
                            sim_books=sim_books, rec_books=rec_books)
 
 
+@app.route('/status/retrain')
+@login_required
+def retrain_status():
+    # "GET /status/retrain" -> 再訓練状態（JSON）
+    return jsonify(retrain_worker.get_status())
+
+
 @app.route('/explore')
 @login_required
 def explore():
@@ -0,0 +1,81 @@
+"""類似書籍取得（/book/<isbn10>）のベンチマーク: 全探索（most_similar） vs 類似書籍テーブル参照
+
+リポジトリのルートで実行する（設定はconfig/config.ymlのdoc2vecを使用）::
+
+    python -m backend.bench.similar
+"""
+from logging import getLogger, StreamHandler, DEBUG, Formatter
+from pathlib import Path
+import tempfile
+import time
+import numpy as np
+from backend.doc2vecwrapper import Doc2VecWrapper
+from config import get_config
+
+# ロガー設定
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+handler.setFormatter(Formatter('[shisho] %(message)s'))
+
+N_BOOKS = (1000, 10000, 50000)  # 書籍数
+N_QUERY = 200                   # 計測する閲覧数
+TOPN = 6                        # 類似書籍数（/book/<isbn10>と同じ）
+
+
+def write_exports(model_path: Path, n_book: int, seed=0) -> None:
+    """ランダムな書籍ベクトル・単語ベクトルの推論用エクスポート書き出し（Doc2VecWrapperの書き出し形式）
+
+    Args:
+        model_path (Path): モデルファイルパス（空ファイルを作成，モデル本体は読み込まれない）
+        n_book (int): 書籍数
+        seed (int, optional): 乱数シード．Defaults to 0.
+    """
+    rng = np.random.RandomState(seed)
+    vector_size = get_config()['doc2vec']['vector_size']
+    model_path.touch()
+    for name, keys in {'dv': ['{:010d}'.format(i) for i in range(n_book)], 'wv': ['w{}'.format(i) for i in range(10)]}.items():
+        stem = '{0}.{1}'.format(model_path.stem, name)
+        np.save(model_path.with_name(stem + '.npy'), rng.standard_normal((len(keys), vector_size)).astype(np.float32))
+        model_path.with_name(stem + '.keys').write_text(''.join('{}\n'.format(key) for key in keys))
+
+
+def measure(fn, isbn10s: list) -> np.ndarray:
+    """1閲覧あたりの所要時間計測
+
+    Returns:
+        np.ndarray: 所要時間（ミリ秒）
+    """
+    elapsed = np.empty(len(isbn10s))
+    for i, isbn10 in enumerate(isbn10s):
+        start = time.perf_counter()
+        fn(isbn10)
+        elapsed[i] = (time.perf_counter() - start) * 1000
+    return elapsed
+
+
+if __name__ == '__main__':
+    for n_book in N_BOOKS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_path = Path(tmp_dir) / 'd2v.model'
+            write_exports(model_path=model_path, n_book=n_book)
+
+            start = time.perf_counter()
+            d2v = Doc2VecWrapper(model_path=model_path)     # 類似書籍テーブルなし -> 構築
+            build_sec = time.perf_counter() - start
+
+            isbn10s = np.random.RandomState(1).choice(d2v.bv.index_to_key, size=N_QUERY).tolist()
+            before = measure(lambda isbn10: d2v.bv.most_similar(positive=[isbn10], topn=TOPN), isbn10s)
+            after = measure(lambda isbn10: d2v.get_similar_books(isbn10=isbn10, topn=TOPN), isbn10s)
+
+            # 全探索と同じ類似書籍が得られることを確認
+            for isbn10 in isbn10s[:20]:
+                expected = [bId for bId, _ in d2v.bv.most_similar(positive=[isbn10], topn=TOPN)]
+                assert [bId for bId, _ in d2v.get_similar_books(isbn10=isbn10, topn=TOPN)] == expected
+
+        logger.debug('書籍数: {0:>6} | テーブル構築: {1:.2f}s | most_similar: 平均{2:.3f}ms (p50 {3:.3f}ms) | '
+                     'テーブル参照: 平均{4:.3f}ms (p50 {5:.3f}ms)'.format(n_book, build_sec, before.mean(), np.median(before),
+                                                                        after.mean(), np.median(after)))
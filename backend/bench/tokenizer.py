@@ -0,0 +1,88 @@
+"""書籍説明テキスト前処理のベンチマーク: 旧実装（ChaSen形式の出力を行・タブで分割） vs Tokenizer（形態素ノード）
+
+config/books.txt（なければconfig/_books.txt）の書籍の書籍説明をopenBDから取得して（キャッシュあり -> 再利用）計測する．
+リポジトリのルートで実行する::
+
+    python -m backend.bench.tokenizer
+"""
+from logging import getLogger, StreamHandler, DEBUG, Formatter
+from typing import List
+from pathlib import Path
+import re
+import time
+import MeCab
+from neologdn import normalize
+from backend.openbd import OpenBD, get_jsons_from_openbd
+from backend.tokenizer import Tokenizer, MECAB_ARGS
+from config import get_config
+
+# ロガー設定
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+handler.setFormatter(Formatter('[shisho] %(message)s'))
+
+N_REPEAT = 5    # 計測回数（書籍説明全体を繰り返し処理）
+
+
+def load_descriptions(tokenizer: Tokenizer) -> List[str]:
+    """書籍説明テキスト（前処理前）の取得
+
+    Args:
+        tokenizer (Tokenizer): 書籍説明テキストの前処理
+
+    Returns:
+        List[str]: 書籍説明テキスト（openBDで見つからない書籍は除外）
+    """
+    books_path = Path('./config/books.txt')
+    if not books_path.exists():
+        books_path = Path('./config/_books.txt')
+    isbn10s = [line.strip() for line in books_path.read_text().splitlines() if line.strip()]
+
+    texts, batch_size = [], get_config()['openbd']['batch_size']
+    for start in range(0, len(isbn10s), batch_size):
+        batch = isbn10s[start:start + batch_size]
+        for isbn10, openbd in zip(batch, get_jsons_from_openbd(isbn10s=batch)):
+            book = OpenBD.from_json(isbn10=isbn10, openbd=openbd, tokenizer=tokenizer)
+            if book.result == 'OK':
+                texts.append(book.get_description_text())
+    return texts
+
+
+class ChasenTokenizer():
+    """旧実装の前処理（OpenBD.get_std_infoで-Ochasen形式の解析結果を分割していた処理）
+    """
+
+    def __init__(self, mecab_args=MECAB_ARGS):
+        self.mecab = MeCab.Tagger('-Ochasen ' + mecab_args)
+
+    def tokenize_many(self, texts: List[str]) -> List[List[str]]:
+        words_list = []
+        for text in texts:
+            tmp_description = re.sub(r'[0-9]+', ' ', normalize(text))
+            words = []
+            for line in self.mecab.parse(tmp_description).splitlines():
+                chunks = line.split('\t')
+                if len(chunks) > 3 and (chunks[3].startswith('動詞') or chunks[3].startswith('形容詞') or chunks[3].startswith('名詞')):
+                    words.append(chunks[0])
+            words_list.append(words)
+        return words_list
+
+
+if __name__ == '__main__':
+    tokenizer = Tokenizer(mecab_args=MECAB_ARGS)
+    texts = load_descriptions(tokenizer=tokenizer)
+    logger.debug('書籍説明: {0}件 ({1:,}文字)'.format(len(texts), sum(len(text) for text in texts)))
+
+    chasen = ChasenTokenizer(mecab_args=MECAB_ARGS)
+    assert tokenizer.tokenize_many(texts) == chasen.tokenize_many(texts)    # 前処理結果が旧実装と一致することを確認
+
+    for name, impl in (('ChaSen出力の分割', chasen), ('Tokenizer', tokenizer)):
+        n_token, start = 0, time.perf_counter()
+        for _ in range(N_REPEAT):
+            n_token += sum(len(words) for words in impl.tokenize_many(texts))
+        elapsed = time.perf_counter() - start
+        logger.debug('{0:<16} | {1:.2f}s | {2:,.0f} tokens/s'.format(name, elapsed, n_token / elapsed))
@@ -0,0 +1,79 @@
+"""Doc2Vecモデル訓練のベンチマーク: 反復可能オブジェクト（documents） vs corpus_file形式 x ワーカー数
+
+分かち書き済コーパス（doc2vec.token_store）が構築済ならその書籍説明，なければZipf分布に従う合成コーパスで訓練する．
+ハイパーパラメータはconfig/config.ymlのdoc2vecを使用する．リポジトリのルートで実行する::
+
+    python -m backend.bench.training
+"""
+from logging import getLogger, StreamHandler, DEBUG, Formatter
+from typing import List
+from pathlib import Path
+import os
+import tempfile
+import time
+import numpy as np
+from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+from backend.tokenstore import get_token_store
+from config import get_config
+
+# ロガー設定
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+handler.setFormatter(Formatter('[shisho] %(message)s'))
+
+N_DOC = 20000       # 合成コーパスの書籍数
+N_VOCAB = 30000     # 合成コーパスの語彙数
+DOC_LENGTH = 120    # 合成コーパスの書籍説明単語数（平均）
+WORKERS = sorted({1, 2, 4, os.cpu_count()})     # ワーカー数
+
+
+def load_documents() -> List[TaggedDocument]:
+    """訓練用書籍説明の読み込み（分かち書き済コーパス or 合成コーパス）
+
+    Returns:
+        List[TaggedDocument]: 書籍説明文書（タグ: ISBN-10 or 通し番号）
+    """
+    token_store = get_token_store()
+    if (token_store is not None) and token_store.is_built():
+        logger.debug('分かち書き済コーパスを使用します: {}'.format(token_store.path))
+        return list(token_store)
+
+    logger.debug('合成コーパスを使用します (書籍数: {0}, 語彙数: {1})'.format(N_DOC, N_VOCAB))
+    rng = np.random.RandomState(0)
+    vocab = np.array(['w{}'.format(i) for i in range(N_VOCAB)])
+    return [TaggedDocument(vocab[(rng.zipf(1.2, size=rng.poisson(DOC_LENGTH)) - 1) % N_VOCAB].tolist(), [str(i)])
+            for i in range(N_DOC)]
+
+
+if __name__ == '__main__':
+    d2v_config = get_config()['doc2vec']    # Doc2Vec設定
+    documents = load_documents()
+    n_word = sum(len(doc.words) for doc in documents)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # corpus_file形式: 1行1書籍（行番号がタグ）
+        corpus_path = Path(tmp_dir) / 'corpus.txt'
+        with open(corpus_path, mode='w') as f:
+            f.writelines(' '.join(doc.words) + '\n' for doc in documents)
+
+        for mode in ('documents', 'corpus_file'):
+            for workers in WORKERS:
+                hyperparams = dict(dm=d2v_config['dm'], vector_size=d2v_config['vector_size'], epochs=d2v_config['epochs'],
+                                   min_count=d2v_config['min_count'], negative=d2v_config['negative'],
+                                   sample=d2v_config['sample'], workers=workers)
+                start = time.perf_counter()
+                if mode == 'documents':
+                    model = Doc2Vec(documents=documents, **hyperparams)
+                else:
+                    model = Doc2Vec(corpus_file=str(corpus_path), **hyperparams)
+                    # Doc2VecWrapperはcorpus_file形式のタグ（行番号 0..n-1）を書籍ISBN-10へ付け替えるため，その前提を確認
+                    assert list(model.dv.index_to_key) == list(range(len(documents)))
+                elapsed = time.perf_counter() - start
+
+                assert len(model.dv) == len(documents)
+                logger.debug('{0:<11} | workers: {1:>2} | {2:.1f}s | {3:,.0f} words/s'.format(
+                    mode, workers, elapsed, n_word * hyperparams['epochs'] / elapsed))
@@ -0,0 +1,175 @@
+from typing import Dict, Iterable, Tuple, Union
+from collections import OrderedDict
+from threading import Lock
+from pathlib import Path
+import os
+import sys
+import time
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from config import get_config
+
+_shared_cache = None    # プロセス共有書籍情報キャッシュ
+_shared_lock = Lock()   # 共有キャッシュ生成の排他制御
+
+
+class BookCache():
+    """書籍情報キャッシュ（LRU・TTL）
+
+    キーは（ISBN-10，取得フィールド）とし，書籍ごとに無効化できるようにする．
+    複数プロセス構成では無効化ログファイル（invalidation_log）に無効化したISBN-10を追記し，
+    各プロセスは参照時（最短poll_interval秒間隔）に他プロセスの追記分を読み込んで無効化する．
+    """
+
+    def __init__(self, max_size=4096, ttl=600.0, invalidation_log: Union[Path, None] = None, poll_interval=1.0):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            max_size (int, optional): 最大保持数（超過時は最も古く参照されたものから破棄）．Defaults to 4096.
+            ttl (float, optional): 有効期間（秒）．Defaults to 600.0.
+            invalidation_log (Union[Path, None], optional): プロセス間無効化ログファイルパス（None -> 単一プロセス）．Defaults to None.
+            poll_interval (float, optional): 無効化ログ確認間隔（秒）．Defaults to 1.0.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.invalidation_log = invalidation_log
+        self.poll_interval = poll_interval
+
+        self.__data = OrderedDict()     # (ISBN-10, 取得フィールド) -> (有効期限, 書籍情報)
+        self.__lock = Lock()
+        self.hits, self.misses, self.evictions, self.expirations = 0, 0, 0, 0
+
+        # 無効化ログは生成時点以降の追記分のみ反映
+        self.__log_offset = self.invalidation_log.stat().st_size if self.__has_log() else 0
+        self.__polled_at = time.monotonic()
+
+    def __has_log(self) -> bool:
+        """無効化ログファイル有無確認
+
+        Returns:
+            bool: 無効化ログファイルあり -> True
+        """
+        return self.invalidation_log is not None and self.invalidation_log.exists()
+
+    def __poll_invalidation_log(self) -> None:
+        """他プロセスによる無効化の反映（ロック取得済で呼び出すこと）
+        """
+        if self.invalidation_log is None:
+            return
+        now = time.monotonic()
+        if now - self.__polled_at < self.poll_interval:
+            return
+        self.__polled_at = now
+
+        if not self.__has_log() or self.invalidation_log.stat().st_size <= self.__log_offset:
+            return
+        with open(self.invalidation_log, 'rb') as f:
+            f.seek(self.__log_offset)
+            lines = f.readlines()
+        if len(lines) and not lines[-1].endswith(b'\n'):  # 追記途中の行は次回読み込み
+            lines = lines[:-1]
+        self.__log_offset += sum(len(line) for line in lines)
+        self.__discard({line.decode().strip() for line in lines})
+
+    def __discard(self, isbn10s: set) -> None:
+        """書籍情報の破棄（ロック取得済で呼び出すこと）
+
+        Args:
+            isbn10s (set): ISBN-10コード集合
+        """
+        for key in [key for key in self.__data if key[0] in isbn10s]:
+            del self.__data[key]
+
+    def get(self, isbn10: str, fields: Union[Tuple[str], None]) -> Union[Dict, None]:
+        """書籍情報取得
+
+        Args:
+            isbn10 (str): ISBN-10コード
+            fields (Union[Tuple[str], None]): 取得フィールド（None -> 全フィールド）
+
+        Returns:
+            Union[Dict, None]: 書籍情報（キャッシュなし・期限切れ -> None）
+        """
+        key = (isbn10, fields)
+        with self.__lock:
+            self.__poll_invalidation_log()
+            item = self.__data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[0] < time.monotonic():
+                del self.__data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, isbn10: str, fields: Union[Tuple[str], None], book: Dict) -> None:
+        """書籍情報登録
+
+        Args:
+            isbn10 (str): ISBN-10コード
+            fields (Union[Tuple[str], None]): 取得フィールド（None -> 全フィールド）
+            book (Dict): 書籍情報
+        """
+        key = (isbn10, fields)
+        with self.__lock:
+            self.__data[key] = (time.monotonic() + self.ttl, book)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.max_size:
+                self.__data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, isbn10s: Iterable[str]) -> None:
+        """書籍情報の無効化（書籍登録・削除時）
+
+        Args:
+            isbn10s (Iterable[str]): ISBN-10コードリスト
+        """
+        isbn10s = set(isbn10s)
+        with self.__lock:
+            self.__discard(isbn10s)
+
+        # 他プロセスへの通知（1行1書籍の追記）
+        if self.invalidation_log is not None and len(isbn10s):
+            fd = os.open(self.invalidation_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, ''.join('{}\n'.format(isbn10) for isbn10 in isbn10s).encode())
+            finally:
+                os.close(fd)
+
+    def clear(self) -> None:
+        """全書籍情報の破棄
+        """
+        with self.__lock:
+            self.__data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """キャッシュ統計取得
+
+        Returns:
+            Dict[str, int]: 保持数・ヒット数・ミス数・LRU破棄数・期限切れ数
+        """
+        with self.__lock:
+            return dict(size=len(self.__data), hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, expirations=self.expirations)
+
+
+def get_book_cache() -> BookCache:
+    """プロセス共有書籍情報キャッシュ取得（初回呼び出し時に生成）
+
+    Returns:
+        BookCache: 書籍情報キャッシュ
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                cache_config = get_config()['book_cache']   # 書籍情報キャッシュ設定
+                invalidation_log = cache_config['invalidation_log']
+                _shared_cache = BookCache(max_size=cache_config['max_size'], ttl=cache_config['ttl'],
+                                          invalidation_log=None if invalidation_log is None else Path(invalidation_log))
+    return _shared_cache
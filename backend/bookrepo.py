@@ -0,0 +1,75 @@
+from typing import Dict, List, Union
+from elasticsearch import Elasticsearch
+from backend.esclient import get_es
+from backend.bookcache import BookCache, get_book_cache
+
+CARD_FIELDS = ['isbn10', 'title', 'cover', 'authors', 'publisher']    # 書籍カード表示に用いる書籍情報
+
+
+class BookRepository():
+    """bookインデックスからの書籍情報取得（書籍情報キャッシュ経由）
+    """
+
+    def __init__(self, es: Union[Elasticsearch, None] = None, index='book', cache: Union[BookCache, None] = None):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            es (Union[Elasticsearch, None], optional): Elasticsearchクライアント（None -> 共有クライアント）．Defaults to None.
+            index (str, optional): インデックス名．Defaults to 'book'.
+            cache (Union[BookCache, None], optional): 書籍情報キャッシュ（None -> 共有キャッシュ）．Defaults to None.
+        """
+        self.es = get_es() if es is None else es
+        self.index = index
+        self.cache = get_book_cache() if cache is None else cache
+
+    def get(self, isbn10: str) -> Dict:
+        """書籍情報取得
+
+        Args:
+            isbn10 (str): ISBN-10コード
+
+        Returns:
+            Dict: 書籍情報（全フィールド）
+        """
+        book = self.cache.get(isbn10=isbn10, fields=None)
+        if book is None:
+            book = self.es.get_source(index=self.index, id=isbn10)
+            self.cache.put(isbn10=isbn10, fields=None, book=book)
+        return book
+
+    def mget(self, isbn10s: List[str], fields=CARD_FIELDS) -> List[Union[Dict, None]]:
+        """複数書籍情報の一括取得（キャッシュにない書籍のみ1往復）
+
+        Args:
+            isbn10s (List[str]): ISBN-10コードリスト
+            fields (List[str], optional): 取得フィールド（None -> 全フィールド）．Defaults to CARD_FIELDS.
+
+        Returns:
+            List[Union[Dict, None]]: 書籍情報リスト（isbn10sと同順，未登録・削除済書籍 -> None）
+        """
+        fields = None if fields is None else tuple(fields)
+        book_by_id = dict()
+        for isbn10 in dict.fromkeys(isbn10s):   # 重複除外（順序保持）
+            book = self.cache.get(isbn10=isbn10, fields=fields)
+            if book is not None:
+                book_by_id[isbn10] = book
+
+        # キャッシュにない書籍のみ一括取得
+        ids = [isbn10 for isbn10 in dict.fromkeys(isbn10s) if isbn10 not in book_by_id]
+        if len(ids):
+            params = {} if fields is None else {'_source_includes': ','.join(fields)}
+            docs = self.es.mget(index=self.index, body={'ids': ids}, params=params)['docs']
+            for doc in docs:
+                if doc.get('found'):
+                    book_by_id[doc['_id']] = doc['_source']
+                    self.cache.put(isbn10=doc['_id'], fields=fields, book=doc['_source'])
+
+        return [book_by_id.get(isbn10) for isbn10 in isbn10s]
+
+    def invalidate(self, isbn10s: List[str]) -> None:
+        """書籍情報キャッシュの無効化（書籍登録・削除時）
+
+        Args:
+            isbn10s (List[str]): ISBN-10コードリスト
+        """
+        self.cache.invalidate(isbn10s=isbn10s)
@@ -0,0 +1,187 @@
+from typing import Dict
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+import numpy as np
+
+_shared_book_mat = None     # ワーカープロセス内の書籍表現行列（メモリマップ）
+
+
+def calc_row_cossim(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    """行ごとのコサイン類似度計算
+
+    Args:
+        X (np.ndarray): 行列1（行数 x 次元）
+        Y (np.ndarray): 行列2（行数 x 次元）
+
+    Returns:
+        np.ndarray: 各行のコサイン類似度
+    """
+    return np.einsum('ij,ij->i', X, Y) / (np.linalg.norm(X, axis=1) * np.linalg.norm(Y, axis=1))
+
+
+def learn_reps(uIdx: np.ndarray, sIds: np.ndarray, bIdx: np.ndarray, is_last: np.ndarray, log_ids: np.ndarray,
+               book_mat: np.ndarray, context_size: int) -> Dict[str, np.ndarray]:
+    """閲覧履歴からのセッション・ユーザ表現一括構築（ProposalUser.update_repsの逐次反映と同じ結果）
+
+    セッション表現の漸化式はセッション内の位置ごとに全セッション一括で計算する．
+    ユーザ表現の更新は直前のユーザ表現に依存しないため，各ユーザの最後のセッション末尾ログについてのみ計算する．
+    入力は書籍表現を持つログのみとし，(uIdx, log_ids)の昇順に並べておくこと．
+
+    Args:
+        uIdx (np.ndarray): ユーザ番号
+        sIds (np.ndarray): セッションID
+        bIdx (np.ndarray): 書籍番号（book_matの行番号）
+        is_last (np.ndarray): セッション末尾ログフラグ
+        log_ids (np.ndarray): ログID
+        book_mat (np.ndarray): 書籍表現行列
+        context_size (int): コンテキストセッション数
+
+    Returns:
+        Dict[str, np.ndarray]: ユーザごとの構築結果
+            - uIdx: ログを反映したユーザ番号（昇順）
+            - session_mat, session_head, n_session: セッション表現リングバッファ（UserRepStoreと同じ配置）
+            - latest_sIds, prv_bIdx: 最新セッションID，直前閲覧書籍番号
+            - open_log_ids: セッション末尾未確定ログID（確定済 -> -1）
+            - rep_uIdx, user_reps, first_rep_log_ids: ユーザ表現構築済ユーザ番号，ユーザ表現，初回構築ログID
+    """
+    dim = book_mat.shape[1]
+
+    # 直前と同じ書籍のログを除外（ユーザ先頭ログは常に反映）
+    is_head = np.ones(len(uIdx), dtype=bool)
+    is_head[1:] = uIdx[1:] != uIdx[:-1]
+    keep = is_head.copy()
+    keep[1:] |= bIdx[1:] != bIdx[:-1]
+    uIdx, sIds, bIdx, is_last, log_ids, is_head = uIdx[keep], sIds[keep], bIdx[keep], is_last[keep], log_ids[keep], is_head[keep]
+    n_log = len(uIdx)
+
+    # セッション分割: ユーザ先頭 or 直前ログとセッションIDが異なる -> 新規セッション
+    is_new_session = is_head.copy()
+    is_new_session[1:] |= sIds[1:] != sIds[:-1]
+    session = np.cumsum(is_new_session) - 1                     # セッション通し番号
+    session_start = np.flatnonzero(is_new_session)              # セッション先頭ログ位置
+    pos = np.arange(n_log) - session_start[session]             # セッション内位置
+
+    user_start = np.flatnonzero(is_head)                                    # ユーザ先頭ログ位置
+    user_of_log = np.cumsum(is_head) - 1                                    # ユーザ通し番号
+    first_session_of_user = session[user_start]                             # ユーザ先頭セッション通し番号
+    ordinal = session - first_session_of_user[user_of_log]                  # ユーザ内セッション番号
+    user_end = np.append(user_start[1:], n_log)[:len(user_start)] - 1       # ユーザ末尾ログ位置
+    n_user_session = session[user_end] - first_session_of_user + 1          # ユーザごとのセッション数
+
+    # ユーザ表現の構築/更新に使うセッション末尾ログ: ユーザごとに初回（構築順）と最終（最終的なユーザ表現）
+    event = np.flatnonzero(is_last)
+    event_user = user_of_log[event]
+    has_rep = np.zeros(len(user_start), dtype=bool)
+    has_rep[event_user] = True
+    rep_users = np.flatnonzero(has_rep)
+    first_event = event[np.searchsorted(event_user, rep_users, side='left')]
+    last_event = event[np.searchsorted(event_user, rep_users, side='right') - 1]
+    event_slot = np.full(n_log, -1, dtype=np.int64)    # 最終セッション末尾ログ -> 記録先
+    event_slot[last_event] = np.arange(len(last_event))
+
+    # セッション表現の漸化式（セッション内位置ごとに一括計算）
+    session_reps = np.zeros((len(session_start), dim), dtype=np.float32)
+    latest_reps = np.zeros((len(last_event), dim), dtype=np.float32)
+    order = np.argsort(pos, kind='stable')
+    bounds = np.searchsorted(pos[order], np.arange(pos.max() + 2)) if n_log else np.zeros(1, dtype=np.int64)
+    for t in range(len(bounds) - 1):
+        logs = order[bounds[t]:bounds[t + 1]]
+        book_reps = book_mat[bIdx[logs]]
+        if t == 0:  # 新規セッション -> 出現書籍表現により構築
+            reps = book_reps
+        else:       # セッション表現更新: 重み|cos| x 最新セッション表現 + 出現書籍表現
+            prv_reps = session_reps[session[logs]]
+            reps = np.abs(calc_row_cossim(prv_reps, book_reps))[:, np.newaxis] * prv_reps + book_reps
+        session_reps[session[logs]] = reps
+        recorded = logs[event_slot[logs] >= 0]  # 最終セッション末尾ログ時点のセッション表現
+        latest_reps[event_slot[recorded]] = session_reps[session[recorded]]
+
+    # コンテキストセッション表現（リングバッファ配置）: 位置pには p ≡ ユーザ内セッション番号 (mod context_size) のセッション
+    def get_ring(users: np.ndarray, latest_ordinal: np.ndarray):
+        ring_ordinal = latest_ordinal[:, np.newaxis] - ((latest_ordinal[:, np.newaxis] - np.arange(context_size)) % context_size)
+        is_valid = ring_ordinal >= 0
+        ring = session_reps[first_session_of_user[users][:, np.newaxis] + np.maximum(ring_ordinal, 0)]
+        ring[~is_valid] = 0
+        return ring, is_valid, ring_ordinal
+
+    # ユーザ表現: 初回 -> 最新セッション表現，2回目以降 -> コンテキストセッション表現の加重平均（重み: 最新セッション表現との|cos|）
+    context_reps, is_valid, ring_ordinal = get_ring(rep_users, ordinal[last_event])
+    context_reps[ring_ordinal == ordinal[last_event][:, np.newaxis]] = latest_reps     # 最新セッションはその時点の値
+    norms = np.linalg.norm(context_reps, axis=2) * np.linalg.norm(latest_reps, axis=1)[:, np.newaxis]
+    weights = np.where(is_valid, np.abs(np.einsum('ijk,ik->ij', context_reps, latest_reps)) / np.where(is_valid, norms, 1), 0)
+    user_reps = np.einsum('ij,ijk->ik', weights, context_reps) / weights.sum(axis=1)[:, np.newaxis]
+    is_first = first_event == last_event
+    user_reps[is_first] = latest_reps[is_first]
+
+    # セッション表現リングバッファ（最終値）
+    all_users = np.arange(len(user_start))
+    ring, _, _ = get_ring(all_users, n_user_session - 1)
+
+    return dict(uIdx=uIdx[user_start], session_mat=ring, session_head=(n_user_session - 1) % context_size,
+                n_session=np.minimum(n_user_session, context_size), latest_sIds=sIds[user_end], prv_bIdx=bIdx[user_end],
+                open_log_ids=np.where(is_last[user_end], -1, log_ids[user_end]),
+                rep_uIdx=uIdx[user_start[rep_users]], user_reps=user_reps.astype(np.float32), first_rep_log_ids=log_ids[first_event])
+
+
+def _init_worker(book_mat_path: str) -> None:
+    """ワーカープロセス初期化（書籍表現行列をメモリマップで共有）
+
+    Args:
+        book_mat_path (str): 書籍表現行列（.npy）パス
+    """
+    global _shared_book_mat
+    _shared_book_mat = np.load(book_mat_path, mmap_mode='r')
+
+
+def _learn_shard(shard: Dict[str, np.ndarray], context_size: int) -> Dict[str, np.ndarray]:
+    """シャード単位の一括構築（ワーカープロセスで実行）
+
+    Args:
+        shard (Dict[str, np.ndarray]): シャードに含まれるログ（learn_repsの入力）
+        context_size (int): コンテキストセッション数
+
+    Returns:
+        Dict[str, np.ndarray]: learn_repsによる構築結果
+    """
+    return learn_reps(book_mat=_shared_book_mat, context_size=context_size, **shard)
+
+
+def learn_reps_parallel(uIdx: np.ndarray, sIds: np.ndarray, bIdx: np.ndarray, is_last: np.ndarray, log_ids: np.ndarray,
+                        book_mat: np.ndarray, context_size: int, n_workers: int) -> Dict[str, np.ndarray]:
+    """ユーザ単位でシャーディングした並列一括構築（learn_repsと同じ結果）
+
+    ログ数がほぼ均等になるようにユーザ境界でn_workers個のシャードに分割し，プロセスプールで並列にlearn_repsを実行する．
+    書籍表現行列は一時ファイル（.npy）経由でメモリマップにより各ワーカーと共有する．
+    シャードはユーザ番号順に連続しているため，結果をシャード順に連結すれば出力は決定的となる．
+
+    Args:
+        uIdx (np.ndarray): ユーザ番号
+        sIds (np.ndarray): セッションID
+        bIdx (np.ndarray): 書籍番号（book_matの行番号）
+        is_last (np.ndarray): セッション末尾ログフラグ
+        log_ids (np.ndarray): ログID
+        book_mat (np.ndarray): 書籍表現行列
+        context_size (int): コンテキストセッション数
+        n_workers (int): ワーカープロセス数
+
+    Returns:
+        Dict[str, np.ndarray]: ユーザごとの構築結果（learn_repsと同じ形式）
+    """
+    logs = dict(uIdx=uIdx, sIds=sIds, bIdx=bIdx, is_last=is_last, log_ids=log_ids)
+    if n_workers <= 1 or len(uIdx) == 0:
+        return learn_reps(book_mat=book_mat, context_size=context_size, **logs)
+
+    # ログ数の分位点に最も近いユーザ境界でシャード分割
+    user_start = np.flatnonzero(np.append(True, uIdx[1:] != uIdx[:-1]))
+    targets = np.linspace(0, len(uIdx), n_workers + 1)[1:-1]
+    bounds = np.unique(np.concatenate([[0], user_start[np.minimum(np.searchsorted(user_start, targets), len(user_start) - 1)], [len(uIdx)]]))
+    shards = [{key: val[start:end] for key, val in logs.items()} for start, end in zip(bounds[:-1], bounds[1:])]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        book_mat_path = Path(tmp_dir) / 'book_mat.npy'
+        np.save(book_mat_path, np.ascontiguousarray(book_mat, dtype=np.float32))
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(str(book_mat_path),)) as executor:
+            results = list(executor.map(_learn_shard, shards, [context_size] * len(shards)))
+
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
@@ -0,0 +1,108 @@
+from typing import Iterator, List, Tuple, Union
+from pathlib import Path
+import os
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan
+from gensim.models.doc2vec import TaggedDocument
+from backend.esclient import get_es
+
+
+def split_description(description: str) -> List[str]:
+    """書籍説明（分かち書き済）の単語リスト化（訓練・推論で共通）
+
+    Args:
+        description (str): 書籍説明（OpenBD.get_std_infoにより空白区切りで分かち書き済）
+
+    Returns:
+        List[str]: 単語リスト
+    """
+    return description.split()
+
+
+class BookCorpus():
+    """bookインデックスの書籍説明コーパス（gensim用の反復可能オブジェクト）
+
+    反復ごとにbookインデックスをスクロールで少しずつ読み込むため，全書籍を一度にメモリへ載せない．
+    cache_pathを指定した場合は初回反復時にgensimのcorpus_file形式（1行1書籍・空白区切り）で書き出し，
+    以降の反復（エポック）はファイルから読み込む（タグ = ISBN-10は行順にcache_path.keysへ保存）．
+    単語を含まない書籍説明はコーパスから除外する（corpus_file形式の行番号とタグの対応を保つため）．
+    """
+
+    def __init__(self, es: Union[Elasticsearch, None] = None, index='book', cache_path: Union[Path, None] = None, batch_size=1000):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            es (Union[Elasticsearch, None], optional): Elasticsearchクライアント（None -> 共有クライアント）．Defaults to None.
+            index (str, optional): インデックス名．Defaults to 'book'.
+            cache_path (Union[Path, None], optional): コーパスキャッシュ（corpus_file形式）パス（None -> 毎回スクロール）．Defaults to None.
+            batch_size (int, optional): スクロール1回あたりの取得書籍数．Defaults to 1000.
+        """
+        self.es = get_es() if es is None else es
+        self.index = index
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.keys = None    # キャッシュ書き出し済 -> 行順のタグ（ISBN-10）リスト
+
+    @staticmethod
+    def get_keys_path(corpus_path: Path) -> Path:
+        """タグ（ISBN-10）リストファイルパス取得
+
+        Args:
+            corpus_path (Path): コーパスファイルパス
+
+        Returns:
+            Path: タグリストファイルパス
+        """
+        return corpus_path.with_name(corpus_path.name + '.keys')
+
+    def iter_words(self) -> Iterator[Tuple[str, List[str]]]:
+        """bookインデックスのスクロール読み込み（書籍説明のみ取得）
+
+        Yields:
+            Iterator[Tuple[str, List[str]]]: (ISBN-10, 書籍説明単語リスト)
+        """
+        query = {'_source': ['description'], 'query': {'match_all': {}}}
+        for hit in scan(self.es, index=self.index, query=query, size=self.batch_size):
+            words = split_description(hit['_source'].get('description', ''))
+            if len(words):
+                yield hit['_id'], words
+
+    def export(self, corpus_path: Path) -> List[str]:
+        """corpus_file形式での書き出し（一時ファイルへ書き込み後に置換）
+
+        Args:
+            corpus_path (Path): コーパスファイルパス
+
+        Returns:
+            List[str]: 行順のタグ（ISBN-10）リスト
+        """
+        keys = []
+        tmp_path = corpus_path.with_name(corpus_path.name + '.tmp')
+        with open(tmp_path, mode='w') as f:
+            for isbn10, words in self.iter_words():
+                f.write(' '.join(words) + '\n')
+                keys.append(isbn10)
+
+        keys_path = self.get_keys_path(corpus_path)
+        keys_tmp_path = keys_path.with_name(keys_path.name + '.tmp')
+        keys_tmp_path.write_text(''.join('{}\n'.format(isbn10) for isbn10 in keys))
+        os.replace(tmp_path, corpus_path)
+        os.replace(keys_tmp_path, keys_path)
+        return keys
+
+    def __iter__(self) -> Iterator[TaggedDocument]:
+        """書籍説明の反復（タグ: ISBN-10）
+
+        Yields:
+            Iterator[TaggedDocument]: 書籍説明文書
+        """
+        if self.cache_path is None:
+            for isbn10, words in self.iter_words():
+                yield TaggedDocument(words, [isbn10])
+            return
+
+        if self.keys is None:
+            self.keys = self.export(corpus_path=self.cache_path)
+        with open(self.cache_path) as f:
+            for isbn10, line in zip(self.keys, f):
+                yield TaggedDocument(line.split(), [isbn10])
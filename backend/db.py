@@ -10,11 +10,11 @@ import string
 import pandas as pd
 import numpy as np
 
-from datetime import datetime as dt
+from datetime import datetime as dt, timedelta
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker, relationship
 from sqlalchemy.sql.functions import current_timestamp
-from sqlalchemy import Column, String, Integer, create_engine, TIMESTAMP, text, ForeignKey, Boolean
+from sqlalchemy import Column, String, Integer, create_engine, TIMESTAMP, text, ForeignKey, Boolean, case, func
 from flask_login import UserMixin
 from flask_bcrypt import Bcrypt
 
@@ -150,17 +150,34 @@ def get_user_history(user: LoginUser) -> Dict[int, Dict[int, Union[int, str, dt]
     return user_history
 
 
-def get_history_df() -> pd.core.frame.DataFrame:
+def get_history_df(min_id=0) -> pd.core.frame.DataFrame:
     """書籍情報閲覧履歴をデータフレームに変換して取得
 
+    Args:
+        min_id (int, optional): 取得するログIDの下限（このIDより大きいログのみ取得）．Defaults to 0.
+
     Returns:
         pd.core.frame.DataFrame: データフレーム形式 書籍情報閲覧履歴
     """
-    sql = "SELECT * FROM histories"                                     # 書籍情報 全閲覧履歴
-    history_df = pd.read_sql_query(sql=sql, con=ENGINE, index_col='id')  # SQLからデータフレーム読み込み
+    sql = text("SELECT * FROM histories WHERE id > :min_id ORDER BY id")    # 書籍情報 閲覧履歴（ログID順）
+    history_df = pd.read_sql_query(sql=sql, con=ENGINE, index_col='id', params={'min_id': min_id})  # SQLからデータフレーム読み込み
     return history_df
 
 
+def get_closed_history_df(ids: List[int]) -> pd.core.frame.DataFrame:
+    """指定ログのうちセッション末尾として確定したログをデータフレームに変換して取得
+
+    Args:
+        ids (List[int]): ログID
+
+    Returns:
+        pd.core.frame.DataFrame: データフレーム形式 セッション末尾確定ログ
+    """
+    query = History.query.filter(History.id.in_(ids), History.isLast.is_(True)).order_by(History.id)
+    closed_df = pd.read_sql_query(sql=query.statement, con=ENGINE, index_col='id')
+    return closed_df
+
+
 def change_session(user: LoginUser) -> History:
     """セッション変更
 
@@ -179,24 +196,39 @@ def change_session(user: LoginUser) -> History:
     return last_log
 
 
-def update_session(change_limit_minutes: int) -> None:
-    """セッション更新（変更有無確認）
+def update_session(change_limit_minutes: int) -> List[str]:
+    """セッション更新（最終アクティブ時刻から上限時間以上経過したユーザのセッションを一括変更）
 
     Args:
         change_limit_minutes (int): セッション変更上限時刻（現在時刻と最終アクティブ時刻の差）
+
+    Returns:
+        List[str]: セッションを変更したユーザID
     """
-    cts = dt.now()              # 現在時刻
-    users = User.query.all()    # 全ユーザ
+    threshold = dt.now() - timedelta(minutes=change_limit_minutes)  # 最終アクティブ時刻の上限
 
-    for user in users:
-        if user.changed_sId:
-            # セッション変更済 -> 再変更しない
-            continue
+    try:
+        # セッション未変更＆上限オーバーのユーザ（変更完了まで行ロック）
+        rows = session.query(User.uId).filter(User.changed_sId.is_(False), User.active_at <= threshold).with_for_update().all()
+        uIds = [uId for uId, in rows]
+        if not len(uIds):
+            session.commit()
+            return uIds
+
+        # セッションID一括変更
+        session.query(User).filter(User.uId.in_(uIds)).update(
+            {User.sId: case({uId: get_sId() for uId in uIds}, value=User.uId), User.changed_sId: True}, synchronize_session=False)
+
+        # セッション末尾ログフラグ一括設定（各ユーザの最新ログ）
+        # MySQLは更新対象テーブルをサブクエリで参照できないため，最新ログIDを取得してから更新
+        last_log_ids = [log_id for log_id, in session.query(func.max(History.id)).filter(History.uId.in_(uIds)).group_by(History.uId)]
+        session.query(History).filter(History.id.in_(last_log_ids)).update({History.isLast: True}, synchronize_session=False)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
 
-        time_diff_minutes = (cts - user.active_at).seconds // 60    # 時間差（分単位）
-        if time_diff_minutes >= change_limit_minutes:
-            # 上限オーバー -> セッション変更
-            change_session(user=user)
+    return uIds
 
 
 def get_guest_uIds() -> List[str]:
@@ -207,7 +239,7 @@ def get_guest_uIds() -> List[str]:
 def insert_user_and_history_for_debug() -> None:
     """デバッグ用ユーザ/閲覧履歴のDB各テーブルへの挿入
     """
-    from elasticsearch import Elasticsearch
+    from backend.esclient import get_es
 
     def get_random_bId() -> str:
         """書籍ID（ISBN-10）のランダム習得
@@ -215,11 +247,10 @@ def insert_user_and_history_for_debug() -> None:
         Returns:
             str: 書籍ID（ISBN-10）
         """
-        es = Elasticsearch('elasticsearch')
+        es = get_es()
         es_params = {'size': 1}
         body = {'query': {'function_score': {"query": {"match_all": {}}, "random_score": {}}}}
         bId = es.search(index='book', body=body, params=es_params)['hits']['hits'][0]['_source']['isbn10']
-        es.close()
         return bId
 
     config = get_config()                   # 司書設定
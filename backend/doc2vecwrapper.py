@@ -1,9 +1,21 @@
 from logging import getLogger, StreamHandler, DEBUG, Formatter
-from typing import List, Tuple
+from typing import List, Tuple, Union
 from pathlib import Path
-from elasticsearch import Elasticsearch
-import MeCab
-from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+import os
+from threading import Lock
+import sys
+import time
+import numpy as np
+from gensim.models import KeyedVectors
+from gensim.models.doc2vec import Doc2Vec
+from backend.corpus import BookCorpus, split_description
+from backend.bookrepo import BookRepository
+from backend.tokenstore import get_token_store
+from backend.knn import calc_similar_table, select_top_k
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from config import get_config
 
 # ロガー設定
 logger = getLogger(__name__)
@@ -24,6 +36,15 @@ class Doc2VecWrapper():
             initialize (bool, optional): モデル初期化時->True．Defaults to False.
         """
         self.model_path = model_path    # モデルファイルパス
+        self.model = None               # モデル（推論・訓練時のみ読み込み）
+        self.__model_lock = Lock()      # モデル遅延読み込みの排他制御
+        self.sim_path = model_path.with_name(model_path.stem + '.sim.npz')  # 類似書籍テーブルパス（モデルと同じディレクトリ）
+        self.sim_scores, self.sim_idx = None, None                          # 類似書籍テーブル（類似度，書籍番号）
+        self.deleted_path = model_path.with_name(model_path.stem + '.deleted.txt')  # 削除書籍（トゥームストーン）ファイルパス
+        self.deleted = set()                                                        # 削除書籍ISBN-10集合（次回再訓練まで推薦対象外）
+        self.n_unsaved = 0  # 未保存の追加書籍数（persist_every冊ごとにflush）
+        self.added = dict()         # 追加書籍 ISBN-10 -> (追加時刻, 書籍説明)（再訓練中に追加された書籍の引き継ぎ用）
+        self.trained_at = None      # 訓練開始時刻（訓練コーパス取得前，これ以降の追加書籍は訓練コーパスに含まれない場合がある）
 
         # 非初期化指定＆モデルパス先存在 -> 訓練済みとする
         if (not initialize) and self.model_path.exists():
@@ -35,18 +56,113 @@ class Doc2VecWrapper():
         if self.is_trained:
             self.__load_model()
 
-        # MeCab設定: NEologd（MeCab用システム辞書）を使った分かち書き
-        self.mecab = MeCab.Tagger('-Ochasen -r /etc/mecabrc -d /usr/lib/x86_64-linux-gnu/mecab/dic/mecab-ipadic-neologd')
+    def __get_export_paths(self, name: str) -> Tuple[Path, Path]:
+        """推論用エクスポート（ベクトル・キー）パス取得
+
+        Args:
+            name (str): ベクトル名（dv: 書籍ベクトル，wv: 単語ベクトル）
+
+        Returns:
+            Tuple[Path, Path]: (ベクトル（.npy）パス，キー（1行1キー）パス)
+        """
+        stem = '{0}.{1}'.format(self.model_path.stem, name)
+        return self.model_path.with_name(stem + '.npy'), self.model_path.with_name(stem + '.keys')
+
+    def __export(self, names=('dv', 'wv')) -> None:
+        """推論用エクスポート（書籍ベクトル・単語ベクトルとキーのみ，一時ファイルへ書き込み後に置換）
+
+        Args:
+            names (tuple, optional): エクスポートするベクトル名．Defaults to ('dv', 'wv').
+        """
+        for name, kv in {'dv': self.bv, 'wv': self.wv}.items():
+            if name not in names:
+                continue
+            vectors_path, keys_path = self.__get_export_paths(name=name)
+            vectors_tmp_path, keys_tmp_path = (path.with_name(path.name + '.tmp') for path in (vectors_path, keys_path))
+            with open(vectors_tmp_path, mode='wb') as f:
+                np.save(f, np.asarray(kv.vectors, dtype=np.float32))
+            keys_tmp_path.write_text(''.join('{}\n'.format(key) for key in kv.index_to_key))
+            os.replace(vectors_tmp_path, vectors_path)
+            os.replace(keys_tmp_path, keys_path)
+
+    def __load_export(self, name: str) -> Union[KeyedVectors, None]:
+        """推論用エクスポートの読み込み（ベクトルはメモリマップ: 複数プロセスでOSのページキャッシュを共有）
+
+        Args:
+            name (str): ベクトル名（dv: 書籍ベクトル，wv: 単語ベクトル）
+
+        Returns:
+            Union[KeyedVectors, None]: ベクトル（エクスポートなし -> None）
+        """
+        vectors_path, keys_path = self.__get_export_paths(name=name)
+        if not (vectors_path.exists() and keys_path.exists()):
+            return None
+        vectors = np.load(vectors_path, mmap_mode='r')
+        kv = KeyedVectors(vector_size=vectors.shape[1])
+        kv.vectors = vectors
+        kv.index_to_key = keys_path.read_text().split('\n')[:len(vectors)]
+        kv.key_to_index = {key: idx for idx, key in enumerate(kv.index_to_key)}
+        return kv
+
+    def __get_model(self) -> Doc2Vec:
+        """モデル取得（未読み込み -> 読み込み，推論時のみ使用）
+
+        分割保存された大きな配列（単語ベクトル・出力層重みなど）は読み込み専用でメモリマップし，
+        各Webワーカーが複製を持たないようにする（推論では書き換えない）．
+
+        Returns:
+            Doc2Vec: モデル
+        """
+        with self.__model_lock:
+            if self.model is None:
+                self.model = Doc2Vec.load(str(self.model_path), mmap='r')
+        return self.model
 
     def __load_model(self) -> None:
-        """モデル読み込み
+        """モデル読み込み（推論用エクスポートあり -> 書籍・単語ベクトルのみメモリマップ，なし -> モデル全体を読み込みエクスポート）
         """
-        self.model = Doc2Vec.load(str(self.model_path))  # モデル
-        self.wv = self.model.wv
-        self.bv = self.model.dv  # 書籍ベクトル: Doc2Vecで学習された文書ベクトル
+        self.bv = self.__load_export(name='dv')  # 書籍ベクトル: Doc2Vecで学習された文書ベクトル
+        self.wv = self.__load_export(name='wv')  # 単語ベクトル
+        if (self.bv is None) or (self.wv is None):
+            # エクスポートなし（or 単語ベクトルなしの旧形式） -> モデル全体から一度だけエクスポートしてメモリマップで読み直す
+            model = self.__get_model()
+            self.bv, self.wv = model.dv, model.wv
+            self.__export()
+            self.model = None   # モデル本体は推論時に遅延読み込み
+            self.bv, self.wv = self.__load_export(name='dv'), self.__load_export(name='wv')
+        self.__load_similar_table()
+        if self.deleted_path.exists():
+            self.deleted = set(self.deleted_path.read_text().split()) & set(self.bv.key_to_index)
+
+    def __build_similar_table(self) -> None:
+        """類似書籍テーブル構築・保存（全書籍について類似上位similar_topn冊を事前計算）
+        """
+        d2v_config = get_config()['doc2vec']    # Doc2Vec設定
+        self.sim_scores, self.sim_idx = calc_similar_table(self.bv.vectors, n_neighbors=d2v_config['similar_topn'],
+                                                           block_size=d2v_config['similar_block_size'])
+        self.__save_similar_table()
+
+    def __save_similar_table(self) -> None:
+        """類似書籍テーブル保存（一時ファイルへ書き込み後に置換）
+        """
+        tmp_path = self.sim_path.with_name(self.sim_path.name + '.tmp')
+        with open(tmp_path, mode='wb') as f:
+            np.savez(f, keys=np.array(self.bv.index_to_key, dtype=str), sim_scores=self.sim_scores, sim_idx=self.sim_idx)
+        os.replace(tmp_path, self.sim_path)
+        logger.debug('類似書籍テーブルを保存しました (書籍数: {0})'.format(len(self.sim_idx)))
+
+    def __load_similar_table(self) -> None:
+        """類似書籍テーブル読み込み（存在しない or モデルと書籍が一致しない -> 再構築）
+        """
+        if self.sim_path.exists():
+            with np.load(self.sim_path) as table:
+                if table['keys'].tolist() == list(self.bv.index_to_key):
+                    self.sim_scores, self.sim_idx = table['sim_scores'], table['sim_idx']
+                    return
+        self.__build_similar_table()
 
     def get_title_from_isbn10(self, isbn10: str) -> str:
-        """ISBN-10から書籍タイトル取得（Elasticsearch経由）
+        """ISBN-10から書籍タイトル取得（書籍情報キャッシュ・Elasticsearch経由）
 
         Args:
             isbn10 (str): ISBN-10コード
@@ -54,9 +170,7 @@ class Doc2VecWrapper():
         Returns:
             str: 書籍タイトル
         """
-        es = Elasticsearch('elasticsearch')
-        title = es.get_source(index="book", id=isbn10)['title']
-        es.close()
+        title = BookRepository().get(isbn10=isbn10)['title']
 
         return title
 
@@ -72,27 +186,200 @@ class Doc2VecWrapper():
         # 非再訓練指定＆訓練済み -> エラーとする
         if (not retrain) and self.is_trained:
             return False
+        self.trained_at = time.time()
 
-        # 全書籍情報取得
-        es = Elasticsearch('elasticsearch')
-        n_book = es.count(index='book')['count']    # 登録書籍総数
-        books = es.search(index='book', size=n_book)['hits']['hits']
-        es.close()
+        d2v_config = get_config()['doc2vec']    # Doc2Vec設定
+        hyperparams = dict(dm=d2v_config['dm'], vector_size=d2v_config['vector_size'], epochs=d2v_config['epochs'],
+                           min_count=d2v_config['min_count'], negative=d2v_config['negative'], sample=d2v_config['sample'],
+                           workers=d2v_config['workers'] or os.cpu_count())    # workers: 0 -> 全コア
+        corpus_cache = d2v_config['corpus_cache']   # コーパスキャッシュパス（None -> エポックごとにスクロール）
 
-        # Doc2Vec学習データ準備
-        data = [(book['_id'], book['_source']['description']) for book in books]  # ISBN-10と書籍説明取得
-        documents = [TaggedDocument(dscrp, [isbn10]) for isbn10, dscrp in data]  # ISBN-10を文書（書籍説明）のタグとする
+        # 分かち書き済コーパスあり -> bookインデックスを読まずに訓練（未構築の場合のみbookインデックスから構築）
+        token_store = get_token_store()
+        if token_store is not None:
+            if token_store.is_built():
+                token_store.compact()   # 置換・削除済書籍の除去
+            else:
+                token_store.rebuild(items=BookCorpus().iter_words())
 
         # Doc2Vecモデルの訓練・保存
-        # パラメータは暫定値 <- 詳細検証予定
-        self.model = Doc2Vec(documents=documents, dm=0, vector_size=100, min_count=1, epochs=30)
+        if d2v_config['corpus_file']:
+            # corpus_file形式: コーパスをローカルファイルへ書き出し -> ワーカースレッドがファイルを分担して読み込み（GILの影響を受けない）
+            corpus_path = self.model_path.with_name(self.model_path.stem + '.corpus.txt') if corpus_cache is None else Path(corpus_cache)
+            keys = (BookCorpus() if token_store is None else token_store).export(corpus_path=corpus_path)
+            self.model = Doc2Vec(corpus_file=str(corpus_path), **hyperparams)
+            self.__remap_tags(keys=keys)    # 行番号タグ -> ISBN-10
+        else:
+            # 反復可能オブジェクト: 書籍説明を分かち書き済コーパス or bookインデックスから逐次読み込み（ISBN-10を文書（書籍説明）のタグとする）
+            if token_store is None:
+                documents = BookCorpus(cache_path=None if corpus_cache is None else Path(corpus_cache))
+            else:
+                documents = token_store
+            self.model = Doc2Vec(documents=documents, **hyperparams)
         self.model.save(str(self.model_path))
 
         self.wv = self.model.wv  # 学習済み単語ベクトル (Word Vectors)
         self.bv = self.model.dv  # 学習済み書籍ベクトル（Document (paragraph) Vectors）
+        self.__export()
+        self.__build_similar_table()
+        self.deleted = set()    # 削除書籍は訓練データに含まれない（トゥームストーンのコンパクション）
+        self.deleted_path.write_text('')
+        self.is_trained = True
 
         return True
 
+    def add_book(self, isbn10: str, description: str) -> np.ndarray:
+        """新規登録書籍の書籍ベクトル推論・追加（再訓練なし）
+
+        書籍説明から推論した書籍ベクトルを書籍ベクトルに追加し，類似書籍テーブルに追加書籍の行を追加する．
+        既存書籍の行は追加書籍の方が類似する場合のみ差し込む．
+        ノルムは追加書籍分のみ更新し，推論用エクスポート・類似書籍テーブルの保存はpersist_every冊ごとにまとめて行う（flush）．
+
+        Args:
+            isbn10 (str): ISBN-10コード
+            description (str): 書籍説明（分かち書き済）
+
+        Returns:
+            np.ndarray: 推論した書籍ベクトル
+        """
+        book_rep = self.__get_model().infer_vector(split_description(description))
+        if isbn10 in self.deleted:  # 削除後の再登録 -> トゥームストーン解除
+            self.deleted.discard(isbn10)
+            self.deleted_path.write_text(''.join('{}\n'.format(bId) for bId in self.deleted))
+
+        self.bv.fill_norms()    # 未計算時のみ全書籍分を計算（以降は差分更新）
+        norm = np.linalg.norm(book_rep).astype(self.bv.norms.dtype)
+        bIdx = self.bv.key_to_index.get(isbn10)
+        if bIdx is None:    # 新規書籍 -> 末尾に追加（add_vectorはノルムを更新しない）
+            self.bv.add_vector(isbn10, book_rep)
+            bIdx = self.bv.key_to_index[isbn10]
+            self.bv.norms = np.append(self.bv.norms, norm)
+        else:               # 登録済書籍（再登録） -> 書籍ベクトル置換（メモリマップは読み込み専用のため複製）
+            if not self.bv.vectors.flags.writeable:
+                self.bv.vectors = np.array(self.bv.vectors)
+            self.bv.vectors[bIdx] = book_rep
+            self.bv.norms[bIdx] = norm
+
+        if self.sim_idx is not None:
+            self.__add_to_similar_table(bIdx=bIdx)
+        self.added[isbn10] = (time.time(), description)
+        self.n_unsaved += 1
+        if self.n_unsaved >= get_config()['doc2vec']['persist_every']:
+            self.flush()
+        return book_rep
+
+    def flush(self) -> None:
+        """追加書籍の保存（書籍ベクトルの推論用エクスポート・類似書籍テーブル，モデル本体は推論にのみ使用するため保存しない）
+        """
+        if not self.n_unsaved:
+            return
+        self.__export(names=('dv',))
+        if self.sim_idx is not None:
+            self.__save_similar_table()
+        self.n_unsaved = 0
+
+    def __calc_cossims(self, bIdxs: np.ndarray) -> np.ndarray:
+        """指定書籍と全書籍のコサイン類似度計算（保持しているノルムを使用，自身は-inf）
+
+        Args:
+            bIdxs (np.ndarray): 書籍番号リスト
+
+        Returns:
+            np.ndarray: 類似度行列（指定書籍数 x 書籍数）
+        """
+        norms = np.where(self.bv.norms == 0, 1.0, self.bv.norms).astype(np.float32)   # ノルム0の書籍は類似度0
+        scores = (self.bv.vectors[bIdxs] @ self.bv.vectors.T) / norms[bIdxs, np.newaxis] / norms[np.newaxis, :]
+        scores[np.arange(len(bIdxs)), bIdxs] = -np.inf
+        return scores
+
+    def __add_to_similar_table(self, bIdx: int) -> None:
+        """類似書籍テーブルへの書籍追加・反映
+
+        Args:
+            bIdx (int): 追加書籍の書籍番号
+        """
+        d2v_config = get_config()['doc2vec']    # Doc2Vec設定
+        k = self.sim_idx.shape[1]
+        if k < min(d2v_config['similar_topn'], len(self.bv) - 1):
+            # 類似書籍数が上限未満（書籍数が少ない） -> 全体を再計算
+            self.sim_scores, self.sim_idx = calc_similar_table(self.bv.vectors, n_neighbors=d2v_config['similar_topn'],
+                                                               block_size=d2v_config['similar_block_size'])
+            return
+
+        n_row = len(self.sim_idx)   # 追加前の行数（新規書籍 -> bIdx == n_row）
+        if not self.sim_scores.flags.writeable:
+            self.sim_scores, self.sim_idx = np.array(self.sim_scores), np.array(self.sim_idx)
+
+        # 再登録書籍を含む既存書籍の行: 類似度が変わるため行全体を再計算
+        stale = np.flatnonzero((self.sim_idx == bIdx).any(axis=1))
+        stale = stale[stale != bIdx]
+        for start in range(0, len(stale), d2v_config['similar_block_size']):
+            rows = stale[start:start + d2v_config['similar_block_size']]
+            self.sim_scores[rows], self.sim_idx[rows] = select_top_k(self.__calc_cossims(bIdxs=rows), k=k)
+
+        # 追加書籍の行（再登録 -> 置換）
+        scores = self.__calc_cossims(bIdxs=np.array([bIdx]))
+        top_scores, top_idx = select_top_k(scores, k=k)
+        scores = scores[0]
+        if bIdx == n_row:
+            self.sim_scores = np.vstack([self.sim_scores, top_scores.astype(np.float32)])
+            self.sim_idx = np.vstack([self.sim_idx, top_idx.astype(np.int32)])
+        else:
+            self.sim_scores[bIdx], self.sim_idx[bIdx] = top_scores[0], top_idx[0]
+
+        # その他の既存書籍の行: 追加書籍の方が類似する行のみ差し込み（末尾を押し出し）
+        candidates = scores[:n_row] > self.sim_scores[:n_row, -1]
+        candidates[stale] = False
+        for row in np.flatnonzero(candidates):
+            if row == bIdx:
+                continue
+            pos = int(np.sum(self.sim_scores[row] >= scores[row]))
+            self.sim_scores[row, pos:] = np.append(scores[row], self.sim_scores[row, pos:-1])
+            self.sim_idx[row, pos:] = np.append(bIdx, self.sim_idx[row, pos:-1])
+
+    def __remap_tags(self, keys: List[str]) -> None:
+        """書籍ベクトルのタグ付け替え（corpus_file形式での訓練時: 行番号 -> ISBN-10）
+
+        Args:
+            keys (List[str]): 行順のタグ（ISBN-10）リスト
+        """
+        dv = self.model.dv
+        if len(dv.vectors) != len(keys):
+            raise ValueError('書籍ベクトル数（{0}）とコーパス行数（{1}）が一致しません'.format(len(dv.vectors), len(keys)))
+        dv.index_to_key = list(keys)
+        dv.key_to_index = {isbn10: bIdx for bIdx, isbn10 in enumerate(keys)}
+        dv.fill_norms(force=True)
+
+    def promote(self, model_path: Path) -> None:
+        """別パスに訓練したモデルファイル群（モデル・分割保存配列・類似書籍テーブル）を指定パスへ置換
+
+        Args:
+            model_path (Path): 置換先モデルファイルパス
+        """
+        src_prefix, dst_prefix = self.model_path.stem + '.', model_path.stem + '.'  # 例: d2v.next.* -> d2v.*
+        for src_path in self.model_path.parent.glob(src_prefix + '*'):
+            os.replace(src_path, model_path.parent / (dst_prefix + src_path.name[len(src_prefix):]))
+
+        self.model_path = model_path
+        self.sim_path = model_path.with_name(model_path.stem + '.sim.npz')
+        self.deleted_path = model_path.with_name(model_path.stem + '.deleted.txt')
+
+    def delete_book(self, isbn10: str) -> bool:
+        """書籍削除（トゥームストーン追加: 次回再訓練まで類似書籍から除外）
+
+        Args:
+            isbn10 (str): ISBN-10コード
+
+        Returns:
+            bool: 書籍ベクトルあり（トゥームストーン追加） -> True
+        """
+        if (not self.is_trained) or (isbn10 not in self.bv.key_to_index) or (isbn10 in self.deleted):
+            return False
+        self.deleted.add(isbn10)
+        with open(self.deleted_path, mode='a') as f:
+            f.write('{}\n'.format(isbn10))
+        return True
+
     def calc_word_cossim(self, word_1: str, word_2: str) -> float:
         """単語同士のコサイン類似度計算
 
@@ -130,8 +417,17 @@ class Doc2VecWrapper():
         Returns:
             List[Tuple[str, float]]: 類似書籍集合
         """
-        # ISBN-10に対応する書籍と類似するトップtopn個の書籍取得
-        similar_books = self.bv.most_similar(positive=[isbn10], topn=topn)
+        # ISBN-10に対応する書籍と類似するトップtopn個の書籍取得（削除書籍は除外）
+        # 類似書籍テーブルで足りる -> テーブル参照，足りない -> 全書籍ベクトルとの類似度計算（削除書籍数分多く取得）
+        similar_books = []
+        if self.sim_idx is not None:
+            bIdx = self.bv.key_to_index[isbn10]     # 未構築 -> KeyError
+            similar_books = [(self.bv.index_to_key[sim_bIdx], float(score))
+                             for sim_bIdx, score in zip(self.sim_idx[bIdx], self.sim_scores[bIdx])]
+            similar_books = [sb for sb in similar_books if sb[0] not in self.deleted][:topn]
+        if len(similar_books) < min(topn, len(self.bv) - len(self.deleted) - 1):
+            similar_books = self.bv.most_similar(positive=[isbn10], topn=topn + len(self.deleted))
+            similar_books = [sb for sb in similar_books if sb[0] not in self.deleted][:topn]
 
         # 類似書籍詳細表示
         if verbose:
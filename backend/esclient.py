@@ -0,0 +1,98 @@
+from logging import getLogger, StreamHandler, DEBUG, Formatter
+from contextvars import ContextVar
+from threading import Lock
+from pathlib import Path
+import sys
+import atexit
+from elasticsearch import Elasticsearch, Transport
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from config import get_config
+
+# ロガー設定
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+handler.setFormatter(Formatter('[shisho] %(message)s'))
+
+_client = None                                                      # プロセス共有Elasticsearchクライアント
+_lock = Lock()                                                      # クライアント生成の排他制御
+_round_trips = ContextVar('es_round_trips', default=None)           # リクエストごとのElasticsearch往復回数
+
+
+class CountingTransport(Transport):
+    """Elasticsearchへの往復回数を計測するTransport
+    """
+
+    def perform_request(self, method, url, *args, **kwargs):
+        counter = _round_trips.get()
+        if counter is not None:
+            counter[0] += 1
+        return super().perform_request(method, url, *args, **kwargs)
+
+
+def get_es() -> Elasticsearch:
+    """プロセス共有Elasticsearchクライアント取得（初回呼び出し時に生成）
+
+    コネクションプール（keep-alive）はスレッド間で共有されるため，呼び出し側でclose()しないこと．
+
+    Returns:
+        Elasticsearch: Elasticsearchクライアント
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                es_config = get_config()['elasticsearch']   # Elasticsearch接続設定
+                _client = Elasticsearch(es_config['hosts'], transport_class=CountingTransport,
+                                        maxsize=es_config['maxsize'],           # ノードあたりの最大コネクション数
+                                        timeout=es_config['timeout'],           # リクエストタイムアウト（秒）
+                                        max_retries=es_config['max_retries'],   # 最大リトライ回数
+                                        retry_on_timeout=True)
+                atexit.register(close_es)
+    return _client
+
+
+def close_es() -> None:
+    """プロセス共有Elasticsearchクライアント破棄
+    """
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_round_trips() -> int:
+    """現在のリクエストにおけるElasticsearch往復回数取得
+
+    Returns:
+        int: 往復回数（計測対象外 -> 0）
+    """
+    counter = _round_trips.get()
+    return 0 if counter is None else counter[0]
+
+
+def init_app(app) -> None:
+    """Flaskアプリへの登録（クライアント生成・リクエストごとの往復回数計測）
+
+    Args:
+        app (Flask): Flaskアプリ
+    """
+    app.extensions['es'] = get_es()
+
+    @app.before_request
+    def start_count_round_trips() -> None:
+        _round_trips.set([0])
+
+    @app.after_request
+    def report_round_trips(response):
+        from flask import request
+        n_round_trip = get_round_trips()
+        response.headers['X-ES-Round-Trips'] = str(n_round_trip)
+        logger.debug('{0} {1} -> ES round-trips: {2}'.format(request.method, request.path, n_round_trip))
+        return response
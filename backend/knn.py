@@ -0,0 +1,515 @@
+from typing import Callable, Tuple, Union
+from pathlib import Path
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+
+def calc_euclidean_distances(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    """行列間のユークリッド距離計算（全探索用）
+
+    Args:
+        X (np.ndarray): クエリ行列（クエリ数 x 次元）
+        Y (np.ndarray): 探索対象行列（対象数 x 次元）
+
+    Returns:
+        np.ndarray: 距離行列（クエリ数 x 対象数）
+    """
+    sq_dists = (X * X).sum(axis=1)[:, np.newaxis] + (Y * Y).sum(axis=1)[np.newaxis, :] - 2 * (X @ Y.T)
+    return np.sqrt(np.maximum(sq_dists, 0))
+
+
+class IncrementalKNNIndex():
+    """追記型KNNインデックス（ユークリッド距離）
+
+    探索対象行列の先頭n_base行を構築済ブロック（sklearn NearestNeighbors），それ以降の行を追記ブロック（全探索）として管理する．
+    追記ブロックがcompact_size行を超えた時点で全体を構築済ブロックとして再構築（コンパクション）するため，
+    1行の追加/削除はO(1)（償却O(d)）で済み，リクエストごとの再構築は発生しない．
+    構築済ブロック内の行が更新された場合は，その行を構築済ブロックの探索結果から除外し，最新の値で全探索する．
+    更新回数がrebuild_intervalに達した時点でコンパクションを行う．
+    構築済ブロックはindex='ivf'かつ行数がmin_size以上のときIVFIndex（近似探索）とする．
+    """
+
+    def __init__(self, get_vectors: Callable[[], np.ndarray], n_neighbors: int, compact_size=256, rebuild_interval=256,
+                 index='exact', ivf_params=None):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            get_vectors (Callable[[], np.ndarray]): 探索対象行列（行番号 = インデックスID）の取得関数
+            n_neighbors (int): デフォルト近傍数
+            compact_size (int, optional): コンパクションを行う追記ブロック行数．Defaults to 256.
+            rebuild_interval (int, optional): コンパクションを行う行更新回数．Defaults to 256.
+            index (str, optional): 構築済ブロックのインデックス種別（'exact' or 'ivf'）．Defaults to 'exact'.
+            ivf_params (IVFConfig, optional): IVFパラメータ（n_list, n_probe, min_size）．Defaults to None.
+        """
+        if index not in {'exact', 'ivf'}:
+            raise ValueError('指定したインデックス種別"{0}"は未定義です'.format(index))
+
+        self.get_vectors = get_vectors              # 探索対象行列取得関数
+        self.n_neighbors = n_neighbors              # デフォルト近傍数
+        self.compact_size = compact_size            # コンパクション閾値（追記）
+        self.rebuild_interval = rebuild_interval    # コンパクション閾値（更新）
+        self.index = index                          # 構築済ブロックのインデックス種別
+        self.ivf_params = ivf_params                # IVFパラメータ
+
+        self.base_model = None  # 構築済ブロックKNNモデル
+        self.n_base = 0         # 構築済ブロック行数
+        self.deleted = set()    # 削除済行（tombstone）
+        self.dirty = set()      # 構築済ブロック内の更新済行
+        self.n_update = 0       # 前回コンパクション以降の行更新回数
+
+        self.compact()
+
+    @property
+    def n_total(self) -> int:
+        """探索対象行数算出
+
+        Returns:
+            int: 探索対象行数（削除済行含む）
+        """
+        return len(self.get_vectors())
+
+    @property
+    def n_delta(self) -> int:
+        """追記ブロック行数算出
+
+        Returns:
+            int: 追記ブロック行数
+        """
+        return self.n_total - self.n_base
+
+    def compact(self) -> None:
+        """コンパクション（全行による構築済ブロック再構築）
+        """
+        vectors = np.array(self.get_vectors())  # スナップショット（以降の追記・更新の影響を受けない）
+        self.n_base = len(vectors)
+
+        if self.index == 'ivf' and self.n_base >= self.ivf_params.min_size:
+            # 近似探索（行数min_size未満なら厳密探索にフォールバック）
+            self.base_model = IVFIndex(n_neighbors=min(self.n_neighbors, self.n_base), n_list=self.ivf_params.n_list,
+                                       n_probe=self.ivf_params.n_probe).fit(vectors)
+        elif self.n_base > 0:
+            self.base_model = NearestNeighbors(n_neighbors=min(self.n_neighbors, self.n_base)).fit(vectors)
+        else:
+            self.base_model = None
+        self.dirty = set()
+        self.n_update = 0
+
+    def insert(self, idx: int) -> None:
+        """行追加（探索対象行列へ追記済の行を登録）
+
+        Args:
+            idx (int): 追加行番号
+        """
+        self.deleted.discard(idx)
+        if self.n_delta > self.compact_size:
+            self.compact()
+
+    def update(self, idx: int) -> None:
+        """行更新（探索対象行列の行を書き換えた後に呼び出す）
+
+        Args:
+            idx (int): 更新行番号
+        """
+        if idx < self.n_base:   # 構築済ブロック内 -> 以降は最新の値で全探索
+            self.dirty.add(idx)
+        self.n_update += 1
+        if self.n_update >= self.rebuild_interval:
+            self.compact()
+
+    def delete(self, idx: int) -> None:
+        """行削除（以降の探索結果から除外）
+
+        Args:
+            idx (int): 削除行番号
+        """
+        self.deleted.add(idx)
+
+    def kneighbors(self, X: np.ndarray, n_neighbors=None, return_distance=True) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """近傍探索（sklearn NearestNeighbors.kneighbors互換）
+
+        Args:
+            X (np.ndarray): クエリ行列（クエリ数 x 次元）
+            n_neighbors (int, optional): 近傍数（Noneならデフォルト近傍数）．Defaults to None.
+            return_distance (bool, optional): 距離も返すならTrue．Defaults to True.
+
+        Returns:
+            Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]: 近傍行番号（return_distance=True -> (距離, 近傍行番号)）
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        vectors = self.get_vectors()
+        k = min(self.n_neighbors if n_neighbors is None else n_neighbors, len(vectors) - len(self.deleted))
+
+        # 構築済ブロック探索（削除済行・更新済行の分だけ多めに取得）
+        if self.base_model is not None:
+            n_fetch = min(k + len(self.deleted) + len(self.dirty), self.n_base)
+            base_dists, base_idx = self.base_model.kneighbors(X, n_neighbors=n_fetch)
+            if self.dirty:  # 更新済行は構築済ブロック（古い値）の結果から除外
+                base_dists = np.where(np.isin(base_idx, list(self.dirty)), np.inf, base_dists)
+        else:
+            base_dists, base_idx = np.empty((len(X), 0)), np.empty((len(X), 0), dtype=np.int64)
+
+        # 更新済行＋追記ブロック全探索（最新の値）
+        fresh_idx = np.concatenate([np.fromiter(self.dirty, dtype=np.int64, count=len(self.dirty)),
+                                    np.arange(self.n_base, len(vectors))])
+        fresh_dists = calc_euclidean_distances(X, vectors[fresh_idx])
+        fresh_idx = np.broadcast_to(fresh_idx, fresh_dists.shape)
+
+        # 両ブロックの結果を統合 -> 削除済行除外 -> 距離昇順に上位k件取得
+        dists = np.hstack([base_dists, fresh_dists])
+        idx = np.hstack([base_idx, fresh_idx])
+        if self.deleted:
+            dists = np.where(np.isin(idx, list(self.deleted)), np.inf, dists)
+        order = np.argsort(dists, axis=1, kind='stable')[:, :k]
+
+        nn_idx = np.take_along_axis(idx, order, axis=1)
+        if return_distance:
+            return np.take_along_axis(dists, order, axis=1), nn_idx
+        return nn_idx
+
+
+def normalize_rows(X: np.ndarray) -> np.ndarray:
+    """行ごとのL2正規化（float32・C連続）
+
+    Args:
+        X (np.ndarray): 行列（行数 x 次元）
+
+    Returns:
+        np.ndarray: 正規化済行列（ノルム0の行はそのまま）
+    """
+    X = np.array(X, dtype=np.float32, order='C', ndmin=2)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    X /= norms
+    return X
+
+
+class CosineTopK():
+    """全探索コサイン類似度Top-kエンジン
+
+    探索対象行列を一度だけL2正規化してfloat32連続配列として保持し，
+    クエリとの内積（単一クエリ: GEMV，複数クエリ: GEMM）とargpartitionにより上位k件を取得する．
+    """
+
+    def __init__(self, vectors: np.ndarray, n_neighbors: int):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            vectors (np.ndarray): 探索対象行列（行番号 = インデックスID）
+            n_neighbors (int): デフォルト近傍数
+        """
+        self.mat = normalize_rows(vectors)  # 正規化済探索対象行列
+        self.n_neighbors = n_neighbors      # デフォルト近傍数
+
+    @property
+    def n_total(self) -> int:
+        """探索対象行数算出
+
+        Returns:
+            int: 探索対象行数
+        """
+        return len(self.mat)
+
+    def add(self, vectors: np.ndarray) -> None:
+        """探索対象行の追加（行番号は追加順に続番）
+
+        Args:
+            vectors (np.ndarray): 追加行列（行数 x 次元）
+        """
+        self.mat = np.vstack([self.mat, normalize_rows(vectors)])
+
+    def search(self, X: np.ndarray, n_neighbors=None, return_score=False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """近傍探索（コサイン類似度降順）
+
+        Args:
+            X (np.ndarray): クエリ（1次元 -> 単一クエリ，2次元 -> 一括クエリ）
+            n_neighbors (int, optional): 近傍数（Noneならデフォルト近傍数）．Defaults to None.
+            return_score (bool, optional): コサイン類似度も返すならTrue．Defaults to False.
+
+        Returns:
+            Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]: 近傍行番号（return_score=True -> (類似度, 近傍行番号)）
+                                                             単一クエリなら1次元，一括クエリなら2次元（クエリ数 x 近傍数）
+        """
+        is_single = np.ndim(X) == 1
+        k = min(self.n_neighbors if n_neighbors is None else n_neighbors, self.n_total)
+
+        # 正規化済行列との内積 = コサイン類似度（単一クエリ: GEMV，一括クエリ: GEMM）
+        if is_single:
+            scores = (self.mat @ normalize_rows(X)[0])[np.newaxis, :]
+        else:
+            scores = normalize_rows(X) @ self.mat.T
+
+        # 上位k件を部分ソート -> 類似度降順に整列
+        if k < self.n_total:
+            top_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top_idx = np.broadcast_to(np.arange(self.n_total), scores.shape)
+        top_scores = np.take_along_axis(scores, top_idx, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        nn_idx = np.take_along_axis(top_idx, order, axis=1)
+        nn_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        if is_single:
+            nn_idx, nn_scores = nn_idx[0], nn_scores[0]
+        if return_score:
+            return nn_scores, nn_idx
+        return nn_idx
+
+
+def calc_similar_table(vectors: np.ndarray, n_neighbors: int, block_size=256) -> Tuple[np.ndarray, np.ndarray]:
+    """全行の類似行テーブル計算（コサイン類似度降順，自身は除外）
+
+    行ブロックごとに正規化済行列同士の内積（GEMM）を計算し，ブロック x 全行の類似度行列のみを保持する．
+
+    Args:
+        vectors (np.ndarray): 行列（行数 x 次元）
+        n_neighbors (int): 類似行数（上限: 行数 - 1）
+        block_size (int, optional): 一度に計算する行数．Defaults to 256.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (類似度, 類似行番号)（いずれも行数 x 類似行数）
+    """
+    mat = normalize_rows(vectors)
+    n_total = len(mat)
+    k = max(min(n_neighbors, n_total - 1), 0)
+    sim_scores = np.zeros((n_total, k), dtype=np.float32)
+    sim_idx = np.zeros((n_total, k), dtype=np.int32)
+    if k == 0:
+        return sim_scores, sim_idx
+
+    for start in range(0, n_total, block_size):
+        rows = np.arange(start, min(start + block_size, n_total))
+        scores = mat[rows] @ mat.T
+        scores[np.arange(len(rows)), rows] = -np.inf    # 自身は除外
+
+        sim_scores[rows], sim_idx[rows] = select_top_k(scores, k=k)
+
+    return sim_scores, sim_idx
+
+
+def select_top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """行ごとの類似度上位k件の選択（類似度降順）
+
+    Args:
+        scores (np.ndarray): 類似度行列（行数 x 対象数，除外する要素は-inf）
+        k (int): 選択数（1以上，対象数以下）
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (類似度, 対象番号)（いずれも行数 x k）
+    """
+    top_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top_idx, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top_idx, order, axis=1)
+
+
+class IVFIndex():
+    """転置ファイル（IVF）型近似近傍探索インデックス
+
+    探索対象行列をk-meansによりn_list個のクラスタ（転置リスト）に分割し，
+    クエリに近いn_probe個のクラスタに属する行のみを全探索する（n_probe大 -> 再現率↑・速度↓）．
+    - metric='euclidean': ユークリッド距離（スコアは距離の符号反転）
+    - metric='cosine': コサイン類似度（球面k-means，スコアはコサイン類似度）
+    """
+
+    def __init__(self, n_neighbors: int, metric='euclidean', n_list=64, n_probe=8, n_iter=10, seed=0):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            n_neighbors (int): デフォルト近傍数
+            metric (str, optional): 距離尺度（'euclidean' or 'cosine'）．Defaults to 'euclidean'.
+            n_list (int, optional): クラスタ数．Defaults to 64.
+            n_probe (int, optional): 探索クラスタ数．Defaults to 8.
+            n_iter (int, optional): k-means反復回数．Defaults to 10.
+            seed (int, optional): 乱数シード．Defaults to 0.
+        """
+        if metric not in {'euclidean', 'cosine'}:
+            raise ValueError('指定した距離尺度"{0}"は未定義です'.format(metric))
+
+        self.n_neighbors = n_neighbors  # デフォルト近傍数
+        self.metric = metric            # 距離尺度
+        self.n_list = n_list            # クラスタ数
+        self.n_probe = n_probe          # 探索クラスタ数
+        self.n_iter = n_iter            # k-means反復回数
+        self.seed = seed                # 乱数シード
+
+        self.centroids = None   # クラスタ中心（クラスタ数 x 次元）
+        self.data = None        # クラスタ順に並べ替えた探索対象行列
+        self.ids = None         # 並べ替え後の行 -> 元の行番号
+        self.offsets = None     # クラスタごとの開始位置（クラスタ数 + 1）
+
+    @property
+    def n_total(self) -> int:
+        """探索対象行数算出
+
+        Returns:
+            int: 探索対象行数
+        """
+        return 0 if self.data is None else len(self.data)
+
+    def __calc_scores(self, X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+        """スコア計算（大きいほど近い）
+
+        Args:
+            X (np.ndarray): クエリ行列
+            Y (np.ndarray): 探索対象行列
+
+        Returns:
+            np.ndarray: スコア行列（クエリ数 x 対象数）
+        """
+        if self.metric == 'cosine':
+            return X @ Y.T  # X, Yは正規化済
+        return -calc_euclidean_distances(X, Y)
+
+    def __assign(self, vectors: np.ndarray, block_size=65536) -> np.ndarray:
+        """最近傍クラスタ割り当て（ブロック単位）
+
+        Args:
+            vectors (np.ndarray): 割り当て対象行列
+            block_size (int, optional): 1ブロックあたりの行数．Defaults to 65536.
+
+        Returns:
+            np.ndarray: クラスタ番号
+        """
+        return np.concatenate([self.__calc_scores(vectors[i:i + block_size], self.centroids).argmax(axis=1)
+                               for i in range(0, len(vectors), block_size)])
+
+    def fit(self, vectors: np.ndarray) -> 'IVFIndex':
+        """インデックス構築
+
+        Args:
+            vectors (np.ndarray): 探索対象行列（行番号 = インデックスID）
+
+        Returns:
+            IVFIndex: 構築済インデックス
+        """
+        vectors = normalize_rows(vectors) if self.metric == 'cosine' else np.array(vectors, dtype=np.float32, order='C')
+        rng = np.random.default_rng(self.seed)
+        n_list = max(1, min(self.n_list, len(vectors)))
+
+        # k-means（学習はクラスタあたり最大256行のサンプルで行う）
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), 256 * n_list), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), size=n_list, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = self.__assign(sample)
+            for c in range(n_list):
+                members = sample[assign == c]
+                if len(members):    # 空クラスタは中心を維持
+                    self.centroids[c] = members.mean(axis=0)
+            if self.metric == 'cosine':
+                self.centroids = normalize_rows(self.centroids)
+
+        # 全行をクラスタ順に並べ替えて連続配置
+        assign = self.__assign(vectors)
+        self.ids = np.argsort(assign, kind='stable')
+        self.data = vectors[self.ids]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_list))])
+        return self
+
+    def add(self, vectors: np.ndarray) -> None:
+        """探索対象行の追加（クラスタ中心は固定，最近傍クラスタの転置リスト末尾に挿入，行番号は追加順に続番）
+
+        Args:
+            vectors (np.ndarray): 追加行列（行数 x 次元）
+        """
+        vectors = normalize_rows(vectors) if self.metric == 'cosine' else np.array(vectors, dtype=np.float32, ndmin=2)
+        for vector, c in zip(vectors, self.__assign(vectors)):
+            pos = self.offsets[c + 1]
+            self.data = np.insert(self.data, pos, vector, axis=0)
+            self.ids = np.insert(self.ids, pos, len(self.ids))
+            self.offsets[c + 1:] += 1
+
+    def search(self, X: np.ndarray, n_neighbors=None, return_score=False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """近似近傍探索（スコア降順）
+
+        Args:
+            X (np.ndarray): クエリ（1次元 -> 単一クエリ，2次元 -> 一括クエリ）
+            n_neighbors (int, optional): 近傍数（Noneならデフォルト近傍数）．Defaults to None.
+            return_score (bool, optional): スコアも返すならTrue．Defaults to False.
+
+        Returns:
+            Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]: 近傍行番号（return_score=True -> (スコア, 近傍行番号)）
+        """
+        is_single = np.ndim(X) == 1
+        X = normalize_rows(X) if self.metric == 'cosine' else np.array(X, dtype=np.float32, ndmin=2)
+        k = min(self.n_neighbors if n_neighbors is None else n_neighbors, self.n_total)
+        list_sizes = np.diff(self.offsets)
+
+        nn_scores, nn_idx = np.empty((len(X), k), dtype=np.float32), np.empty((len(X), k), dtype=np.int64)
+        for qi, (x, centroid_scores) in enumerate(zip(X, self.__calc_scores(X, self.centroids))):
+            # 近いクラスタ順にn_probe個（ただし候補行数がk未満なら追加）選択
+            lists = np.argsort(-centroid_scores, kind='stable')
+            n_use = max(min(self.n_probe, len(lists)), int(np.searchsorted(np.cumsum(list_sizes[lists]), k)) + 1)
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists[:n_use]])
+
+            # 候補行の全探索 -> 上位k件
+            scores = self.__calc_scores(x[np.newaxis, :], self.data[rows])[0]
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+            top = top[np.argsort(-scores[top], kind='stable')]
+            nn_scores[qi], nn_idx[qi] = scores[top], self.ids[rows[top]]
+
+        if is_single:
+            nn_scores, nn_idx = nn_scores[0], nn_idx[0]
+        if return_score:
+            return nn_scores, nn_idx
+        return nn_idx
+
+    def kneighbors(self, X: np.ndarray, n_neighbors=None, return_distance=True) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """近似近傍探索（sklearn NearestNeighbors.kneighbors互換）
+
+        Args:
+            X (np.ndarray): クエリ行列（クエリ数 x 次元）
+            n_neighbors (int, optional): 近傍数（Noneならデフォルト近傍数）．Defaults to None.
+            return_distance (bool, optional): 距離も返すならTrue．Defaults to True.
+
+        Returns:
+            Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]: 近傍行番号（return_distance=True -> (距離, 近傍行番号)）
+        """
+        scores, nn_idx = self.search(np.atleast_2d(X), n_neighbors=n_neighbors, return_score=True)
+        if return_distance:
+            return (1 - scores if self.metric == 'cosine' else -scores), nn_idx
+        return nn_idx
+
+    def save(self, path: Path) -> None:
+        """インデックス保存（.npz）
+
+        Args:
+            path (Path): 保存先パス
+        """
+        np.savez(path, centroids=self.centroids, data=self.data, ids=self.ids, offsets=self.offsets,
+                 params=np.array([self.n_neighbors, self.n_list, self.n_probe, self.n_iter, self.seed]),
+                 metric=np.array(self.metric))
+
+    @classmethod
+    def load(cls, path: Path) -> 'IVFIndex':
+        """インデックス読み込み（.npz）
+
+        Args:
+            path (Path): 保存先パス
+
+        Returns:
+            IVFIndex: 構築済インデックス
+        """
+        with np.load(path) as npz:
+            n_neighbors, n_list, n_probe, n_iter, seed = (int(p) for p in npz['params'])
+            index = cls(n_neighbors=n_neighbors, metric=str(npz['metric']), n_list=n_list, n_probe=n_probe, n_iter=n_iter, seed=seed)
+            index.centroids, index.data, index.ids, index.offsets = npz['centroids'], npz['data'], npz['ids'], npz['offsets']
+        return index
+
+
+def construct_book_index(vectors: np.ndarray, n_neighbors: int, index='exact', ivf_params=None) -> Union[CosineTopK, IVFIndex]:
+    """書籍近傍探索インデックス構築（コサイン類似度）
+
+    Args:
+        vectors (np.ndarray): 書籍表現行列
+        n_neighbors (int): デフォルト近傍数
+        index (str, optional): インデックス種別（'exact' or 'ivf'）．Defaults to 'exact'.
+        ivf_params (IVFConfig, optional): IVFパラメータ（n_list, n_probe, min_size）．Defaults to None.
+
+    Returns:
+        Union[CosineTopK, IVFIndex]: 書籍近傍探索インデックス（行数min_size未満なら全探索）
+    """
+    if index == 'ivf' and len(vectors) >= ivf_params.min_size:
+        return IVFIndex(n_neighbors=n_neighbors, metric='cosine', n_list=ivf_params.n_list, n_probe=ivf_params.n_probe).fit(vectors)
+    elif index in {'exact', 'ivf'}:
+        return CosineTopK(vectors=vectors, n_neighbors=n_neighbors)
+    raise ValueError('指定したインデックス種別"{0}"は未定義です'.format(index))
@@ -1,10 +1,20 @@
 from logging import getLogger, StreamHandler, DEBUG, Formatter
-from typing import Dict, Union
-import re
+from typing import Dict, Iterable, List, Union
+from threading import Lock
+from pathlib import Path
+import sys
 import json
+import time
+import sqlite3
+import hashlib
 import requests
-import MeCab
-from neologdn import normalize
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from backend.tokenizer import Tokenizer
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from config import get_config
 
 # ロガー設定
 logger = getLogger(__name__)
@@ -15,19 +25,261 @@ logger.addHandler(handler)
 logger.propagate = False
 handler.setFormatter(Formatter('[openBD] %(asctime)s - %(message)s'))
 
+OPENBD_ENDPOINT = 'https://api.openbd.jp/v1/get'    # openBD書籍情報取得エンドポイント
+
+
+_shared_client = None    # プロセス共有openBDクライアント
+_shared_lock = Lock()   # 共有クライアント生成の排他制御
+
+
+class OpenBDResponseCache():
+    """openBDレスポンスキャッシュ（SQLite・TTL）
+
+    キーはエンドポイントとISBN-10から求めたSHA-256とし，書籍1冊ごとにレスポンス（JSON）を保存する．
+    openBDで見つからない書籍（null）もキャッシュする（再投入時に再リクエストしない）．
+    期限切れレスポンスはキャッシュファイルを開く際に削除する．
+    """
+
+    def __init__(self, path: Path, ttl=86400.0):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            path (Path): キャッシュファイル（SQLite）パス
+            ttl (float, optional): 有効期間（秒）．Defaults to 86400.0.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.__lock = Lock()
+        # 複数プロセスから参照されるため，書き込み待ちはSQLite側で待機
+        self.__conn = sqlite3.connect(str(self.path), timeout=30.0, check_same_thread=False)
+        with self.__lock, self.__conn:
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('CREATE TABLE IF NOT EXISTS response (key TEXT PRIMARY KEY, fetched_at REAL NOT NULL, body TEXT NOT NULL)')
+        n_purged = self.purge()     # 期限切れレスポンスは再利用されないため，開くたびに削除してファイルの肥大化を防ぐ
+        if n_purged:
+            logger.debug('期限切れレスポンスを削除しました ({0}件)'.format(n_purged))
+
+    @staticmethod
+    def get_key(endpoint: str, isbn10: str) -> str:
+        """キャッシュキー取得
+
+        Args:
+            endpoint (str): openBDエンドポイント
+            isbn10 (str): ISBN-10コード
+
+        Returns:
+            str: キャッシュキー（SHA-256）
+        """
+        return hashlib.sha256('{0}?isbn={1}'.format(endpoint, isbn10).encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Union[Dict, None]]:
+        """レスポンス一括取得
+
+        Args:
+            keys (List[str]): キャッシュキーリスト
+
+        Returns:
+            Dict[str, Union[Dict, None]]: キャッシュキー -> 書籍情報（見つからない書籍 -> None，キャッシュなし・期限切れは含まない）
+        """
+        if not len(keys):
+            return dict()
+        query = 'SELECT key, body FROM response WHERE fetched_at >= ? AND key IN ({})'.format(','.join('?' * len(keys)))
+        with self.__lock:
+            rows = self.__conn.execute(query, [time.time() - self.ttl] + list(keys)).fetchall()
+        return {key: json.loads(body) for key, body in rows}
+
+    def put_many(self, items: Dict[str, Union[Dict, None]]) -> None:
+        """レスポンス一括保存
+
+        Args:
+            items (Dict[str, Union[Dict, None]]): キャッシュキー -> 書籍情報（見つからない書籍 -> None）
+        """
+        now = time.time()
+        with self.__lock, self.__conn:
+            self.__conn.executemany('INSERT OR REPLACE INTO response (key, fetched_at, body) VALUES (?, ?, ?)',
+                                    [(key, now, json.dumps(openbd, ensure_ascii=False)) for key, openbd in items.items()])
+
+    def purge(self) -> int:
+        """期限切れレスポンスの削除
+
+        Returns:
+            int: 削除件数
+        """
+        with self.__lock, self.__conn:
+            return self.__conn.execute('DELETE FROM response WHERE fetched_at < ?', (time.time() - self.ttl,)).rowcount
+
+    def close(self) -> None:
+        """キャッシュファイルを閉じる
+        """
+        with self.__lock:
+            self.__conn.close()
+
+
+class OpenBDClient():
+    """openBDクライアント
+
+    HTTPセッション（コネクション）を使い回し，複数書籍はISBNをカンマ区切りで指定して一括リクエストする．
+    タイムアウト・リトライ（接続失敗・429・5xx）を設定し，レスポンスはキャッシュ（cache）があれば保存・再利用する．
+    """
+
+    def __init__(self, endpoint=OPENBD_ENDPOINT, timeout=(3.05, 30.0), max_retries=3, backoff_factor=0.5,
+                 batch_size=100, cache: Union[OpenBDResponseCache, None] = None):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            endpoint (str, optional): openBD書籍情報取得エンドポイント．Defaults to OPENBD_ENDPOINT.
+            timeout (tuple, optional): タイムアウト（秒，（接続, 読み込み））．Defaults to (3.05, 30.0).
+            max_retries (int, optional): 最大リトライ回数．Defaults to 3.
+            backoff_factor (float, optional): リトライ間隔係数（backoff_factor * 2^(n-1)秒）．Defaults to 0.5.
+            batch_size (int, optional): 1リクエストあたりの最大書籍数．Defaults to 100.
+            cache (Union[OpenBDResponseCache, None], optional): レスポンスキャッシュ（None -> キャッシュしない）．Defaults to None.
+        """
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.cache = cache
+
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504))
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(max_retries=retry))
+        self.session.mount('https://', HTTPAdapter(max_retries=retry))
+
+    def __fetch(self, isbn10s: List[str]) -> List[Union[Dict, None]]:
+        """openBDへのリクエスト（batch_size冊ずつ）
+
+        Args:
+            isbn10s (List[str]): ISBN-10コードリスト
+
+        Raises:
+            requests.RequestException: リクエスト失敗（リトライ後もステータスコード200番台以外を含む）
+
+        Returns:
+            List[Union[Dict, None]]: 書籍情報リスト（isbn10sと同順，見つからない書籍 -> None）
+        """
+        openbds = []
+        for i in range(0, len(isbn10s), self.batch_size):
+            response = self.session.get(self.endpoint, params=dict(isbn=','.join(isbn10s[i:i + self.batch_size])), timeout=self.timeout)
+            response.raise_for_status()
+            openbds.extend(response.json())
+        return openbds
+
+    def get_many(self, isbn10s: Iterable[str]) -> List[Union[Dict, None]]:
+        """複数書籍の書籍情報取得（キャッシュにない書籍のみリクエスト）
+
+        Args:
+            isbn10s (Iterable[str]): ISBN-10コードリスト
+
+        Raises:
+            requests.RequestException: リクエスト失敗
+
+        Returns:
+            List[Union[Dict, None]]: 書籍情報リスト（isbn10sと同順，見つからない書籍 -> None）
+        """
+        isbn10s = list(isbn10s)
+        if self.cache is None:
+            return self.__fetch(isbn10s)
+
+        keys = {isbn10: self.cache.get_key(endpoint=self.endpoint, isbn10=isbn10) for isbn10 in isbn10s}
+        cached = self.cache.get_many(list(set(keys.values())))
+        missing = [isbn10 for isbn10 in dict.fromkeys(isbn10s) if keys[isbn10] not in cached]
+        if len(missing):
+            fetched = {keys[isbn10]: openbd for isbn10, openbd in zip(missing, self.__fetch(missing))}
+            self.cache.put_many(fetched)
+            cached.update(fetched)
+        return [cached[keys[isbn10]] for isbn10 in isbn10s]
+
+    def get(self, isbn10: str) -> Union[Dict, None]:
+        """書籍情報取得
+
+        Args:
+            isbn10 (str): ISBN-10コード
+
+        Raises:
+            requests.RequestException: リクエスト失敗
+
+        Returns:
+            Union[Dict, None]: 書籍情報（見つからない書籍 -> None）
+        """
+        return self.get_many([isbn10])[0]
+
+    def close(self) -> None:
+        """HTTPセッション・キャッシュを閉じる
+        """
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def get_openbd_client() -> OpenBDClient:
+    """プロセス共有openBDクライアント取得（初回呼び出し時に生成）
+
+    Returns:
+        OpenBDClient: openBDクライアント
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_lock:
+            if _shared_client is None:
+                openbd_config = get_config()['openbd']  # openBDクライアント設定
+                cache_path = openbd_config['cache_path']
+                cache = None if cache_path is None else OpenBDResponseCache(path=Path(cache_path), ttl=openbd_config['cache_ttl'])
+                _shared_client = OpenBDClient(timeout=(openbd_config['connect_timeout'], openbd_config['read_timeout']),
+                                              max_retries=openbd_config['max_retries'], backoff_factor=openbd_config['backoff_factor'],
+                                              batch_size=openbd_config['batch_size'], cache=cache)
+    return _shared_client
+
+
+def get_jsons_from_openbd(isbn10s: List[str]) -> List[Union[Dict, None]]:
+    """openBDから複数書籍の書籍情報を一括取得（共有クライアント経由）
+
+    Args:
+        isbn10s (List[str]): ISBN-10コードリスト
+
+    Raises:
+        requests.RequestException: リクエスト失敗（ステータスコード200番台以外を含む）
+
+    Returns:
+        List[Union[Dict, None]]: 書籍情報リスト（isbn10sと同順，見つからない書籍 -> None）
+    """
+    return get_openbd_client().get_many(isbn10s)
+
 
 class OpenBD:
     # openBD: https://openbd.jp/
-    def __init__(self, isbn10: int, mecab: MeCab.Tagger):
+    def __init__(self, isbn10: int, tokenizer: Tokenizer, client: Union[OpenBDClient, None] = None):
         """"インスタンス生成時の初期化処理
 
         Args:
             isbn10 (int): OpenBDへリクエストする書籍のISBN-10
-            mecab (MeCab.Tagger): MeCab設定（辞書等）
+            tokenizer (Tokenizer): 書籍説明テキストの前処理（MeCab設定等）
+            client (Union[OpenBDClient, None], optional): openBDクライアント（None -> 共有クライアント）．Defaults to None.
         """
         self.isbn10 = isbn10    # 書籍のISBN-10
+        self.client = get_openbd_client() if client is None else client    # openBDクライアント
         self.result = self.get_json_from_openbd()  # openBDへのリクエスト結果
-        self.mecab = mecab      # MeCab設定
+        self.tokenizer = tokenizer  # 書籍説明テキストの前処理
+
+    @classmethod
+    def from_json(cls, isbn10: str, openbd: Union[Dict, None], tokenizer: Tokenizer) -> 'OpenBD':
+        """取得済の書籍情報からのインスタンス生成（openBDへリクエストしない）
+
+        Args:
+            isbn10 (str): 書籍のISBN-10
+            openbd (Union[Dict, None]): openBD書籍情報（見つからない書籍 -> None）
+            tokenizer (Tokenizer): 書籍説明テキストの前処理（MeCab設定等）
+
+        Returns:
+            OpenBD: インスタンス
+        """
+        book = cls.__new__(cls)
+        book.isbn10, book.tokenizer = isbn10, tokenizer
+        if openbd is None:
+            book.result = 'NOT FOUND'
+        else:
+            book.openbd, book.result = openbd, 'OK'
+        return book
 
     def get_json_from_openbd(self) -> str:
         """openBDから書籍情報取得
@@ -35,18 +287,13 @@ class OpenBD:
         Returns:
             str: openBDリクエスト結果
         """
-        # 指定ISBN-10の書籍情報を取得する, openBDエンドポイント
-        openbd_endpoint = 'https://api.openbd.jp/v1/get?isbn={0}'.format(self.isbn10)
-
         try:
-            response = requests.get(openbd_endpoint)
-            response.raise_for_status()
+            openbd = self.client.get(isbn10=self.isbn10)   # 書籍情報 from openBD（キャッシュ済 -> リクエストなし）
         except requests.RequestException as e:
             # ステータスコード200番台以外 -> エラーログ出力
             logger.debug(e)
             return 'FAILED'
 
-        openbd = json.loads(response.text)[0]   # 書籍情報 from openBD
         # openBDで書籍情報が見つからないケース
         if openbd is None:
             return 'NOT FOUND'
@@ -54,6 +301,24 @@ class OpenBD:
         self.openbd = openbd
         return 'OK'
 
+    def get_description_text(self) -> str:
+        """書籍説明（タイトル，出版社，著者，詳細を連結した文章）テキスト取得（前処理前）
+
+        Returns:
+            str: 書籍説明テキスト
+        """
+        summary = self.openbd['summary']
+
+        # 書籍詳細（目次や概要など）の取得
+        if self.openbd['onix']['CollateralDetail'].get('TextContent'):
+            # 複数ある場合は連結
+            detail = ' '.join([text_content['Text'].replace('\n', ' ') for text_content in self.openbd['onix']['CollateralDetail']['TextContent']])
+        else:
+            # 詳細が存在しない場合 -> 未登録とする
+            detail = '未登録'
+
+        return '{0} {1} {2} {3}'.format(summary['title'], summary['publisher'], summary['author'], detail)
+
     def get_std_info(self) -> Union[Dict[str, str], bool]:
         if self.result != 'OK':
             logger.debug('openBDからの書籍情報取得に失敗しているため基本情報を取得できません')
@@ -78,25 +343,8 @@ class OpenBD:
             # pubdare: yyyy-MM
             pubdate = '{0}-01'.format(tmp_pubdate)
 
-        # 書籍詳細（目次や概要など）の取得
-        if self.openbd['onix']['CollateralDetail'].get('TextContent'):
-            # 複数ある場合は連結
-            detail = ' '.join([text_content['Text'].replace('\n', ' ') for text_content in self.openbd['onix']['CollateralDetail']['TextContent']])
-        else:
-            # 詳細が存在しない場合 -> 未登録とする
-            detail = '未登録'
-
-        # 書籍説明（タイトル，出版社，著者，詳細を連結した文章）テキスト（処理前）
-        # neologdnによる正規化 -> 数字削除（目次対策）
-        tmp_description = re.sub(r'[0-9]+', ' ', normalize('{0} {1} {2} {3}'.format(title, publisher, authors, detail)))
-
-        # 書籍説明テキストの分かち書きと品詞フィルタリング
-        description_word_list = []  # 書籍説明テキスト対象単語
-        for line in self.mecab.parse(tmp_description).splitlines():
-            chunks = line.split('\t')
-            if len(chunks) > 3 and (chunks[3].startswith('動詞') or chunks[3].startswith('形容詞') or chunks[3].startswith('名詞')):
-                # 動詞or形容詞or名詞 -> 訓練対象
-                description_word_list.append(chunks[0])
+        # 書籍説明テキスト: 正規化・数字削除 -> 分かち書きと品詞フィルタリング（動詞or形容詞or名詞 -> 訓練対象）
+        description_word_list = self.tokenizer.tokenize(self.get_description_text())
 
         # 書籍説明テキスト（処理後）: Doc2Vec訓練時に書籍を表す文章として使用
         description = ' '.join(description_word_list)
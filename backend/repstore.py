@@ -0,0 +1,239 @@
+from typing import Dict, Union
+import numpy as np
+
+
+class UserRepStore():
+    """ユーザ/セッション表現ストア（行列形式）
+
+    ユーザごとの表現を連続したfloat32行列上で管理する．
+    - セッション表現: ユーザ行ごとに直近context_size個を保持するリングバッファ
+    - ユーザ表現: ユーザ表現構築済ユーザのみを先頭から詰めて保持する行列（ユーザKNNモデルの入力）
+    """
+
+    def __init__(self, dim: int, context_size: int, capacity=1024):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            dim (int): 表現次元数
+            context_size (int): ユーザあたりに保持するセッション表現数（コンテキストセッション数）
+            capacity (int, optional): 初期確保ユーザ数（超過時は倍々で拡張）．Defaults to 1024.
+        """
+        if context_size < 1:
+            raise ValueError('コンテキストサイズ（指定値: {}）は1以上の整数を指定してください'.format(context_size))
+
+        self.dim = dim                      # 表現次元数
+        self.context_size = context_size    # コンテキストセッション数
+
+        # セッション表現（ユーザ行 x コンテキストセッション x 次元）
+        self.session_mat = np.zeros((capacity, context_size, dim), dtype=np.float32)
+        self.session_head = np.full(capacity, -1, dtype=np.int64)   # 最新セッション表現位置（未構築: -1）
+        self.n_session = np.zeros(capacity, dtype=np.int64)         # 保持セッション表現数（上限: context_size）
+        self.row_by_uId = dict()    # ユーザID -> セッション表現行
+        self.n_user = 0             # 登録ユーザ数
+
+        # ユーザ表現（ユーザ表現行 x 次元）
+        self.user_mat = np.zeros((capacity, dim), dtype=np.float32)
+        self.urow_by_uId = dict()                                   # ユーザID -> ユーザ表現行
+        self.uId_by_urow = np.empty(capacity, dtype=object)         # ユーザ表現行 -> ユーザID
+        self.n_user_rep = 0                                         # ユーザ表現数
+
+    @property
+    def user_reps(self) -> np.ndarray:
+        """ユーザ表現行列取得（ビュー）
+
+        Returns:
+            np.ndarray: ユーザ表現行列（ユーザ表現数 x 次元）
+        """
+        return self.user_mat[:self.n_user_rep]
+
+    @property
+    def uIds_with_rep(self) -> np.ndarray:
+        """ユーザ表現行対応ユーザID取得（ビュー）
+
+        Returns:
+            np.ndarray: ユーザ表現行対応ユーザIDリスト
+        """
+        return self.uId_by_urow[:self.n_user_rep]
+
+    def __grow_session(self) -> None:
+        """セッション表現領域の拡張（2倍）
+        """
+        capacity = 2 * self.session_mat.shape[0]
+
+        session_mat = np.zeros((capacity, self.context_size, self.dim), dtype=np.float32)
+        session_mat[:self.n_user] = self.session_mat[:self.n_user]
+        session_head = np.full(capacity, -1, dtype=np.int64)
+        session_head[:self.n_user] = self.session_head[:self.n_user]
+        n_session = np.zeros(capacity, dtype=np.int64)
+        n_session[:self.n_user] = self.n_session[:self.n_user]
+
+        self.session_mat, self.session_head, self.n_session = session_mat, session_head, n_session
+
+    def __grow_user(self) -> None:
+        """ユーザ表現領域の拡張（2倍）
+        """
+        capacity = 2 * self.user_mat.shape[0]
+
+        user_mat = np.zeros((capacity, self.dim), dtype=np.float32)
+        user_mat[:self.n_user_rep] = self.user_mat[:self.n_user_rep]
+        uId_by_urow = np.empty(capacity, dtype=object)
+        uId_by_urow[:self.n_user_rep] = self.uId_by_urow[:self.n_user_rep]
+
+        self.user_mat, self.uId_by_urow = user_mat, uId_by_urow
+
+    def add_user(self, uId: str) -> int:
+        """ユーザ登録（セッション表現行の確保）
+
+        Args:
+            uId (str): ユーザID
+
+        Returns:
+            int: セッション表現行
+        """
+        row = self.row_by_uId.get(uId)
+        if row is not None:     # 登録済 -> 既存行
+            return row
+
+        if self.n_user == self.session_mat.shape[0]:
+            self.__grow_session()
+
+        row = self.n_user
+        self.row_by_uId[uId] = row
+        self.n_user += 1
+        return row
+
+    def push_session_rep(self, row: int, rep: np.ndarray) -> None:
+        """新規セッション表現追加（最古のセッション表現を上書き）
+
+        Args:
+            row (int): セッション表現行
+            rep (np.ndarray): セッション表現
+        """
+        head = (self.session_head[row] + 1) % self.context_size
+        self.session_mat[row, head] = rep
+        self.session_head[row] = head
+        self.n_session[row] = min(self.n_session[row] + 1, self.context_size)
+
+    def set_latest_session_rep(self, row: int, rep: np.ndarray) -> None:
+        """最新セッション表現更新
+
+        Args:
+            row (int): セッション表現行
+            rep (np.ndarray): セッション表現
+        """
+        self.session_mat[row, self.session_head[row]] = rep
+
+    def get_latest_session_rep(self, row: int) -> Union[np.ndarray, None]:
+        """最新セッション表現取得（ビュー）
+
+        Args:
+            row (int): セッション表現行
+
+        Returns:
+            Union[np.ndarray, None]: 最新セッション表現（未構築時はNone）
+        """
+        head = self.session_head[row]
+        if head < 0:
+            return None
+        return self.session_mat[row, head]
+
+    def get_context_session_reps(self, row: int) -> np.ndarray:
+        """コンテキストセッション表現取得（ビュー）
+
+        Args:
+            row (int): セッション表現行
+
+        Returns:
+            np.ndarray: 直近最大context_size個のセッション表現（保持数 x 次元）
+        """
+        return self.session_mat[row, :self.n_session[row]]
+
+    def set_session_reps(self, rows: np.ndarray, session_mat: np.ndarray, session_head: np.ndarray, n_session: np.ndarray) -> None:
+        """セッション表現リングバッファの一括設定（一括学習用）
+
+        Args:
+            rows (np.ndarray): セッション表現行
+            session_mat (np.ndarray): セッション表現（行数 x コンテキストセッション数 x 次元）
+            session_head (np.ndarray): 最新セッション表現位置
+            n_session (np.ndarray): 保持セッション表現数
+        """
+        self.session_mat[rows] = session_mat
+        self.session_head[rows] = session_head
+        self.n_session[rows] = n_session
+
+    def set_user_rep(self, uId: str, rep: np.ndarray) -> bool:
+        """ユーザ表現の追加/更新
+
+        Args:
+            uId (str): ユーザID
+            rep (np.ndarray): ユーザ表現
+
+        Returns:
+            bool: 新規追加 -> True
+        """
+        urow = self.urow_by_uId.get(uId)
+        is_new = urow is None
+
+        if is_new:
+            if self.n_user_rep == self.user_mat.shape[0]:
+                self.__grow_user()
+            urow = self.n_user_rep
+            self.urow_by_uId[uId] = urow
+            self.uId_by_urow[urow] = uId
+            self.n_user_rep += 1
+
+        self.user_mat[urow] = rep
+        return is_new
+
+    def get_user_rep(self, uId: str) -> Union[np.ndarray, None]:
+        """ユーザ表現取得（ビュー）
+
+        Args:
+            uId (str): ユーザID
+
+        Returns:
+            Union[np.ndarray, None]: ユーザ表現（未構築時はNone）
+        """
+        urow = self.urow_by_uId.get(uId)
+        if urow is None:
+            return None
+        return self.user_mat[urow]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """保存用配列取得（スナップショット用）
+
+        Returns:
+            Dict[str, np.ndarray]: 各表現・対応ID配列（使用領域のみ）
+        """
+        return dict(uIds=np.array(list(self.row_by_uId.keys()), dtype=str),
+                    session_mat=self.session_mat[:self.n_user], session_head=self.session_head[:self.n_user],
+                    n_session=self.n_session[:self.n_user],
+                    urow_uIds=np.array(self.uIds_with_rep.tolist(), dtype=str), user_mat=self.user_reps)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], capacity=1024) -> 'UserRepStore':
+        """保存用配列からのストア復元
+
+        Args:
+            arrays (Dict[str, np.ndarray]): to_arrays()により取得した配列
+            capacity (int, optional): 最小確保ユーザ数．Defaults to 1024.
+
+        Returns:
+            UserRepStore: 復元したストア
+        """
+        n_user, context_size, dim = arrays['session_mat'].shape
+        n_user_rep = len(arrays['urow_uIds'])
+        store = cls(dim=dim, context_size=context_size, capacity=max(capacity, n_user, n_user_rep))
+
+        uIds, urow_uIds = arrays['uIds'].tolist(), arrays['urow_uIds'].tolist()
+        store.session_mat[:n_user] = arrays['session_mat']
+        store.session_head[:n_user] = arrays['session_head']
+        store.n_session[:n_user] = arrays['n_session']
+        store.row_by_uId = dict(zip(uIds, range(n_user)))
+        store.n_user = n_user
+
+        store.user_mat[:n_user_rep] = arrays['user_mat']
+        store.uId_by_urow[:n_user_rep] = urow_uIds
+        store.urow_by_uId = dict(zip(urow_uIds, range(n_user_rep)))
+        store.n_user_rep = n_user_rep
+        return store
@@ -0,0 +1,116 @@
+from logging import getLogger, StreamHandler, DEBUG, Formatter
+from typing import Any, Callable, Dict
+from threading import Condition, Lock, Thread
+from pathlib import Path
+import time
+from backend.doc2vecwrapper import Doc2VecWrapper
+from backend.sbrs import ProposalSystem, get_prop_sbrs
+
+# ロガー設定
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+handler.setFormatter(Formatter('[shisho] %(asctime)s - %(message)s'))
+
+
+class RetrainWorker():
+    """Doc2Vecモデル・提案SBRSのバックグラウンド再訓練
+
+    再訓練要求はキューイングせずに1件へまとめる（実行中の要求は実行後にもう1回だけ再訓練）．
+    モデルは別ファイル（*.next.*）に訓練し，そのモデルから提案SBRSを再構築して訓練中の閲覧履歴を反映した上で，
+    lockを取得して本番パスへの置換とon_swapによる稼働中のDoc2Vecモデル・提案SBRSの差し替えをまとめて行う．
+    置換から差し替えまでの間に稼働中のモデルが書籍を追加・削除する（置換後のファイルを上書きする）ことはない．
+    """
+
+    def __init__(self, model_path: Path, on_swap: Callable[[Doc2VecWrapper, ProposalSystem], None], lock: Lock):
+        """インスタンス生成時の初期化処理（ワーカースレッド起動）
+
+        Args:
+            model_path (Path): モデルファイルパス
+            on_swap (Callable[[Doc2VecWrapper, ProposalSystem], None]): 再訓練したDoc2Vecモデル・提案SBRSへの差し替え処理
+            lock (Lock): 稼働中のDoc2Vecモデル・提案SBRSの排他制御（書籍の登録・削除処理と共有）
+        """
+        self.model_path = model_path
+        self.staging_path = model_path.with_name(model_path.stem + '.next' + model_path.suffix)  # 訓練先モデルファイルパス
+        self.on_swap = on_swap
+        self.lock = lock
+
+        self.__cond = Condition()
+        self.__pending = False  # 未処理の再訓練要求あり -> True
+        self.__status = dict(state='idle', n_request=0, n_coalesced=0, n_done=0, n_failed=0, last_reason=None,
+                             started_at=None, finished_at=None, last_duration=None, last_error=None)
+
+        self.__thread = Thread(target=self.__run, name='retrain-worker', daemon=True)
+        self.__thread.start()
+
+    def request(self, reason: str) -> bool:
+        """再訓練要求
+
+        Args:
+            reason (str): 要求理由（状態表示用）
+
+        Returns:
+            bool: 新規要求として受付 -> True（未処理の要求にまとめた -> False）
+        """
+        with self.__cond:
+            self.__status['n_request'] += 1
+            self.__status['last_reason'] = reason
+            if self.__pending:
+                self.__status['n_coalesced'] += 1
+                return False
+            self.__pending = True
+            self.__cond.notify()
+        logger.debug('再訓練を要求しました (理由: {0})'.format(reason))
+        return True
+
+    def get_status(self) -> Dict[str, Any]:
+        """再訓練状態取得（監視用）
+
+        Returns:
+            Dict[str, Any]: 状態（idle or running）・要求数・まとめた要求数・成功/失敗数・直近の開始/終了時刻・所要時間・エラー
+        """
+        with self.__cond:
+            return dict(self.__status, pending=self.__pending)
+
+    def __run(self) -> None:
+        """ワーカースレッド本体
+        """
+        while True:
+            with self.__cond:
+                while not self.__pending:
+                    self.__cond.wait()
+                self.__pending = False
+                self.__status.update(state='running', started_at=time.time())
+
+            started = time.perf_counter()
+            try:
+                self.__retrain()
+            except Exception as e:
+                logger.exception('再訓練に失敗しました')
+                with self.__cond:
+                    self.__status['n_failed'] += 1
+                    self.__status['last_error'] = repr(e)
+            else:
+                with self.__cond:
+                    self.__status['n_done'] += 1
+                    self.__status['last_error'] = None
+            finally:
+                with self.__cond:
+                    self.__status.update(state='idle', finished_at=time.time(), last_duration=time.perf_counter() - started)
+
+    def __retrain(self) -> None:
+        """再訓練 -> 提案SBRS再構築 -> 本番パスへ置換・差し替え
+        """
+        d2v = Doc2VecWrapper(model_path=self.staging_path, initialize=True)
+        d2v.train()
+
+        prop_sbrs = get_prop_sbrs(d2v=d2v)
+        n_log = prop_sbrs.catch_up()    # 再構築中に記録された閲覧履歴の反映
+        with self.lock:
+            n_log += prop_sbrs.catch_up()   # ロック取得待ちの間に記録された閲覧履歴の反映
+            d2v.promote(model_path=self.model_path)
+            self.on_swap(d2v, prop_sbrs)
+        logger.debug('Doc2Vecモデル・提案SBRSを差し替えました (書籍数: {0}, 追加反映ログ数: {1})'.format(len(d2v.bv), n_log))
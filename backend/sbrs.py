@@ -1,16 +1,20 @@
 from logging import getLogger, StreamHandler, DEBUG, Formatter
 import sys
+import os
+import hashlib
 from pathlib import Path
-from typing import Union
+from typing import Dict, Union
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import NearestNeighbors
 from backend.doc2vecwrapper import Doc2VecWrapper
-from backend.db import get_history_df, History
+from backend.db import get_history_df, get_closed_history_df, History
+from backend.repstore import UserRepStore
+from backend.knn import IncrementalKNNIndex, construct_book_index
+from backend.bulklearn import learn_reps_parallel
 
 parent_dir = str(Path(__file__).parent.parent.resolve())
 sys.path.append(parent_dir)
-from config import get_config
+from config import get_sbrs_config
 
 # ロガー設定
 logger = getLogger(__name__)
@@ -21,6 +25,8 @@ logger.addHandler(handler)
 logger.propagate = False
 handler.setFormatter(Formatter('[shisho:SBRS] %(asctime)s - %(message)s'))
 
+SNAPSHOT_VERSION = 1    # スナップショット形式バージョン（形式変更時にインクリメント）
+
 
 def calc_similarity(rep_1: np.ndarray, rep_2: np.ndarray) -> float:
     """ベクトル間のコサイン類似度の計算
@@ -34,30 +40,139 @@ def calc_similarity(rep_1: np.ndarray, rep_2: np.ndarray) -> float:
     return cos_sim
 
 
+def update_session_rep_by_cos(session_rep: np.ndarray, book_rep: np.ndarray) -> np.ndarray:
+    """セッション表現更新法: コサイン類似度 (COSine similarity)
+
+    Args:
+        session_rep (np.ndarray): 最新セッション表現
+        book_rep (np.ndarray): 出現書籍表現
+
+    Returns:
+        np.ndarray: 更新後セッション表現
+    """
+    # 最新セッション表現と出現書籍表現のコサイン類似度の絶対値をセッション表現更新用重みとする
+    weight = abs(calc_similarity(rep_1=session_rep, rep_2=book_rep))
+    return weight * session_rep + book_rep  # TODO: 4種類の計算方法追加
+
+
+# セッション表現更新法（TODO: 順序差減衰 (Order Decay Difference: 'odd') の実装）
+SESSION_REP_UPDATE_METHODS = {
+    'cos': update_session_rep_by_cos,
+}
+
+# リアルタイムユーザ表現構築法（引数: 最新セッション表現，ユーザ表現，両者のコサイン類似度の絶対値）
+RTUSER_REP_CONSTRUCT_METHODS = {
+    'avg-session': lambda srep, urep, weight: weight * srep + (1 - weight) * urep,  # 加重平均（セッション軸）
+    'avg-user': lambda srep, urep, weight: (1 - weight) * srep + weight * urep,     # 加重平均（ユーザ軸）
+    'sum-session': lambda srep, urep, weight: weight * srep + urep,                 # 加重和（セッション軸）
+    'sum-user': lambda srep, urep, weight: srep + weight * urep,                    # 加重和（ユーザ軸）
+}
+
+
+def get_book_fingerprint(d2v: Doc2VecWrapper) -> str:
+    """書籍表現のフィンガープリント取得（スナップショットとDoc2Vecモデルの対応確認用）
+
+    Args:
+        d2v (Doc2VecWrapper): Doc2Vec（書籍表現管理）
+
+    Returns:
+        str: 書籍ID・書籍表現のハッシュ値
+    """
+    h = hashlib.sha1()
+    h.update('\n'.join(d2v.bv.index_to_key).encode('utf-8'))
+    h.update(np.ascontiguousarray(d2v.bv.vectors).data)
+    return h.hexdigest()
+
+
+def load_snapshot(path: Union[Path, None], d2v: Doc2VecWrapper, context_size: int) -> Union[Dict[str, np.ndarray], None]:
+    """提案SBRSスナップショット読み込み
+
+    Args:
+        path (Union[Path, None]): スナップショットパス（None -> スナップショットなし）
+        d2v (Doc2VecWrapper): 学習済Doc2Vecモデル
+        context_size (int): コンテキストセッション数
+
+    Returns:
+        Union[Dict[str, np.ndarray], None]: スナップショット（存在しない・形式/モデル/設定が異なる -> None）
+    """
+    if (path is None) or (not path.exists()):
+        return None
+
+    try:
+        with np.load(path) as npz:
+            snapshot = dict(npz)
+    except (OSError, ValueError) as e:
+        logger.debug('スナップショットの読み込みに失敗しました: {0}'.format(e))
+        return None
+
+    if int(snapshot['version']) != SNAPSHOT_VERSION:
+        logger.debug('スナップショットの形式バージョンが異なるため破棄します')
+        return None
+    if str(snapshot['fingerprint']) != get_book_fingerprint(d2v=d2v):
+        logger.debug('スナップショット作成時とDoc2Vecモデルが異なるため破棄します')
+        return None
+    if snapshot['session_mat'].shape[1] != context_size:
+        logger.debug('スナップショット作成時とコンテキストサイズが異なるため破棄します')
+        return None
+
+    return snapshot
+
+
 class ProposalSystem():
     """提案SBRS
     """
 
-    def __init__(self, train_df: pd.core.frame.DataFrame, d2v: Doc2VecWrapper):
+    def __init__(self, train_df: pd.core.frame.DataFrame, d2v: Doc2VecWrapper, snapshot=None):
         """インスタンス生成時の初期化処理
 
         Args:
-            train_df (pd.core.frame.DataFrame): 訓練セット（過去の閲覧履歴）
+            train_df (pd.core.frame.DataFrame): 訓練セット（過去の閲覧履歴，スナップショット指定時は差分）
             d2v (Doc2VecWrapper): Doc2Vec（書籍表現管理）
+            snapshot (Dict[str, np.ndarray], optional): 復元するスナップショット．Defaults to None.
         """
         # 訓練済みDodc2Vecモデルのみ受付
         if not d2v.is_trained:
             logger.exception('Doc2Vecモデルが未訓練状態です')
         self.d2v = d2v
 
-        self.params = get_config()['sbrs']          # 提案SBRSハイパーパラメータ設定
+        self.params = get_sbrs_config()             # 提案SBRSハイパーパラメータ設定
+
+        # 各表現の構築/更新法・推薦書籍探索法（設定から関数を解決しておく）
+        self.update_session_rep = SESSION_REP_UPDATE_METHODS.get(self.params.session_rep.update_method)
+        if self.update_session_rep is None:
+            logger.exception('指定したセッション表現構築法"{}"は未定義です'.format(self.params.session_rep.update_method))
+        self.construct_rtuser_rep = RTUSER_REP_CONSTRUCT_METHODS.get(self.params.rtuser_rep.construct_method)
+        if self.construct_rtuser_rep is None:
+            logger.exception('指定したリアルタイムユーザ表現構築法"{0}"は未定義です'.format(self.params.rtuser_rep.construct_method))
+        self.search_books = {'nn': self.search_nn_books, 'cf': self.search_cf_books}.get(self.params.search.method)
+        if self.search_books is None:
+            logger.exception('指定した推薦アイテム探索法"{0}"は未定義です'.format(self.params.search.method))
         self.train_df = train_df                    # 訓練セット
         self.uIds = set(train_df['uId'].unique())   # ユーザID集合
 
-        self.users = dict()  # ProposalUserインスタンス集合
+        self.user_knn_model = None  # ユーザKNNモデル（ユーザ表現数2以上で構築）
+        self.last_log_id = 0        # 学習済ログID（最大値）
+        self.open_log_ids = dict()  # セッション末尾未確定ログID（ユーザID -> 反映済＆セッション末尾未確定の最新ログのID）
+        self.users = dict()         # ProposalUserインスタンス集合
+
+        if snapshot is None:
+            # ユーザ/セッション表現ストア
+            self.rep_store = UserRepStore(dim=self.d2v.bv.vector_size, context_size=self.params.user_rep.context_size)
+        else:
+            # スナップショットから各表現・ユーザ状態を復元
+            self.rep_store = UserRepStore.from_arrays(arrays=snapshot)
+            self.last_log_id = int(snapshot['last_log_id'])
+            self.open_log_ids = dict(zip(snapshot['open_uIds'].tolist(), snapshot['open_log_ids'].tolist()))
+            for uId, latest_sId, prv_bId in zip(snapshot['uIds'].tolist(), snapshot['latest_sIds'].tolist(), snapshot['prv_bIds'].tolist()):
+                self.uIds.add(uId)
+                self.users[uId] = ProposalUser(uId=uId, prop_sys=self)
+                self.users[uId].latest_sId = latest_sId
+                self.users[uId].prv_bId = prv_bId if prv_bId != '' else None
+
         # 訓練セットに含まれる全ユーザ分のProposalUserクラス（提案システム用のユーザクラス）のインスタンス生成
         for uId in self.uIds:
-            self.users[uId] = ProposalUser(uId=uId, prop_sys=self)
+            if uId not in self.users:
+                self.users[uId] = ProposalUser(uId=uId, prop_sys=self)
 
     @property
     def n_constructed_book(self) -> int:
@@ -75,7 +190,25 @@ class ProposalSystem():
         Returns:
             int: ユーザ表現数算出
         """
-        return len(self.user_reps)
+        return self.rep_store.n_user_rep
+
+    @property
+    def user_reps(self) -> np.ndarray:
+        """ユーザ表現行列取得（ビュー）
+
+        Returns:
+            np.ndarray: ユーザ表現行列（行はuId_by_uIdxと対応）
+        """
+        return self.rep_store.user_reps
+
+    @property
+    def uId_by_uIdx(self) -> np.ndarray:
+        """ユーザIX対応IDリスト取得（ビュー）
+
+        Returns:
+            np.ndarray: ユーザIX対応IDリスト
+        """
+        return self.rep_store.uIds_with_rep
 
     def get_book_rep(self, bId: str) -> Union[np.ndarray, None]:
         """書籍表現取得
@@ -97,35 +230,257 @@ class ProposalSystem():
     def construct_book_knn_model(self) -> None:
         """書籍KNNモデル構築
         """
-        book_knn_model = NearestNeighbors(n_neighbors=min(self.params['search']['k_book'] + 1, self.n_constructed_book))
-        self.book_knn_model = book_knn_model.fit(np.array(self.d2v.bv[self.d2v.bv.index_to_key]))
+        # コサイン類似度による探索（sbrs.search.index: exact -> 全探索，ivf -> 近似探索）
+        self.book_knn_model = construct_book_index(vectors=self.d2v.bv.vectors, n_neighbors=self.params.search.k_book + 1,
+                                                   index=self.params.search.index, ivf_params=self.params.search.ivf)
         self.bId_by_bIdx = np.array(self.d2v.bv.index_to_key)   # 書籍IX対応IDリスト
+        self.is_deleted = np.isin(self.bId_by_bIdx, list(self.d2v.deleted))  # 削除書籍（トゥームストーン）マスク
+        self.n_deleted = int(self.is_deleted.sum())                             # 削除書籍数
+
+    def add_book(self, bId: str) -> None:
+        """新規登録書籍の書籍KNNモデルへの追加（Doc2VecWrapper.add_bookによる書籍ベクトル追加後に呼び出す）
+
+        Args:
+            bId (str): 書籍ID（ISBN-10）
+        """
+        bIdx = self.d2v.bv.key_to_index[bId]
+        if bIdx == len(self.bId_by_bIdx):   # 末尾に追加された書籍 -> 追記
+            self.book_knn_model.add(self.d2v.bv.vectors[bIdx:bIdx + 1])
+            self.bId_by_bIdx = np.append(self.bId_by_bIdx, bId)
+            self.is_deleted = np.append(self.is_deleted, False)
+        else:                               # 書籍ベクトル置換（再登録） -> 再構築
+            self.construct_book_knn_model()
+
+    def delete_book(self, bId: str) -> None:
+        """書籍削除（トゥームストーン: 次回再訓練まで推薦対象外とし，探索時は削除書籍数分多く取得して除外）
+
+        Args:
+            bId (str): 書籍ID（ISBN-10）
+        """
+        bIdx = self.d2v.bv.key_to_index.get(bId)
+        if (bIdx is not None) and (bIdx < len(self.is_deleted)) and (not self.is_deleted[bIdx]):
+            self.is_deleted[bIdx] = True
+            self.n_deleted += 1
 
     def construct_user_knn_model(self) -> None:
-        """ユーザKNNモデル構築
+        """ユーザKNNモデル構築（追記型インデックス）
         """
-        user_knn_model = NearestNeighbors(n_neighbors=min(self.params['search']['k_user'] + 1, self.n_constructed_user))
-        self.user_knn_model = user_knn_model.fit(np.array(list(self.user_reps.values())))
-        self.uId_by_uIdx = np.array(list(self.users.keys()))    # ユーザIX対応IDリスト
+        self.user_knn_model = IncrementalKNNIndex(get_vectors=lambda: self.user_reps, n_neighbors=self.params.search.k_user + 1,
+                                                  compact_size=self.params.search.compact_size,
+                                                  rebuild_interval=self.params.search.rebuild_interval,
+                                                  index=self.params.search.index, ivf_params=self.params.search.ivf)
 
-    def learn(self) -> None:
-        """提案システム学習（各表現の構築/更新）
+    def insert_user_knn(self) -> None:
+        """ユーザKNNモデルへの新規ユーザ表現追加（再構築なし）
         """
-        self.user_reps = dict()  # ユーザ表現集合
+        if self.user_knn_model is None:
+            # 未構築＆ユーザ表現数2以上（最低でも自身含む最近傍） -> ユーザKNNモデル構築
+            if self.n_constructed_user > 1:
+                self.construct_user_knn_model()
+        else:
+            self.user_knn_model.insert(idx=self.n_constructed_user - 1)
 
-        for log in self.train_df.itertuples():
-            book_rep = self.get_book_rep(bId=log.bId)   # 書籍表現
+    def update_user_knn(self, uId: str) -> None:
+        """ユーザKNNモデルへのユーザ表現更新反映（再構築なし）
 
-            if book_rep is None:    # 書籍表現取得失敗 -> 各表現の更新・構築行わない
-                continue
+        Args:
+            uId (str): ユーザ表現を更新したユーザのID
+        """
+        if self.user_knn_model is not None:
+            self.user_knn_model.update(idx=self.rep_store.urow_by_uId[uId])
+
+    def search_nn_books(self, rtuser_rep: np.ndarray, uId: str, bId: str) -> np.ndarray:
+        """NN型推薦書籍探索
 
-            self.users[log.uId].update_reps(log=log)    # ログをもつユーザのセッション・ユーザ表現の更新・構築
+        Args:
+            rtuser_rep (np.ndarray): リアルタイムユーザ表現
+            uId (str): 対象ユーザID
+            bId (str): 出現書籍ID（推薦対象外）
+
+        Returns:
+            np.ndarray: 推薦書籍集合（近傍順）
+        """
+        # リアルタイムユーザ表現近傍（k_book+1+削除書籍数）書籍インデックス -> 削除書籍除外 -> ID変換 -> 出現書籍除外 -> 先頭k_book個取得
+        nn_books_idx = self.book_knn_model.search(rtuser_rep, n_neighbors=self.params.search.k_book + 1 + self.n_deleted)
+        nn_books = self.bId_by_bIdx[nn_books_idx[~self.is_deleted[nn_books_idx]]]
+        return nn_books[bId != nn_books][:self.params.search.k_book]
+
+    def search_cf_books(self, rtuser_rep: np.ndarray, uId: str, bId: str) -> np.ndarray:
+        """CF型推薦書籍探索（書籍近傍探索は1回の一括探索）
+
+        Args:
+            rtuser_rep (np.ndarray): リアルタイムユーザ表現
+            uId (str): 対象ユーザID
+            bId (str): 出現書籍ID（推薦対象外）
+
+        Returns:
+            np.ndarray: 推薦書籍集合（共通近傍書籍優先 -> 近傍順）
+        """
+        k_book, k_user = self.params.search.k_book, self.params.search.k_user   # 近傍書籍数，近傍ユーザ数
+
+        # リアルタイムユーザ表現近傍（k_user+1）ユーザインデックス -> 自身除外 -> 先頭k_user人取得
+        nn_users_idx = self.user_knn_model.kneighbors(rtuser_rep[np.newaxis, :], return_distance=False)[0]
+        nn_users_idx = nn_users_idx[self.uId_by_uIdx[nn_users_idx] != uId][:k_user]
+
+        # [リアルタイムユーザ表現; 近傍ユーザ表現] の近傍（k_book+1+削除書籍数）書籍インデックスを一括探索
+        queries = np.vstack([rtuser_rep[np.newaxis, :], self.user_reps[nn_users_idx]])
+        nn_books_idx = self.book_knn_model.search(queries, n_neighbors=k_book + 1 + self.n_deleted)
+        is_alive = ~self.is_deleted[nn_books_idx]               # 削除書籍除外
+        cand_books_idx = nn_books_idx[0][is_alive[0]][:k_book + 1]  # リアルタイムユーザ表現近傍書籍（推薦候補，先頭k_book+1個）
+        # 近傍ユーザ表現の近傍書籍（各先頭k_book個）
+        nn_books_idx_by_nn_users = nn_books_idx[1:][is_alive[1:] & (np.cumsum(is_alive[1:], axis=1) <= k_book)]
+
+        # 出現書籍除外 -> 共通近傍書籍を優先（安定ソートにより各グループ内は近傍順を維持） -> 先頭k_book個取得
+        cand_books_idx = cand_books_idx[self.bId_by_bIdx[cand_books_idx] != bId]
+        is_common = np.isin(cand_books_idx, nn_books_idx_by_nn_users)
+        recommended_books_idx = cand_books_idx[np.argsort(~is_common, kind='stable')][:k_book]
+
+        return self.bId_by_bIdx[recommended_books_idx]
+
+    def learn(self) -> None:
+        """提案システム学習（各表現の構築/更新）
+        """
+        # 一括学習指定＆学習済ログなし（スナップショット未復元）＆一括学習対応セッション表現更新法 -> 一括学習
+        # それ以外 -> ログごとに逐次反映
+        if (self.params.learn.method == 'bulk') and (self.last_log_id == 0) and (self.update_session_rep is update_session_rep_by_cos):
+            self.__learn_bulk()
+        else:
+            self.__learn_stream()
+
+        if len(self.train_df):
+            self.last_log_id = max(self.last_log_id, int(self.train_df.index.max()))
 
         self.construct_book_knn_model()  # 書籍KNNモデル構築
 
         if self.n_constructed_user > 1:  # ユーザ表現数2以上（最低でも自身含む最近傍） -> ユーザKNNモデル構築
             self.construct_user_knn_model()
 
+    def catch_up(self) -> int:
+        """学習以降に記録された閲覧履歴の反映（再訓練した提案SBRSへの差し替え直前用）
+
+        Returns:
+            int: 反映したログ数
+        """
+        self.train_df = get_history_df(min_id=self.last_log_id)
+        for uId in set(self.train_df['uId'].unique()) - self.uIds:  # 新規ユーザ -> 提案SBRS用ユーザインスタンス生成
+            self.uIds.add(uId)
+            self.users[uId] = ProposalUser(uId=uId, prop_sys=self)
+        self.__learn_stream()
+
+        if len(self.train_df):
+            self.last_log_id = max(self.last_log_id, int(self.train_df.index.max()))
+        return len(self.train_df)
+
+    def __learn_stream(self) -> None:
+        """訓練セットのログごとの逐次反映
+        """
+        for log in self.train_df.itertuples():
+            self.__apply_log(log_id=log.Index, log=log)     # ログをもつユーザのセッション・ユーザ表現の更新・構築
+
+    def __learn_bulk(self) -> None:
+        """訓練セットの一括反映（ユーザごとにまとめて配列演算，逐次反映と同じ結果）
+
+        sbrs.learn.workersが2以上ならユーザ単位でシャーディングして複数プロセスで並列に構築する．
+        """
+        df = self.train_df
+        bIdx = df['bId'].map(self.d2v.bv.key_to_index)     # 書籍番号（書籍表現未構築 -> NaN）
+        last_log_ids = pd.Series(df.index.to_numpy(), index=df['uId'].to_numpy()).groupby(level=0).max()  # ユーザごとの最終ログID
+        has_rep = bIdx.notna().to_numpy()                   # 書籍表現取得失敗ログは各表現の更新・構築行わない
+
+        log_ids = df.index.to_numpy()[has_rep]
+        uIdx, uIds = pd.factorize(df['uId'].to_numpy()[has_rep])
+        order = np.lexsort((log_ids, uIdx))     # ユーザごと・ログID順に整列
+        result = learn_reps_parallel(uIdx=uIdx[order], sIds=df['sId'].to_numpy()[has_rep][order],
+                                     bIdx=bIdx.to_numpy()[has_rep].astype(np.int64)[order],
+                                     is_last=df['isLast'].fillna(False).to_numpy(dtype=bool)[has_rep][order], log_ids=log_ids[order],
+                                     book_mat=self.d2v.bv.vectors, context_size=self.rep_store.context_size,
+                                     n_workers=self.params.learn.workers)
+        self.__apply_learn_result(result=result, uIds=uIds, last_log_ids=last_log_ids.to_dict())
+
+    def __apply_learn_result(self, result: Dict[str, np.ndarray], uIds: np.ndarray, last_log_ids: Dict[str, int]) -> None:
+        """一括構築結果の反映
+
+        Args:
+            result (Dict[str, np.ndarray]): learn_reps_parallelによる構築結果
+            uIds (np.ndarray): ユーザ番号 -> ユーザID
+            last_log_ids (Dict[str, int]): ユーザID -> 最終ログID（書籍表現取得失敗・直前と同じ書籍のログ含む）
+        """
+        bId_by_bIdx = self.d2v.bv.index_to_key
+        rows = []
+        for u, latest_sId, prv_bIdx, open_log_id in zip(result['uIdx'], result['latest_sIds'], result['prv_bIdx'], result['open_log_ids']):
+            user = self.users[uIds[u]]
+            user.latest_sId, user.prv_bId = latest_sId, bId_by_bIdx[prv_bIdx]
+            if open_log_id == last_log_ids[user.uId]:  # 最終ログが反映済＆セッション末尾未確定 -> 記録（逐次反映と同じ）
+                self.open_log_ids[user.uId] = int(open_log_id)
+            rows.append(user.row)
+        self.rep_store.set_session_reps(rows=np.array(rows, dtype=np.int64), session_mat=result['session_mat'],
+                                        session_head=result['session_head'], n_session=result['n_session'])
+
+        # ユーザ表現は初回構築順に追加（逐次反映時とユーザIXを揃える）
+        for i in np.argsort(result['first_rep_log_ids'], kind='stable'):
+            self.rep_store.set_user_rep(uId=uIds[result['rep_uIdx'][i]], rep=result['user_reps'][i])
+
+    def __apply_log(self, log_id: int, log: History) -> None:
+        """ログの反映（各表現の構築/更新＋セッション末尾未確定ログの記録）
+
+        Args:
+            log_id (int): ログID
+            log (History): ログ
+        """
+        self.__close_open_log(log=log)
+        if self.get_book_rep(bId=log.bId) is None:  # 書籍表現取得失敗 -> 各表現の更新・構築行わない
+            return
+
+        # 反映＆セッション末尾未確定 -> 後からセッション末尾として確定する可能性あり（次のログ or スナップショット復元時に確認）
+        # 直前と同じ書籍のためスキップ -> このログが確定しても全履歴からの学習ではユーザ表現を構築/更新しない
+        if self.users[log.uId].update_reps(log=log) and (not log.isLast):
+            self.open_log_ids[log.uId] = log_id
+
+    def __close_open_log(self, log: History) -> None:
+        """ログと同じユーザの末尾未確定ログの確認（このログが最新ログとなるため記録から除く）
+
+        末尾未確定ログ以降にセッションが変更されていれば，そのログはセッション末尾として確定済である
+        （change_session・update_sessionはセッションID変更時にユーザの最新ログをセッション末尾とする）．
+        全履歴から学習した場合と同じく，新しいセッションの反映前にユーザ表現を構築/更新する．
+
+        Args:
+            log (History): ログ
+        """
+        user = self.users[log.uId]
+        if (self.open_log_ids.pop(log.uId, None) is not None) and (log.sId != user.latest_sId):
+            user.construct_user_rep(sId=user.latest_sId)
+
+    def close_sessions(self, closed_df: pd.core.frame.DataFrame) -> None:
+        """反映後にセッション末尾として確定したログによるユーザ表現の構築/更新（スナップショット復元時）
+
+        Args:
+            closed_df (pd.core.frame.DataFrame): セッション末尾確定ログ（open_log_idsに含まれるもの，ユーザごとに高々1件）
+        """
+        for log in closed_df.itertuples():
+            if self.open_log_ids.get(log.uId) != log.Index:
+                continue
+            self.open_log_ids.pop(log.uId)
+            self.users[log.uId].construct_user_rep(sId=log.sId)
+
+    def save_snapshot(self, path: Path) -> None:
+        """提案SBRSスナップショット保存（一時ファイルへ書き込み後に置換）
+
+        Args:
+            path (Path): スナップショットパス
+        """
+        arrays = self.rep_store.to_arrays()
+        users = [self.users[uId] for uId in arrays['uIds'].tolist()]
+
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, mode='wb') as f:
+            np.savez(f, version=SNAPSHOT_VERSION, fingerprint=get_book_fingerprint(d2v=self.d2v), last_log_id=self.last_log_id,
+                     latest_sIds=np.array([user.latest_sId for user in users], dtype=str),
+                     prv_bIds=np.array([user.prv_bId or '' for user in users], dtype=str),
+                     open_uIds=np.array(list(self.open_log_ids.keys()), dtype=str),
+                     open_log_ids=np.array(list(self.open_log_ids.values()), dtype=np.int64), **arrays)
+        os.replace(tmp_path, path)
+        logger.debug('スナップショットを保存しました (last_log_id: {0})'.format(self.last_log_id))
+
     def update(self, log: History, return_rec=True) -> Union[np.ndarray, None]:
         """提案SBRS更新（ログから各表現更新 -> 必要に応じて推薦書籍集合生成）
 
@@ -139,7 +494,8 @@ class ProposalSystem():
         if self.users.get(log.uId) is None:  # 新規ユーザ -> 提案SBRS用ユーザインスタンス生成
             self.uIds.add(log.uId)
             self.users[log.uId] = ProposalUser(uId=log.uId, prop_sys=self)
-        self.users[log.uId].update_reps(log=log)    # 各表現更新（or 構築）
+        self.__apply_log(log_id=log.id, log=log)    # 各表現更新（or 構築）
+        self.last_log_id = max(self.last_log_id, log.id)
 
         # ユーザKNNモデル構築済＆出現書籍表現構築済 -> 推薦書籍集合生成
         if return_rec and (self.user_knn_model is not None) and (self.get_book_rep(bId=log.bId) is not None):
@@ -160,53 +516,55 @@ class ProposalUser():
             uId (str): ユーザID
             prop_sys (ProposalSystem): このユーザを管理する提案SBRS
         """
-        self.sIds = ['*']           # セッションID集合
-        self.session_reps = dict()  # セッション表現集合
+        self.latest_sId = '*'       # 最新セッションID
         self.uId = uId              # ユーザID
-        self.user_rep = None        # ユーザ表現
 
         self.prop_sys = prop_sys            # このユーザを管理する提案SBRS
         self.params = self.prop_sys.params  # 提案SBRSハイパーパラメータ設定
         self.prv_bId = None                 # 直前閲覧書籍ID（ISBN-10）（同書籍連続時の例外処理のため）
 
+        self.rep_store = self.prop_sys.rep_store        # 表現ストア
+        self.row = self.rep_store.add_user(uId=uId)     # 表現ストアにおけるセッション表現行
+
     @ property
-    def latest_sId(self) -> str:
-        """最新セッションID取得
+    def user_rep(self) -> Union[np.ndarray, None]:
+        """ユーザ表現取得（ビュー）
 
         Returns:
-            str: 最新セッションID
+            Union[np.ndarray, None]: ユーザ表現（未構築時はNone）
         """
-        return self.sIds[-1]
+        return self.rep_store.get_user_rep(uId=self.uId)
 
     @ property
     def latest_session_rep(self) -> np.ndarray:
-        """最新セッション表現取得
+        """最新セッション表現取得（ビュー）
 
         Returns:
             np.ndarray: 最新セッション表現
         """
-        rep = self.session_reps[self.latest_sId].copy()
-        return rep
+        return self.rep_store.get_latest_session_rep(row=self.row)
 
-    def update_reps(self, log: History) -> None:
+    def update_reps(self, log: History) -> bool:
         """各表現の構築/更新
 
         Args:
             log (History): ログ
+
+        Returns:
+            bool: ログを反映 -> True（直前と同じ書籍のためスキップ -> False）
         """
         # 直前に閲覧した書籍と同じ -> 各表現の構築/更新スキップ
         if (self.prv_bId is not None) and (log.bId == self.prv_bId):
-            return
+            return False
         self.prv_bId = log.bId  # 直前閲覧書籍ID更新
 
         self.__construct_session_rep(sId=log.sId, bId=log.bId)  # セッション表現の構築/更新
 
-        # 現在のセッションのセッション表現構築済＆セッション末尾ログ -> ユーザ表現の構築/更新
-        if (self.session_reps[log.sId] is not None) and log.isLast:
-            success_construct_user_rep = self.construct_user_rep(sId=log.sId)   # ユーザ表現の構築/更新試行
-            if success_construct_user_rep:
-                # 構築/更新成功 -> 提案システム管理ユーザ表現集合へ追加/更新
-                self.prop_sys.user_reps[self.uId] = self.user_rep.copy()
+        # 現在のセッションのセッション表現構築済＆セッション末尾ログ -> ユーザ表現の構築/更新（表現ストアへ直接書き込み）
+        if (log.sId == self.latest_sId) and log.isLast:
+            self.construct_user_rep(sId=log.sId)
+
+        return True
 
     def __construct_session_rep(self, sId: str, bId: str) -> bool:
         """セッション表現の構築/更新
@@ -225,30 +583,13 @@ class ProposalUser():
 
         if sId != self.latest_sId:
             # 現在のセッションIDと最新セッション表現と対応するIDが異なる -> 新規セッション -> セッション表現構築
-            self.sIds.append(sId)
-            self.session_reps[sId] = book_rep.copy()    # 出現書籍表現により構築
+            self.latest_sId = sId
+            self.rep_store.push_session_rep(row=self.row, rep=book_rep)    # 出現書籍表現により構築
             logger.debug('uId:{0}/sId:{1}/bId:{2} -> Construct session rep.'.format(self.uId, sId, bId))
         else:
-            # セッション表現更新
-            srep_cm = self.params['session_rep']['update_method']    # セッション表現更新法
-
-            if srep_cm == 'cos':
-                # セッション表現更新法: コサイン類似度 (COSine similarity)
-
-                # 最新セッション表現と出現書籍表現のコサイン類似度
-                sim = calc_similarity(rep_1=self.latest_session_rep, rep_2=book_rep)
-                weight = abs(sim)   # セッション表現更新用重み
-
-                # セッション表現更新（TODO: 4種類の計算方法追加）
-                updated_session_rep = weight * self.latest_session_rep + book_rep
-            elif srep_cm == 'odd':
-                # セッション表現構築法: 順序差減衰 (Order Decay Difference)
-                # TODO: 実装
-                pass
-            else:
-                logger.exception('指定したセッション表現構築法"{}"は未定義です'.format(srep_cm))
-
-            self.session_reps[self.latest_sId] = updated_session_rep    # セッション表現更新
+            # セッション表現更新（更新法はProposalSystem生成時に解決済）
+            updated_session_rep = self.prop_sys.update_session_rep(session_rep=self.latest_session_rep, book_rep=book_rep)
+            self.rep_store.set_latest_session_rep(row=self.row, rep=updated_session_rep)  # セッション表現更新
             logger.debug('uId:{0}/sId:{1}/bId:{2} -> Update session rep.'.format(self.uId, sId, bId))
 
         return True
@@ -268,31 +609,22 @@ class ProposalUser():
             return False
 
         if self.user_rep is None:   # ユーザ表現未構築 ->ユーザ表現構築
-            self.user_rep = self.latest_session_rep.copy()  # 最新セッション表現により構築
-            # 構築済ユーザ表現数増加（ただし2以上） -> ユーザKNNモデル再構築
-            if self.prop_sys.n_constructed_user > 1:
-                self.prop_sys.construct_user_knn_model()
+            self.rep_store.set_user_rep(uId=self.uId, rep=self.latest_session_rep)  # 最新セッション表現により構築
+            self.prop_sys.insert_user_knn()     # ユーザKNNモデルへ追加
             logger.debug('uId:{0}/sId:{0} -> Construct user rep.'.format(self.uId, sId))
         else:
             # ユーザ表現更新
-            context_size = self.params['user_rep']['context_size']  # コンテキストセッション数
-            if context_size < 1:
-                logger.exception('コンテキストサイズ（指定値: {}）は1以上の整数を指定してください'.format(context_size))
-            # 最新context_size個のセッションID取得（ただし，min{過去セッションID数, context_size})
-            context_sIds = self.sIds[1:][-context_size:]
-
-            weighted_rep_sum, weight_sum = np.zeros(100), 0.0    # セッション表現加重和，ユーザ表現更新用重み和
+            # 最新context_size個のセッション表現取得（ただし，min{過去セッション数, context_size}）（ビュー）
+            context_reps = self.rep_store.get_context_session_reps(row=self.row)
+            latest_rep = self.latest_session_rep
 
-            for sId in context_sIds:
-                srep = self.session_reps[sId]   # コンテキストに含まれるセッション表現の取得
-                sim = calc_similarity(rep_1=self.latest_session_rep, rep_2=srep)    # 最新セッション表現とのコサイン類似度計算
-                weight = abs(sim)   # ユーザ表現更新用重み
+            # 最新セッション表現と各コンテキストセッション表現のコサイン類似度（絶対値）をユーザ表現更新用重みとする
+            weights = np.abs(context_reps @ latest_rep) / (np.linalg.norm(context_reps, axis=1) * np.linalg.norm(latest_rep))
 
-                weighted_rep_sum += weight * srep
-                weight_sum += weight
-
-            updated_user_rep = weighted_rep_sum / weight_sum    # コンテキストセッション表現の加重平均によるユーザ表現計算
-            self.user_rep = updated_user_rep.copy()             # ユーザ表現更新
+            # コンテキストセッション表現の加重平均によるユーザ表現計算 -> ユーザ表現更新
+            updated_user_rep = (weights @ context_reps) / weights.sum()
+            self.rep_store.set_user_rep(uId=self.uId, rep=updated_user_rep)
+            self.prop_sys.update_user_knn(uId=self.uId)     # ユーザKNNモデルへ反映
             logger.debug('uId:{0}/sId:{1} -> Update user rep.'.format(self.uId, sId))
 
         return True
@@ -307,21 +639,14 @@ class ProposalUser():
         if self.user_rep is None:
             return self.latest_session_rep
 
+        session_rep, user_rep = self.latest_session_rep, self.user_rep
+
         # 最新セッション表現とユーザ表現のコサイン類似度計算
-        sim = calc_similarity(rep_1=self.latest_session_rep, rep_2=self.user_rep)
+        sim = calc_similarity(rep_1=session_rep, rep_2=user_rep)
         weight = abs(sim)   # リアルタイムユーザ表現構築用重み
 
-        rturep_cm = self.params['rtuser_rep']['construct_method']   # リアルタイムユーザ表現構築法
-        if rturep_cm == 'avg-session':      # 加重平均（セッション軸）
-            rtuser_rep = weight * self.latest_session_rep + (1 - weight) * self.user_rep
-        elif rturep_cm == 'avg-user':       # 加重平均（ユーザ軸）
-            rtuser_rep = (1 - weight) * self.latest_session_rep + weight * self.user_rep
-        elif rturep_cm == 'sum-session':    # 加重和（セッション軸）
-            rtuser_rep = weight * self.latest_session_rep + self.user_rep
-        elif rturep_cm == 'sum-user':       # 加重和（ユーザ軸）
-            rtuser_rep = self.latest_session_rep + weight * self.user_rep
-        else:
-            logger.exception('指定したリアルタイムユーザ表現構築法"{0}"は未定義です'.format(rturep_cm))
+        # リアルタイムユーザ表現構築（構築法はProposalSystem生成時に解決済）
+        rtuser_rep = self.prop_sys.construct_rtuser_rep(session_rep, user_rep, weight)
 
         logger.debug('uId:{0} -> Construct rtuser rep.'.format(self.uId))
         return rtuser_rep
@@ -335,53 +660,10 @@ class ProposalUser():
         Returns:
             np.ndarray: 推薦書籍集合
         """
-        k_book, k_user = self.params['search']['k_book'], self.params['search']['k_user']   # 近傍書籍数，近傍ユーザ数
         rtuser_rep = self.construct_rtuser_rep()    # リアルタイムユーザ表現取得
 
-        # リアルタイムユーザ表現近傍（k_book+1）書籍インデックス -> ID変換
-        nn_books_idx = self.prop_sys.book_knn_model.kneighbors([rtuser_rep], return_distance=False)
-        nn_books = self.prop_sys.bId_by_bIdx[nn_books_idx[0]]
-
-        rsm = self.params['search']['method']   # 推薦書籍探索法
-        if rsm == 'nn':     # NN型探索
-            # 出現書籍除外 -> 先頭k_book個取得
-            recommended_books = nn_books[log.bId != nn_books][:k_book]
-        elif rsm == 'cf':   # CF型探索
-            # リアルタイムユーザ表現近傍（k_user+1）ユーザインデックス -> ID変換
-            nn_users_idx = self.prop_sys.user_knn_model.kneighbors([rtuser_rep], return_distance=False)
-            tmp_nn_users = self.prop_sys.uId_by_uIdx[nn_users_idx[0]]
-
-            # 自身除外 -> 先頭k_user人取得 -> 各IDに対応するユーザ表現取得
-            nn_users = tmp_nn_users[log.uId != tmp_nn_users][:k_user]
-            nn_users_rep = np.array([self.prop_sys.user_reps[uId] for uId in nn_users])
-
-            # TODO: エラー吐かなければ消す
-            # if nn_users_rep.shape[0] == 0:
-            #     return None
-
-            # 近傍ユーザ表現の近傍（k_book+1）書籍インデックス
-            tmp_nn_books_idx_by_nn_users = self.prop_sys.book_knn_model.kneighbors(nn_users_rep, return_distance=False)
-            # 先頭k_book個取得 -> 1次元行列化
-            nn_books_idx_by_nn_users = np.array([nb[:k_book] for nb in tmp_nn_books_idx_by_nn_users]).ravel()
-            # 書籍IDへ変換 -> 直負書籍削除
-            nn_books_by_nn_users = np.unique(self.prop_sys.bId_by_bIdx[nn_books_idx_by_nn_users])
-
-            common_nn_books = set(nn_books) & set(nn_books_by_nn_users)  # 共通近傍書籍
-            recommended_books = []  # 推薦書籍集合
-
-            for bId in nn_books:    # 共通近傍書籍を優先的に推薦書籍集合に追加
-                if len(recommended_books) >= k_book:    # 推薦書籍集合サイズ上限
-                    break
-                if (bId in common_nn_books) and (bId != log.bId):       # 共通近傍書籍かつ出現書籍でない書籍を追加
-                    recommended_books.append(bId)
-
-            for bId in nn_books:
-                if len(recommended_books) >= k_book:    # 推薦書籍集合サイズ上限
-                    break
-                if (bId not in common_nn_books) and (bId != log.bId):   # 共通近傍書籍でなく出現書籍でもない書籍を追加
-                    recommended_books.append(bId)
-        else:
-            logger.exception('指定した推薦アイテム探索法"{0}"は未定義です'.format(rsm))
+        # 推薦書籍探索（探索法はProposalSystem生成時に解決済）
+        recommended_books = self.prop_sys.search_books(rtuser_rep=rtuser_rep, uId=log.uId, bId=log.bId)
 
         assert(log.bId not in recommended_books)    # 出現書籍が推薦書籍集合に含まれていないか確認
         return recommended_books
@@ -394,10 +676,23 @@ def get_prop_sbrs(d2v: Doc2VecWrapper) -> ProposalSystem:
         d2v (Doc2VecWrapper): 学習済Doc2Vecモデル
 
     Returns:
-        ProposalSystem: [description]
+        ProposalSystem: 学習済提案SBRS
     """
-    train_df = get_history_df()  # 過去閲覧履歴を訓練セットとする
-    prop_sbrs = ProposalSystem(train_df=train_df, d2v=d2v)  # 提案SBRS取得
+    params = get_sbrs_config()
+    snapshot_path = params.snapshot.path  # スナップショットパス
+    snapshot = load_snapshot(path=snapshot_path, d2v=d2v, context_size=params.user_rep.context_size)
+
+    if snapshot is None:
+        train_df = get_history_df()  # 過去閲覧履歴を訓練セットとする
+        prop_sbrs = ProposalSystem(train_df=train_df, d2v=d2v)  # 提案SBRS取得
+    else:
+        # スナップショット復元 -> 作成以降に確定したセッション末尾の反映 -> 作成以降の閲覧履歴のみ訓練セットとする
+        train_df = get_history_df(min_id=int(snapshot['last_log_id']))
+        prop_sbrs = ProposalSystem(train_df=train_df, d2v=d2v, snapshot=snapshot)
+        prop_sbrs.close_sessions(closed_df=get_closed_history_df(ids=snapshot['open_log_ids'].tolist()))
+        logger.debug('スナップショットを復元しました (last_log_id: {0}, 差分: {1}件)'.format(prop_sbrs.last_log_id, len(train_df)))
     prop_sbrs.learn()   # 提案SBRS学習
+    if snapshot_path is not None:
+        prop_sbrs.save_snapshot(path=snapshot_path)
 
     return prop_sbrs
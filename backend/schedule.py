@@ -1,3 +1,4 @@
+from typing import Callable, List
 from apscheduler.schedulers.background import BackgroundScheduler
 from backend.db import update_session
 
@@ -6,16 +7,23 @@ from backend.db import update_session
 # https://www.pytry3g.com/entry/apscheduler
 
 
-def job_update_session() -> None:
+def job_update_session(on_session_close: Callable[[List[str]], None]) -> None:
     """セッション更新ジョブ
+
+    Args:
+        on_session_close (Callable[[List[str]], None]): セッションを変更したユーザIDを受け取る関数（ユーザ表現の構築/更新）
     """
-    # TODO: セッションが変更されたユーザのユーザ表現更新 (circular importをどう回避するか)
-    update_session(change_limit_minutes=1)
+    uIds = update_session(change_limit_minutes=1)
+    if len(uIds):
+        on_session_close(uIds)
 
 
-def run_schedule() -> None:
+def run_schedule(on_session_close: Callable[[List[str]], None]) -> None:
     """定期実行ジョブのスケジューリング
+
+    Args:
+        on_session_close (Callable[[List[str]], None]): セッションを変更したユーザIDを受け取る関数（ユーザ表現の構築/更新）
     """
     sched = BackgroundScheduler(standalone=True, coalesce=True)
-    sched.add_job(job_update_session, 'interval', minutes=1)    # セッション更新
+    sched.add_job(job_update_session, 'interval', minutes=1, args=(on_session_close,))    # セッション更新
     sched.start()
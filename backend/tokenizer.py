@@ -0,0 +1,66 @@
+from typing import Iterable, List
+import re
+import MeCab
+from neologdn import normalize
+
+# MeCab設定: NEologd（MeCab用システム辞書）を使った分かち書き（品詞は素性の先頭要素で判定するため出力形式は既定のまま）
+MECAB_ARGS = '-r /etc/mecabrc -d /usr/lib/x86_64-linux-gnu/mecab/dic/mecab-ipadic-neologd'
+TARGET_POS = ('動詞', '形容詞', '名詞')  # 訓練対象品詞
+DIGITS_PATTERN = re.compile(r'[0-9]+')  # 数字（目次対策で削除）
+
+
+class Tokenizer():
+    """書籍説明テキストの前処理（正規化・分かち書き・品詞フィルタリング）
+
+    MeCabの形態素ノードを順に辿り，素性（品詞）の先頭で絞り込むため，解析結果の文字列を行・タブで分割しない．
+    """
+
+    def __init__(self, mecab_args=MECAB_ARGS, target_pos=TARGET_POS):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            mecab_args (str, optional): MeCab引数（辞書等）．Defaults to MECAB_ARGS.
+            target_pos (tuple, optional): 対象品詞．Defaults to TARGET_POS.
+        """
+        self.mecab = MeCab.Tagger(mecab_args)
+        self.target_pos = tuple(target_pos)
+
+    def preprocess(self, text: str) -> str:
+        """テキスト正規化（neologdnによる正規化 -> 数字削除）
+
+        Args:
+            text (str): テキスト
+
+        Returns:
+            str: 正規化済テキスト
+        """
+        return DIGITS_PATTERN.sub(' ', normalize(text))
+
+    def tokenize(self, text: str) -> List[str]:
+        """分かち書きと品詞フィルタリング
+
+        Args:
+            text (str): テキスト
+
+        Returns:
+            List[str]: 対象品詞の単語リスト
+        """
+        words = []
+        node = self.mecab.parseToNode(self.preprocess(text))
+        while node:
+            if node.feature.startswith(self.target_pos):
+                words.append(node.surface)
+            node = node.next
+        return words
+
+    def tokenize_many(self, texts: Iterable[str]) -> List[List[str]]:
+        """複数テキストの一括分かち書き
+
+        Args:
+            texts (Iterable[str]): テキストリスト
+
+        Returns:
+            List[List[str]]: 対象品詞の単語リスト（textsと同順）
+        """
+        tokenize = self.tokenize
+        return [tokenize(text) for text in texts]
@@ -0,0 +1,335 @@
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from contextlib import contextmanager
+from threading import Lock
+from pathlib import Path
+import os
+import sys
+import fcntl
+import numpy as np
+from gensim.models.doc2vec import TaggedDocument
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from config import get_config
+
+_shared_store = None    # プロセス共有分かち書き済コーパス
+_shared_lock = Lock()   # 共有コーパス生成の排他制御
+
+
+class TokenStore():
+    """分かち書き済書籍説明コーパス（単語ID列・メモリマップ）
+
+    書籍登録時に書籍説明の単語をID（uint32）として追記し，Doc2Vecモデル訓練時はbookインデックスを読まずにメモリマップから読み込む．
+    ディレクトリ構成は以下のとおり（いずれも追記のみ，compact・rebuildは一時ファイルへ書き込み後に置換）．
+
+    - vocab.txt: 単語（1行1単語，行番号 = 単語ID，置換しない）
+    - tokens.bin: 単語ID列（uint32）
+    - docs.tsv: 書籍索引（ISBN-10，tokens.binの開始位置，単語数（削除 -> -1））．同一書籍は後の行を優先する
+    - built: bookインデックスの全書籍を含む印（rebuild or 一括登録で作成，なし -> 訓練前にrebuild）
+
+    複数プロセスからの追記はロックファイル（flock）で排他制御し，読み込み時は索引をスナップショットしてから反復する．
+    """
+
+    def __init__(self, path: Path):
+        """インスタンス生成時の初期化処理
+
+        Args:
+            path (Path): 保存先ディレクトリパス
+        """
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.vocab_path = path / 'vocab.txt'
+        self.tokens_path = path / 'tokens.bin'
+        self.docs_path = path / 'docs.tsv'
+        self.built_path = path / 'built'
+        self.lock_path = path / 'lock'
+
+        self.__lock = Lock()        # 単語IDの排他制御（プロセス内）
+        self.__vocab = []           # 単語ID -> 単語
+        self.__word_to_id = dict()  # 単語 -> 単語ID
+        self.__vocab_offset = 0     # vocab.txt読み込み済バイト数
+
+    @contextmanager
+    def __flock(self, exclusive: bool) -> Iterator[None]:
+        """プロセス間ロック
+
+        Args:
+            exclusive (bool): 排他ロック（書き込み） -> True，共有ロック（読み込み） -> False
+        """
+        with self.__lock, open(self.lock_path, mode='a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __refresh_vocab(self) -> None:
+        """他プロセスが追加した単語の読み込み（ロック取得済で呼び出すこと）
+        """
+        if not self.vocab_path.exists() or self.vocab_path.stat().st_size <= self.__vocab_offset:
+            return
+        with open(self.vocab_path, 'rb') as f:
+            f.seek(self.__vocab_offset)
+            lines = f.readlines()
+        for line in lines:
+            word = line.decode().rstrip('\n')
+            self.__word_to_id[word] = len(self.__vocab)
+            self.__vocab.append(word)
+        self.__vocab_offset += sum(len(line) for line in lines)
+
+    def __encode(self, words: List[str], new_words: List[str]) -> np.ndarray:
+        """単語列の単語ID列化（未知語は単語IDを割り当ててnew_wordsに追加，ロック取得済で呼び出すこと）
+
+        Args:
+            words (List[str]): 単語リスト
+            new_words (List[str]): 新規単語リスト（追記先）
+
+        Returns:
+            np.ndarray: 単語ID列
+        """
+        ids = np.empty(len(words), dtype=np.uint32)
+        for i, word in enumerate(words):
+            word_id = self.__word_to_id.get(word)
+            if word_id is None:
+                word_id = len(self.__vocab)
+                self.__word_to_id[word] = word_id
+                self.__vocab.append(word)
+                new_words.append(word)
+            ids[i] = word_id
+        return ids
+
+    def __append_vocab(self, new_words: List[str]) -> None:
+        """新規単語の追記（ロック取得済で呼び出すこと）
+
+        Args:
+            new_words (List[str]): 新規単語リスト
+        """
+        if not len(new_words):
+            return
+        data = ''.join('{}\n'.format(word) for word in new_words).encode()
+        with open(self.vocab_path, 'ab') as f:
+            f.write(data)
+        self.__vocab_offset += len(data)
+
+    def append_many(self, items: Iterable[Tuple[str, List[str]]]) -> int:
+        """書籍説明の一括追記（登録済書籍は置換）
+
+        Args:
+            items (Iterable[Tuple[str, List[str]]]): (ISBN-10, 書籍説明単語リスト)
+
+        Returns:
+            int: 追記書籍数
+        """
+        n_doc = 0
+        with self.__flock(exclusive=True):
+            self.__refresh_vocab()
+            new_words, docs = [], []
+            try:
+                with open(self.tokens_path, 'ab') as f:
+                    start = f.tell() // 4
+                    for isbn10, words in items:
+                        ids = self.__encode(words=words, new_words=new_words)
+                        f.write(ids.tobytes())
+                        docs.append('{0}\t{1}\t{2}\n'.format(isbn10, start, len(ids)))
+                        start += len(ids)
+                        n_doc += 1
+            finally:
+                # 単語ID割り当て済の単語は必ず追記（他プロセスと単語IDを一致させるため）
+                self.__append_vocab(new_words=new_words)
+            # 単語 -> 単語ID列 -> 索引の順に追記（索引の追記をもって書籍を反映）
+            with open(self.docs_path, 'a') as f:
+                f.writelines(docs)
+        return n_doc
+
+    def append(self, isbn10: str, words: List[str]) -> None:
+        """書籍説明の追記（登録済書籍は置換）
+
+        Args:
+            isbn10 (str): ISBN-10コード
+            words (List[str]): 書籍説明単語リスト
+        """
+        self.append_many(items=[(isbn10, words)])
+
+    def delete(self, isbn10: str) -> None:
+        """書籍説明の削除（索引に削除行を追記）
+
+        Args:
+            isbn10 (str): ISBN-10コード
+        """
+        with self.__flock(exclusive=True):
+            with open(self.docs_path, 'a') as f:
+                f.write('{0}\t0\t-1\n'.format(isbn10))
+
+    def __read_docs(self) -> Dict[str, Tuple[int, int]]:
+        """索引読み込み（ロック取得済で呼び出すこと）
+
+        Returns:
+            Dict[str, Tuple[int, int]]: ISBN-10 -> (開始位置, 単語数)（削除書籍は含まない）
+        """
+        docs = dict()
+        if not self.docs_path.exists():
+            return docs
+        with open(self.docs_path) as f:
+            for line in f:
+                if not line.endswith('\n'):    # 書き込み途中で中断した行は無視
+                    break
+                isbn10, start, length = line.rstrip('\n').split('\t')
+                if int(length) < 0:
+                    docs.pop(isbn10, None)
+                else:
+                    docs[isbn10] = (int(start), int(length))
+        return docs
+
+    def __snapshot(self) -> Tuple[Dict[str, Tuple[int, int]], np.ndarray, np.ndarray]:
+        """読み込み用スナップショット取得（以降の追記・置換の影響を受けない）
+
+        Returns:
+            Tuple[Dict[str, Tuple[int, int]], np.ndarray, np.ndarray]: 索引，単語ID列（メモリマップ），単語ID -> 単語
+        """
+        with self.__flock(exclusive=False):
+            self.__refresh_vocab()
+            docs = self.__read_docs()
+            vocab = np.array(self.__vocab, dtype=object)
+            if self.tokens_path.exists() and self.tokens_path.stat().st_size:
+                tokens = np.memmap(self.tokens_path, dtype=np.uint32, mode='r')
+            else:
+                tokens = np.empty(0, dtype=np.uint32)
+        return docs, tokens, vocab
+
+    def iter_words(self) -> Iterator[Tuple[str, List[str]]]:
+        """書籍説明の読み込み（単語を含まない書籍説明は除外）
+
+        Yields:
+            Iterator[Tuple[str, List[str]]]: (ISBN-10, 書籍説明単語リスト)
+        """
+        docs, tokens, vocab = self.__snapshot()
+        for isbn10, (start, length) in docs.items():
+            if length:
+                yield isbn10, vocab[tokens[start:start + length]].tolist()
+
+    def __iter__(self) -> Iterator[TaggedDocument]:
+        """書籍説明の反復（タグ: ISBN-10）
+
+        Yields:
+            Iterator[TaggedDocument]: 書籍説明文書
+        """
+        for isbn10, words in self.iter_words():
+            yield TaggedDocument(words, [isbn10])
+
+    def __len__(self) -> int:
+        """書籍数（単語を含まない書籍説明を含む）
+
+        Returns:
+            int: 書籍数
+        """
+        with self.__flock(exclusive=False):
+            return len(self.__read_docs())
+
+    def export(self, corpus_path: Path) -> List[str]:
+        """corpus_file形式での書き出し（一時ファイルへ書き込み後に置換）
+
+        Args:
+            corpus_path (Path): コーパスファイルパス
+
+        Returns:
+            List[str]: 行順のタグ（ISBN-10）リスト
+        """
+        keys = []
+        tmp_path = corpus_path.with_name(corpus_path.name + '.tmp')
+        with open(tmp_path, mode='w') as f:
+            for isbn10, words in self.iter_words():
+                f.write(' '.join(words) + '\n')
+                keys.append(isbn10)
+        os.replace(tmp_path, corpus_path)
+        return keys
+
+    def __rewrite(self, items: Iterable[Tuple[str, np.ndarray]]) -> int:
+        """単語ID列・索引の一時ファイルへの書き込み（__replaceで置換，排他ロック取得済で呼び出すこと）
+
+        Args:
+            items (Iterable[Tuple[str, np.ndarray]]): (ISBN-10, 単語ID列)
+
+        Returns:
+            int: 書籍数
+        """
+        tokens_tmp_path = self.tokens_path.with_name(self.tokens_path.name + '.tmp')
+        docs_tmp_path = self.docs_path.with_name(self.docs_path.name + '.tmp')
+        n_doc, start = 0, 0
+        with open(tokens_tmp_path, 'wb') as f_tokens, open(docs_tmp_path, 'w') as f_docs:
+            for isbn10, ids in items:
+                f_tokens.write(np.asarray(ids, dtype=np.uint32).tobytes())
+                f_docs.write('{0}\t{1}\t{2}\n'.format(isbn10, start, len(ids)))
+                start += len(ids)
+                n_doc += 1
+        return n_doc
+
+    def __replace(self) -> None:
+        """一時ファイルへの置換（排他ロック取得済で呼び出すこと）
+        """
+        os.replace(self.tokens_path.with_name(self.tokens_path.name + '.tmp'), self.tokens_path)
+        os.replace(self.docs_path.with_name(self.docs_path.name + '.tmp'), self.docs_path)
+
+    def compact(self) -> int:
+        """置換・削除済書籍の単語ID列の除去
+
+        Returns:
+            int: 書籍数
+        """
+        with self.__flock(exclusive=True):
+            docs = self.__read_docs()
+            if not len(docs):
+                return 0
+            tokens = np.memmap(self.tokens_path, dtype=np.uint32, mode='r')
+            n_doc = self.__rewrite((isbn10, tokens[start:start + length]) for isbn10, (start, length) in docs.items())
+            self.__replace()
+        return n_doc
+
+    def rebuild(self, items: Iterable[Tuple[str, List[str]]]) -> int:
+        """書籍説明全体の再構築（bookインデックスからの初回構築用，語彙は引き継ぐ）
+
+        Args:
+            items (Iterable[Tuple[str, List[str]]]): (ISBN-10, 書籍説明単語リスト)
+
+        Returns:
+            int: 書籍数
+        """
+        with self.__flock(exclusive=True):
+            self.__refresh_vocab()
+            new_words = []
+            try:
+                n_doc = self.__rewrite((isbn10, self.__encode(words=words, new_words=new_words)) for isbn10, words in items)
+            finally:
+                self.__append_vocab(new_words=new_words)
+            self.__replace()
+            self.mark_built()
+        return n_doc
+
+    def mark_built(self) -> None:
+        """構築済印の作成（bookインデックスの全書籍を追記済の場合に呼び出す，以降の訓練ではrebuildしない）
+        """
+        self.built_path.touch()
+
+    def is_built(self) -> bool:
+        """構築済確認
+
+        Returns:
+            bool: bookインデックスの全書籍を含む（構築済） -> True
+        """
+        return self.built_path.exists()
+
+
+def get_token_store() -> Union[TokenStore, None]:
+    """プロセス共有分かち書き済コーパス取得（初回呼び出し時に生成）
+
+    Returns:
+        Union[TokenStore, None]: 分かち書き済コーパス（設定なし -> None）
+    """
+    global _shared_store
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                store_path = get_config()['doc2vec']['token_store']     # 分かち書き済コーパス保存先
+                if store_path is None:
+                    return None
+                _shared_store = TokenStore(path=Path(store_path))
+    return _shared_store
@@ -1,5 +1,9 @@
 from logging import getLogger, StreamHandler, DEBUG, Formatter
-from typing import Dict, Any
+from typing import Dict, Any, Mapping, Union
+from dataclasses import dataclass
+from threading import Lock
+from types import MappingProxyType
+import time
 import yaml
 from pathlib import Path
 
@@ -12,21 +16,217 @@ logger.addHandler(handler)
 logger.propagate = False
 handler.setFormatter(Formatter('[shisho] %(message)s'))
 
+CONFIG_PATH = Path('./config/config.yml')   # 司書設定ファイルパス
+CHECK_INTERVAL = 1.0                        # 設定ファイル更新確認間隔（秒）
+
+
+@dataclass(frozen=True)
+class SessionRepConfig:
+    """セッション表現設定
+    """
+    __slots__ = ('update_method',)
+    update_method: str      # セッション表現更新法
+
+
+@dataclass(frozen=True)
+class UserRepConfig:
+    """ユーザ表現設定
+    """
+    __slots__ = ('context_size',)
+    context_size: int       # コンテキストセッション数
+
+
+@dataclass(frozen=True)
+class RtuserRepConfig:
+    """リアルタイムユーザ表現設定
+    """
+    __slots__ = ('construct_method',)
+    construct_method: str   # リアルタイムユーザ表現構築法
+
+
+@dataclass(frozen=True)
+class IVFConfig:
+    """IVF（近似近傍探索）設定
+    """
+    __slots__ = ('n_list', 'n_probe', 'min_size')
+    n_list: int             # クラスタ数
+    n_probe: int            # 探索クラスタ数
+    min_size: int           # 近似探索を行う最小行数（未満なら厳密探索）
+
+
+@dataclass(frozen=True)
+class SearchConfig:
+    """推薦書籍探索設定
+    """
+    __slots__ = ('method', 'k_book', 'k_user', 'compact_size', 'rebuild_interval', 'index', 'ivf')
+    method: str             # 推薦書籍探索法
+    k_book: int             # 近傍書籍数
+    k_user: int             # 近傍ユーザ数
+    compact_size: int       # ユーザKNNモデルのコンパクション閾値（追記）
+    rebuild_interval: int   # ユーザKNNモデルのコンパクション閾値（更新）
+    index: str              # インデックス種別
+    ivf: IVFConfig          # IVF設定
+
+
+@dataclass(frozen=True)
+class SnapshotConfig:
+    """スナップショット設定
+    """
+    __slots__ = ('path',)
+    path: Union[Path, None]     # スナップショットパス（None -> スナップショットなし）
+
+
+@dataclass(frozen=True)
+class LearnConfig:
+    """学習設定
+    """
+    __slots__ = ('method', 'workers')
+    method: str             # 学習法（bulk or stream）
+    workers: int            # ワーカープロセス数
+
+
+@dataclass(frozen=True)
+class SbrsConfig:
+    """提案SBRS設定
+    """
+    __slots__ = ('session_rep', 'user_rep', 'rtuser_rep', 'search', 'snapshot', 'learn')
+    session_rep: SessionRepConfig
+    user_rep: UserRepConfig
+    rtuser_rep: RtuserRepConfig
+    search: SearchConfig
+    snapshot: SnapshotConfig
+    learn: LearnConfig
+
+    @classmethod
+    def from_dict(cls, conf: Dict[str, Any]) -> 'SbrsConfig':
+        """設定ファイルのsbrsセクションから生成
+
+        Args:
+            conf (Dict[str, Any]): sbrsセクション
+
+        Returns:
+            SbrsConfig: 提案SBRS設定
+        """
+        search = dict(conf['search'], ivf=IVFConfig(**conf['search']['ivf']))
+        return cls(session_rep=SessionRepConfig(**conf['session_rep']), user_rep=UserRepConfig(**conf['user_rep']),
+                   rtuser_rep=RtuserRepConfig(**conf['rtuser_rep']), search=SearchConfig(**search),
+                   snapshot=SnapshotConfig(path=None if conf['snapshot']['path'] is None else Path(conf['snapshot']['path'])), learn=LearnConfig(**conf['learn']))
+
+
+# 追加設定項目の既定値（設定ファイルに項目がない -> 各機能の追加前と同じ動作）
+DEFAULT_CONFIG = {
+    'elasticsearch': dict(hosts='elasticsearch', maxsize=10, timeout=10, max_retries=3),
+    'book_cache': dict(max_size=0, ttl=600, invalidation_log=None),     # max_size: 0 -> キャッシュしない
+    'openbd': dict(connect_timeout=3.05, read_timeout=30, max_retries=0, backoff_factor=0.5, batch_size=100,
+                   cache_path=None, cache_ttl=86400),
+    'register': dict(batch_size=100, fetch_workers=4, parse_workers=0, bulk_chunk_size=500, checkpoint='./config/books.done'),
+    'doc2vec': dict(dm=0, vector_size=100, epochs=30, min_count=1, negative=5, sample=0.001, workers=3, corpus_file=False,
+                    similar_topn=10, similar_block_size=256, compact_deleted=1, corpus_cache=None,
+                    token_store=None, persist_every=1),
+    'sbrs': dict(search=dict(compact_size=256, rebuild_interval=256, index='exact',
+                             ivf=dict(n_list=64, n_probe=8, min_size=10000)),
+                 snapshot=dict(path=None), learn=dict(method='stream', workers=1)),
+}
+
+
+def merge_defaults(conf: Dict[str, Any], defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """既定値の補完（設定ファイルの値を優先，辞書は再帰的に補完）
+
+    Args:
+        conf (Dict[str, Any]): 設定
+        defaults (Dict[str, Any]): 既定値
+
+    Returns:
+        Dict[str, Any]: 既定値を補完した設定
+    """
+    merged = dict(defaults, **conf)
+    for key, default in defaults.items():
+        if isinstance(default, dict) and isinstance(conf.get(key), dict):
+            merged[key] = merge_defaults(conf=conf[key], defaults=default)
+    return merged
+
+
+def freeze(conf: Any) -> Any:
+    """設定の読み込み専用化（辞書 -> MappingProxyType，リスト -> タプル，再帰的に複製）
+
+    Args:
+        conf (Any): 設定
 
-def get_config() -> Dict[str, Any]:
-    """司書設定ファイル（yml形式）読み込み
     Returns:
-        Dict[str, Any]: 司書設定
+        Any: 読み込み専用の設定
     """
-    config_path = Path('./config/config.yml')
+    if isinstance(conf, dict):
+        return MappingProxyType({key: freeze(value) for key, value in conf.items()})
+    if isinstance(conf, list):
+        return tuple(freeze(value) for value in conf)
+    return conf
 
+
+_lock = Lock()  # 読み込みの排他制御
+# 読み込み済設定（設定ファイルパス，更新時刻，更新確認時刻，設定，提案SBRS設定）
+_cache = dict(path=None, mtime=None, checked_at=0.0, conf=None, sbrs=None)
+
+
+def get_mtime() -> Union[int, None]:
+    """設定ファイル更新時刻取得
+
+    Returns:
+        Union[int, None]: 更新時刻（ナノ秒，取得失敗 -> None）
+    """
     try:
-        with open(config_path) as f:
-            conf = yaml.safe_load(f)
-    except Exception as e:
-        logger.error('コンフィグの読み込みに失敗しました')
-        logger.error('フォーマットに問題がある可能性があります')
-        logger.error(e)
-        exit()
+        return CONFIG_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def reload() -> Mapping[str, Any]:
+    """司書設定ファイル（yml形式）の再読み込み（更新時刻の確認を待たずに反映する場合に呼び出す）
 
+    Returns:
+        Mapping[str, Any]: 司書設定（読み込み専用）
+    """
+    with _lock:
+        mtime = get_mtime()
+        try:
+            with open(CONFIG_PATH) as f:
+                conf = freeze(merge_defaults(conf=yaml.safe_load(f) or dict(), defaults=DEFAULT_CONFIG))
+        except Exception as e:
+            logger.error('コンフィグの読み込みに失敗しました')
+            logger.error('フォーマットに問題がある可能性があります')
+            logger.error(e)
+            exit()
+
+        _cache.update(path=CONFIG_PATH, mtime=mtime, checked_at=time.monotonic(), conf=conf, sbrs=None)
     return conf
+
+
+def get_config() -> Mapping[str, Any]:
+    """司書設定取得（読み込み済ならキャッシュを返す，CHECK_INTERVAL秒ごとに更新時刻を確認してファイル更新時のみ再読み込み）
+
+    Returns:
+        Mapping[str, Any]: 司書設定（読み込み専用）
+    """
+    conf = _cache['conf']
+    if (conf is None) or (_cache['path'] != CONFIG_PATH):
+        return reload()
+
+    now = time.monotonic()
+    if now - _cache['checked_at'] >= CHECK_INTERVAL:
+        _cache['checked_at'] = now
+        if get_mtime() != _cache['mtime']:
+            return reload()
+    return conf
+
+
+def get_sbrs_config() -> SbrsConfig:
+    """提案SBRS設定取得（不変オブジェクト，設定ファイル更新時は再生成）
+
+    Returns:
+        SbrsConfig: 提案SBRS設定
+    """
+    conf = get_config()
+    sbrs = _cache['sbrs']
+    if (sbrs is None) or (_cache['conf'] is not conf):
+        sbrs = SbrsConfig.from_dict(conf['sbrs'])
+        _cache['sbrs'] = sbrs
+    return sbrs
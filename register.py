@@ -1,10 +1,18 @@
 from logging import getLogger, StreamHandler, DEBUG, Formatter
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
 from pathlib import Path
+import os
 from tqdm import tqdm
-from elasticsearch import Elasticsearch
-import MeCab
-from backend.openbd import OpenBD
+from elasticsearch.helpers import streaming_bulk
+from backend.openbd import OpenBD, get_jsons_from_openbd
+from backend.tokenizer import Tokenizer
+from backend.tokenstore import get_token_store
+from backend.corpus import split_description
 from backend.doc2vecwrapper import Doc2VecWrapper
+from backend.esclient import get_es
+from config import get_config
 
 # ロガー設定
 logger = getLogger(__name__)
@@ -15,24 +23,154 @@ logger.addHandler(handler)
 logger.propagate = False
 handler.setFormatter(Formatter('[tosho42] %(message)s'))
 
+_tokenizer = None   # ワーカープロセス内の書籍説明テキスト前処理（MeCab）
+
+
+def bounded_map(executor: Executor, fn: Callable, items: Iterable, max_pending: int) -> Iterator:
+    """実行中タスク数を制限したmap（入力順に結果を返す）
+
+    Args:
+        executor (Executor): 実行器
+        fn (Callable): 関数
+        items (Iterable): 入力
+        max_pending (int): 最大実行中タスク数
+
+    Yields:
+        Iterator: fn(item)の結果
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def fetch_batch(isbn10s: List[str]) -> List[Tuple[str, Union[Dict, None, bool]]]:
+    """openBDからの書籍情報一括取得（スレッドで実行）
+
+    Args:
+        isbn10s (List[str]): ISBN-10コードリスト
+
+    Returns:
+        List[Tuple[str, Union[Dict, None, bool]]]: (ISBN-10, 書籍情報（見つからない -> None，取得失敗 -> False）)
+    """
+    try:
+        return list(zip(isbn10s, get_jsons_from_openbd(isbn10s=isbn10s)))
+    except Exception as e:
+        logger.debug('openBDからの書籍情報取得に失敗しました ({0}冊): {1}'.format(len(isbn10s), e))
+        return [(isbn10, False) for isbn10 in isbn10s]
+
+
+def init_parse_worker() -> None:
+    """ワーカープロセス初期化（MeCabはプロセスごとに生成）
+    """
+    global _tokenizer
+    _tokenizer = Tokenizer()
+
+
+def parse_book(item: Tuple[str, Union[Dict, None]]) -> Tuple[str, Union[Dict[str, str], bool]]:
+    """書籍基本情報取得（正規化・分かち書き，ワーカープロセスで実行）
+
+    Args:
+        item (Tuple[str, Union[Dict, None]]): (ISBN-10, openBD書籍情報)
+
+    Returns:
+        Tuple[str, Union[Dict[str, str], bool]]: (ISBN-10, 書籍基本情報（取得失敗 -> False）)
+    """
+    isbn10, openbd = item
+    return isbn10, OpenBD.from_json(isbn10=isbn10, openbd=openbd, tokenizer=_tokenizer).get_std_info()
+
+
+def read_checkpoint(checkpoint_path: Path) -> set:
+    """登録済ISBN-10読み込み（中断からの再開用）
+
+    Args:
+        checkpoint_path (Path): チェックポイントファイルパス
+
+    Returns:
+        set: 登録済（見つからない書籍を含む）ISBN-10集合
+    """
+    if not checkpoint_path.exists():
+        return set()
+    return set(checkpoint_path.read_text().split())
+
+
 if __name__ == '__main__':
-    mecab = MeCab.Tagger('-Ochasen -r /etc/mecabrc -d /usr/lib/x86_64-linux-gnu/mecab/dic/mecab-ipadic-neologd')   # MeCab設定
+    register_config = get_config()['register']     # 一括登録設定
     books_path = Path('./config/books.txt')  # 書籍データファイルパス
+    checkpoint_path = Path(register_config['checkpoint'])   # チェックポイントファイルパス
 
-    # 書籍データ読み込み
+    # 書籍データ読み込み -> 登録済書籍を除外
     with open(books_path, mode='r') as f:
-        books = f.readlines()
-
-    es = Elasticsearch('elasticsearch')
-    for book in tqdm(books):
-        # 書籍登録
-        # ISBN-10 -> openBDへ書籍情報リクエスト -> 基本情報取得 -> bookインデックスに登録
-        isbn10 = book.strip()
-        book = OpenBD(isbn10=isbn10, mecab=mecab).get_std_info()
-        es.index(index='book', doc_type='_doc', body=book, id=isbn10)
-    es.indices.refresh(index='book')
-    es.close()
-    logger.debug('書籍データの一括登録が完了しました')
+        isbn10s = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    done = read_checkpoint(checkpoint_path=checkpoint_path)
+    isbn10s = [isbn10 for isbn10 in isbn10s if isbn10 not in done]
+    logger.debug('未登録書籍: {0}冊（登録済: {1}冊）'.format(len(isbn10s), len(done)))
+
+    # 書籍登録パイプライン
+    # ISBN-10 -> openBDへ一括リクエスト（スレッド） -> 基本情報取得（プロセス） -> bookインデックスに一括登録
+    batch_size = register_config['batch_size']
+    batches = [isbn10s[i:i + batch_size] for i in range(0, len(isbn10s), batch_size)]
+    fetch_workers = register_config['fetch_workers']
+    parse_workers = register_config['parse_workers'] or os.cpu_count()
+    counts = dict(failed=0, not_found=0)    # 取得・登録失敗数，openBDで見つからない書籍数
+    descriptions = dict()   # 登録待ち書籍の書籍説明（ISBN-10 -> 単語リスト）
+
+    def iter_actions(fetcher: Executor, parser: Executor, checkpoint, pbar: tqdm) -> Iterator[Dict]:
+        for fetched in bounded_map(fetcher, fetch_batch, batches, max_pending=2 * fetch_workers):
+            found = [(isbn10, openbd) for isbn10, openbd in fetched if openbd]
+            not_found = [isbn10 for isbn10, openbd in fetched if openbd is None]
+            n_failed = sum(openbd is False for _, openbd in fetched)
+            counts['failed'] += n_failed
+            counts['not_found'] += len(not_found)
+            # openBDで見つからない書籍は登録済扱い（再開時に再リクエストしない）
+            checkpoint.writelines('{}\n'.format(isbn10) for isbn10 in not_found)
+            pbar.update(len(not_found) + n_failed)
+            for isbn10, book in parser.map(parse_book, found, chunksize=max(1, len(found) // parse_workers)):
+                if book:
+                    descriptions[isbn10] = split_description(book['description'])
+                    yield {'_index': 'book', '_id': isbn10, '_source': book}
+                else:
+                    counts['failed'] += 1
+                    pbar.update(1)
+
+    def flush_indexed(indexed: List[str], checkpoint) -> None:
+        # 分かち書き済コーパスへの追記 -> チェックポイント記録（再開時にコーパスへの追記漏れを防ぐ）
+        if token_store is not None:
+            token_store.append_many(items=((isbn10, descriptions[isbn10]) for isbn10 in indexed))
+        checkpoint.writelines('{}\n'.format(isbn10) for isbn10 in indexed)
+        checkpoint.flush()
+        for isbn10 in indexed:
+            del descriptions[isbn10]
+        indexed.clear()
+
+    es = get_es()
+    token_store = get_token_store()
+    indexed = []    # 登録済（コーパス追記・チェックポイント記録待ち）ISBN-10
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetcher, \
+            ProcessPoolExecutor(max_workers=parse_workers, initializer=init_parse_worker) as parser, \
+            open(checkpoint_path, mode='a') as checkpoint, tqdm(total=len(isbn10s)) as pbar:
+        actions = iter_actions(fetcher=fetcher, parser=parser, checkpoint=checkpoint, pbar=pbar)
+        for ok, result in streaming_bulk(es, actions, chunk_size=register_config['bulk_chunk_size'], raise_on_error=False):
+            item = list(result.values())[0]
+            if ok:
+                indexed.append(item['_id'])
+                if len(indexed) >= register_config['bulk_chunk_size']:
+                    flush_indexed(indexed=indexed, checkpoint=checkpoint)
+            else:
+                counts['failed'] += 1
+                descriptions.pop(item['_id'], None)
+                logger.debug('書籍の登録に失敗しました (ISBN-10: {0}): {1}'.format(item['_id'], item.get('error')))
+            pbar.update(1)
+        flush_indexed(indexed=indexed, checkpoint=checkpoint)
+    es.indices.refresh(index='book')    # 一括登録後に1回だけ更新
+    # 分かち書き済コーパスがbookインデックスの全書籍を含む（空の状態から一括登録した等） -> 構築済とする（訓練時にrebuildしない）
+    if (token_store is not None) and (not token_store.is_built()) and (len(token_store) >= es.count(index='book')['count']):
+        token_store.mark_built()
+    logger.debug('書籍データの一括登録が完了しました（見つからない書籍: {0}冊，失敗: {1}冊 -> 再実行で再登録）'.format(
+        counts['not_found'], counts['failed']))
 
     # Doc2Vecモデルの初期化と訓練
     Path('/projects/model').mkdir(exist_ok=True)
@@ -0,0 +1,185 @@
+from pathlib import Path
+import os
+import sys
+import random
+from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+from gensim.models import KeyedVectors
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+for key in ('MYSQL_USER', 'MYSQL_PASSWORD', 'MYSQL_DATABASE'):    # DB接続はしない（backend.dbの読み込みのみ）
+    os.environ.setdefault(key, 'shisho')
+import config
+from backend.sbrs import ProposalSystem
+
+N_BOOK = 30         # 書籍数
+DIM = 16            # 書籍表現次元数
+MISSING_BID = 'X'   # 書籍表現なしの書籍ID
+
+
+class BookVectors():
+    """書籍表現のみを持つDoc2VecWrapper代替（ProposalSystemが参照する属性のみ）
+    """
+
+    def __init__(self, seed: int, n_book=N_BOOK):
+        self.is_trained = True
+        self.deleted = set()
+        self.bv = KeyedVectors(vector_size=DIM)
+        vectors = np.random.RandomState(seed).standard_normal((n_book, DIM)).astype(np.float32)
+        self.bv.add_vectors(['b{}'.format(i) for i in range(n_book)], vectors)
+
+
+def make_history(seed: int, n_user=8, n_log=600) -> pd.core.frame.DataFrame:
+    """ランダムな閲覧履歴生成（change_sessionと同じく，セッション変更時はユーザの最新ログをセッション末尾とする）
+
+    セッションIDは共通の候補から選ぶため，ユーザ間で重複する（同じユーザでは再び現れない）．
+    直前と同じ書籍・書籍表現なしの書籍のログも含む．
+    """
+    rng = random.Random(seed)
+    sId_pool = ['s{}'.format(i) for i in range(40)]
+    uIds = ['u{}'.format(i) for i in range(n_user)]
+    used_sIds = {uId: set() for uId in uIds}    # ユーザID -> 使用済セッションID
+
+    def new_sId(uId: str) -> str:
+        sId = rng.choice([sId for sId in sId_pool if sId not in used_sIds[uId]])
+        used_sIds[uId].add(sId)
+        return sId
+
+    sIds = {uId: new_sId(uId) for uId in uIds}
+    last_log = dict()   # ユーザID -> 最新ログ
+    logs = []
+    for log_id in range(1, n_log + 1):
+        uId = rng.choice(uIds)
+        if (uId in last_log) and (rng.random() < 0.2):     # セッション変更
+            last_log[uId]['isLast'] = True
+            sIds[uId] = new_sId(uId)
+        if (uId in last_log) and (rng.random() < 0.15):    # 直前と同じ書籍
+            bId = last_log[uId]['bId']
+        elif rng.random() < 0.05:
+            bId = MISSING_BID
+        else:
+            bId = 'b{}'.format(rng.randrange(N_BOOK))
+        log = dict(id=log_id, uId=uId, sId=sIds[uId], bId=bId, isLast=False)
+        logs.append(log)
+        last_log[uId] = log
+    return pd.DataFrame(logs).set_index('id')
+
+
+def calc_similarity(rep_1: np.ndarray, rep_2: np.ndarray) -> float:
+    return float(np.dot(rep_1, rep_2) / (np.linalg.norm(rep_1) * np.linalg.norm(rep_2)))
+
+
+class BaselineUser():
+    """改修前のProposalUserの各表現の構築/更新（ログごとの逐次反映）の写し（比較用）
+    """
+
+    def __init__(self, params: dict):
+        self.params = params
+        self.sIds = ['*']           # セッションID集合
+        self.session_reps = dict()  # セッション表現集合
+        self.user_rep = None        # ユーザ表現
+        self.prv_bId = None         # 直前閲覧書籍ID
+
+    @property
+    def latest_sId(self) -> str:
+        return self.sIds[-1]
+
+    @property
+    def latest_session_rep(self) -> np.ndarray:
+        return self.session_reps[self.latest_sId].copy()
+
+    @property
+    def context_session_reps(self) -> np.ndarray:
+        return np.array([self.session_reps[sId] for sId in self.sIds[1:][-self.params['user_rep']['context_size']:]])
+
+    def update_reps(self, log, book_rep: np.ndarray, user_reps: dict) -> None:
+        if (self.prv_bId is not None) and (log.bId == self.prv_bId):
+            return
+        self.prv_bId = log.bId
+
+        if log.sId != self.latest_sId:
+            self.sIds.append(log.sId)
+            self.session_reps[log.sId] = book_rep.copy()
+        else:
+            weight = abs(calc_similarity(rep_1=self.latest_session_rep, rep_2=book_rep))
+            self.session_reps[self.latest_sId] = weight * self.latest_session_rep + book_rep
+
+        if (self.session_reps[log.sId] is not None) and log.isLast:
+            self.construct_user_rep()
+            user_reps[log.uId] = self.user_rep.copy()
+
+    def construct_user_rep(self) -> None:
+        if self.user_rep is None:
+            self.user_rep = self.latest_session_rep.copy()
+            return
+
+        weighted_rep_sum, weight_sum = np.zeros(DIM), 0.0
+        for srep in self.context_session_reps:
+            weight = abs(calc_similarity(rep_1=self.latest_session_rep, rep_2=srep))
+            weighted_rep_sum += weight * srep
+            weight_sum += weight
+        self.user_rep = (weighted_rep_sum / weight_sum).copy()
+
+
+def learn_baseline(train_df: pd.core.frame.DataFrame, d2v: BookVectors) -> Tuple[Dict[str, BaselineUser], Dict[str, np.ndarray]]:
+    """改修前のProposalSystem.learnの写し（比較用）
+
+    Returns:
+        Tuple[Dict[str, BaselineUser], Dict[str, np.ndarray]]: ユーザ，ユーザ表現集合（初回構築順）
+    """
+    params = config.get_config()['sbrs']
+    assert params['session_rep']['update_method'] == 'cos'
+    users = {uId: BaselineUser(params=params) for uId in train_df['uId'].unique()}
+    user_reps = dict()
+    for log in train_df.itertuples():
+        try:
+            book_rep = d2v.bv[log.bId]
+        except KeyError:
+            continue
+        users[log.uId].update_reps(log=log, book_rep=book_rep, user_reps=user_reps)
+    return users, user_reps
+
+
+@pytest.fixture(params=[('stream', 1), ('bulk', 1), ('bulk', 2)], ids=lambda p: '{0}-{1}'.format(*p))
+def learn_config(request, tmp_path, monkeypatch):
+    """学習法（sbrs.learn）を指定した設定への切り替え（終了時はmonkeypatchが元の設定パスへ戻し，get_configが再読み込みする）
+    """
+    with open(Path(parent_dir) / 'config' / '_config.yml') as f:
+        conf = yaml.safe_load(f)
+    method, workers = request.param
+    conf['sbrs']['learn'] = dict(method=method, workers=workers)
+    conf['sbrs']['snapshot'] = dict(path=None)
+    with open(tmp_path / 'config.yml', mode='w') as f:
+        yaml.safe_dump(conf, f)
+    monkeypatch.setattr(config, 'CONFIG_PATH', tmp_path / 'config.yml')
+    config.reload()
+    return request.param
+
+
+def assert_same_reps(users: Dict[str, BaselineUser], user_reps: Dict[str, np.ndarray], actual: ProposalSystem) -> None:
+    np.testing.assert_array_equal(list(user_reps.keys()), actual.rep_store.uIds_with_rep)  # ユーザKNNモデルの行順
+    np.testing.assert_allclose(np.array(list(user_reps.values())), actual.rep_store.user_reps, rtol=1e-5, atol=1e-6)
+    for uId, user in users.items():
+        other = actual.users[uId]
+        assert (user.latest_sId, user.prv_bId) == (other.latest_sId, other.prv_bId)
+        if user.latest_sId == '*':   # セッション表現未構築
+            continue
+        # リングバッファを古い順に並べ替えて比較
+        context_reps = np.roll(other.rep_store.get_context_session_reps(row=other.row), -(other.rep_store.session_head[other.row] + 1), axis=0)
+        np.testing.assert_allclose(user.context_session_reps, context_reps, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(user.latest_session_rep, other.latest_session_rep, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_learn_matches_baseline(seed, learn_config):
+    train_df = make_history(seed=seed)
+    d2v = BookVectors(seed=seed)
+    users, user_reps = learn_baseline(train_df=train_df, d2v=d2v)
+    prop_sbrs = ProposalSystem(train_df=train_df, d2v=d2v)
+    prop_sbrs.learn()
+    assert len(user_reps) > 1
+    assert_same_reps(users=users, user_reps=user_reps, actual=prop_sbrs)
@@ -0,0 +1,64 @@
+from pathlib import Path
+import os
+import sys
+import pytest
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+import config
+
+BASE_CONFIG = (Path(parent_dir) / 'config' / '_config.yml').read_text()   # 設定ファイル例
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    """一時設定ファイルへの切り替え（更新確認間隔は各テストで指定）
+    """
+    path = tmp_path / 'config.yml'
+    path.write_text(BASE_CONFIG.replace('epochs: 30', 'epochs: 5'))
+    monkeypatch.setattr(config, 'CONFIG_PATH', path)
+    return path
+
+
+def rewrite(path: Path, text: str) -> None:
+    """設定ファイルの書き換え（更新時刻を確実に進める）
+    """
+    mtime = path.stat().st_mtime_ns
+    path.write_text(text)
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+
+def test_reloads_when_file_changes(config_path, monkeypatch):
+    monkeypatch.setattr(config, 'CHECK_INTERVAL', 0.0)
+    assert config.get_config()['doc2vec']['epochs'] == 5
+
+    rewrite(config_path, BASE_CONFIG.replace('epochs: 30', 'epochs: 7').replace('k_book: 6', 'k_book: 3'))
+    assert config.get_config()['doc2vec']['epochs'] == 7
+    assert config.get_sbrs_config().search.k_book == 3
+
+
+def test_checks_mtime_at_most_once_per_interval(config_path, monkeypatch):
+    monkeypatch.setattr(config, 'CHECK_INTERVAL', 3600.0)
+    assert config.get_config()['doc2vec']['epochs'] == 5
+
+    rewrite(config_path, BASE_CONFIG.replace('epochs: 30', 'epochs: 7'))
+    assert config.get_config()['doc2vec']['epochs'] == 5    # 確認間隔内 -> キャッシュ
+    assert config.reload()['doc2vec']['epochs'] == 7        # 明示的な再読み込み
+    assert config.get_config()['doc2vec']['epochs'] == 7
+
+
+def test_defaults_fill_missing_keys(config_path):
+    config_path.write_text('doc2vec:\n  epochs: 5\n')
+    conf = config.reload()
+    assert conf['doc2vec']['epochs'] == 5
+    assert conf['doc2vec']['persist_every'] == config.DEFAULT_CONFIG['doc2vec']['persist_every']
+    assert conf['sbrs']['learn']['method'] == 'stream'
+
+
+def test_config_is_read_only(config_path):
+    conf = config.get_config()
+    with pytest.raises(TypeError):
+        conf['doc2vec']['epochs'] = 1
+    with pytest.raises(TypeError):
+        conf['doc2vec'] = dict()
+    assert config.get_config()['doc2vec']['epochs'] == 5
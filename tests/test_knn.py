@@ -0,0 +1,70 @@
+from pathlib import Path
+import sys
+import numpy as np
+import pytest
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from backend.knn import IncrementalKNNIndex
+
+DIM = 8
+
+
+class Rows():
+    """追記可能な探索対象行列（UserRepStoreと同じく確保済バッファの先頭n行をビューとして返す）
+    """
+
+    def __init__(self, n: int, rng: np.random.RandomState, capacity=1024):
+        self.buf = np.zeros((capacity, DIM), dtype=np.float32)
+        self.buf[:n] = rng.standard_normal((n, DIM))
+        self.n = n
+
+    def get(self) -> np.ndarray:
+        return self.buf[:self.n]
+
+
+def brute_force(vectors: np.ndarray, X: np.ndarray, k: int, deleted: set):
+    dists = np.linalg.norm(X[:, np.newaxis, :] - vectors[np.newaxis, :, :], axis=2)
+    dists[:, list(deleted)] = np.inf
+    nn_idx = np.argsort(dists, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(dists, nn_idx, axis=1), nn_idx
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_brute_force(seed):
+    rng = np.random.RandomState(seed)
+    rows = Rows(n=20, rng=rng)
+    knn = IncrementalKNNIndex(get_vectors=rows.get, n_neighbors=6, compact_size=8, rebuild_interval=5)
+    deleted = set()
+    counts = dict(insert_compaction=0, update_compaction=0, with_delta=0, with_dirty=0)
+
+    for _ in range(300):
+        op = rng.choice(['insert', 'update', 'delete'], p=[0.4, 0.5, 0.1])
+        n_base = knn.n_base
+        if op == 'insert':
+            rows.buf[rows.n] = rng.standard_normal(DIM)
+            rows.n += 1
+            knn.insert(idx=rows.n - 1)
+            counts['insert_compaction'] += knn.n_base != n_base
+        elif op == 'update':
+            idx = rng.randint(rows.n)
+            rows.buf[idx] = rng.standard_normal(DIM)
+            knn.update(idx=idx)
+            counts['update_compaction'] += knn.n_update == 0
+        else:
+            idx = rng.randint(rows.n)
+            deleted.add(idx)
+            knn.delete(idx=idx)
+        counts['with_delta'] += knn.n_delta > 0
+        counts['with_dirty'] += len(knn.dirty) > 0
+
+        # 構築済ブロック・更新済行・追記ブロック・削除済行が混在した状態で全探索と比較
+        X = rng.standard_normal((3, DIM)).astype(np.float32)
+        k = rng.randint(1, 10)
+        expected_dists, expected_idx = brute_force(rows.get(), X, k=min(k, rows.n - len(deleted)), deleted=deleted)
+        dists, nn_idx = knn.kneighbors(X, n_neighbors=k)
+        np.testing.assert_array_equal(nn_idx, expected_idx)
+        np.testing.assert_allclose(dists, expected_dists, rtol=1e-4, atol=1e-4)
+
+    # 追記・更新の両方でコンパクションをまたいだ
+    assert min(counts.values()) > 0, counts
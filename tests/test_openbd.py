@@ -0,0 +1,103 @@
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+import sys
+import json
+import sqlite3
+import time
+import pytest
+import requests
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from backend.openbd import OpenBDClient, OpenBDResponseCache
+
+ISBN10S = ['400000000{}'.format(i) for i in range(7)]   # 書籍ISBN-10（末尾6はopenBDで見つからない書籍）
+
+
+class StubOpenBD(BaseHTTPRequestHandler):
+    """openBD代替（ISBNごとに{"summary": {"isbn": ...}}，見つからない書籍はnullを返す，failuresの順にエラー応答）
+    """
+    requests = []   # リクエストされたISBNリスト
+    failures = []   # 先頭から順に返すエラーステータスコード
+
+    def do_GET(self):
+        if self.failures:
+            self.send_response(self.failures.pop(0))
+            self.end_headers()
+            return
+        isbn10s = parse_qs(urlparse(self.path).query)['isbn'][0].split(',')
+        self.requests.append(isbn10s)
+        body = json.dumps([None if isbn10.endswith('6') else dict(summary=dict(isbn=isbn10)) for isbn10 in isbn10s]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    """スタブサーバ起動（終了時に停止）
+    """
+    StubOpenBD.requests, StubOpenBD.failures = [], []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubOpenBD)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{0}/v1/get'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(endpoint: str, **kwargs) -> OpenBDClient:
+    params = dict(timeout=(1.0, 5.0), max_retries=2, backoff_factor=0.0, batch_size=3)
+    params.update(kwargs)
+    return OpenBDClient(endpoint=endpoint, **params)
+
+
+def assert_books(openbds: list, isbn10s: list) -> None:
+    assert [None if openbd is None else openbd['summary']['isbn'] for openbd in openbds] == \
+        [None if isbn10.endswith('6') else isbn10 for isbn10 in isbn10s]
+
+
+def test_batches_requests(endpoint):
+    client = make_client(endpoint)
+    openbds = client.get_many(ISBN10S)
+    assert StubOpenBD.requests == [ISBN10S[0:3], ISBN10S[3:6], ISBN10S[6:7]]
+    assert_books(openbds, ISBN10S)
+    client.close()
+
+
+def test_retries_server_errors(endpoint):
+    client = make_client(endpoint)
+    StubOpenBD.failures = [503, 500]
+    assert_books(client.get_many(ISBN10S[:2]), ISBN10S[:2])
+    assert StubOpenBD.requests == [ISBN10S[:2]]
+
+    StubOpenBD.failures = [502, 503, 504]   # リトライ上限（2回）超過
+    with pytest.raises(requests.RequestException):
+        client.get_many(ISBN10S[:2])
+    client.close()
+
+
+def test_cache_expires_after_ttl(endpoint, tmp_path):
+    cache_path = tmp_path / 'openbd.sqlite3'
+    client = make_client(endpoint, cache=OpenBDResponseCache(path=cache_path, ttl=0.5))
+    assert_books(client.get_many(ISBN10S), ISBN10S)
+    assert_books(client.get_many(ISBN10S[::-1]), ISBN10S[::-1])     # 有効期間内 -> キャッシュ（見つからない書籍含む）
+    assert len(StubOpenBD.requests) == 3
+
+    time.sleep(0.6)
+    assert_books(client.get_many(ISBN10S[:2]), ISBN10S[:2])         # 期限切れ -> 再リクエスト
+    assert StubOpenBD.requests[3:] == [ISBN10S[:2]]
+    client.close()
+
+    # 開き直すと期限切れレスポンスを削除
+    time.sleep(0.6)
+    OpenBDResponseCache(path=cache_path, ttl=0.5).close()
+    with sqlite3.connect(str(cache_path)) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM response').fetchone()[0] == 0
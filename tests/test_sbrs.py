@@ -0,0 +1,129 @@
+from pathlib import Path
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+import config
+from test_bulklearn import BookVectors, make_history    # DB接続用環境変数もここで設定
+import backend.sbrs
+from backend.sbrs import ProposalSystem, get_prop_sbrs
+
+
+@pytest.fixture
+def sbrs_config(tmp_path, monkeypatch):
+    """一時ディレクトリにスナップショットを置く設定への切り替え（CF型探索・逐次学習）
+    """
+    with open(Path(parent_dir) / 'config' / '_config.yml') as f:
+        conf = yaml.safe_load(f)
+    conf['sbrs']['search']['method'] = 'cf'
+    conf['sbrs']['learn'] = dict(method='stream', workers=1)
+    conf['sbrs']['snapshot'] = dict(path=str(tmp_path / 'sbrs.npz'))
+    with open(tmp_path / 'config.yml', mode='w') as f:
+        yaml.safe_dump(conf, f)
+    monkeypatch.setattr(config, 'CONFIG_PATH', tmp_path / 'config.yml')
+    return config.reload()
+
+
+class HistoryDB():
+    """閲覧履歴テーブルの代替（ログID tまで記録された時点の状態を返す）
+
+    セッション末尾フラグは，change_sessionと同じくそのユーザの次のログ（新しいセッション）の記録時に立つ．
+    expireでupdate_sessionと同じく次のログを待たずにセッションを終了させる．
+    """
+
+    def __init__(self, history_df: pd.core.frame.DataFrame):
+        self.history_df = history_df.copy()
+        next_log_id = pd.Series(history_df.index, index=history_df.index).groupby(history_df['uId']).shift(-1)
+        self.closed_at = next_log_id.where(history_df['isLast'], np.inf)    # セッション末尾フラグが立つログID
+        self.t = 0
+
+    def expire(self, n_user: int) -> None:
+        """セッション切れ（時点tで末尾未確定のログをもつn_user人のセッションを終了し，以降はそのユーザのログなし）
+
+        次のログがないため，末尾確定はスナップショット復元時のclose_sessionsでのみ反映される．
+        """
+        df = self.get_history_df()
+        last_logs = df[~df['uId'].duplicated(keep='last') & ~df['isLast']].tail(n_user)
+        self.closed_at[last_logs.index] = self.t
+        self.history_df.loc[last_logs.index, 'isLast'] = True
+        self.history_df = self.history_df[(self.history_df.index <= self.t) | ~self.history_df['uId'].isin(last_logs['uId'])]
+
+    def get_history_df(self, min_id=0) -> pd.core.frame.DataFrame:
+        df = self.history_df[self.history_df.index <= self.t].copy()
+        df['isLast'] = self.closed_at[df.index] <= self.t
+        return df[df.index > min_id]
+
+    def get_closed_history_df(self, ids: list) -> pd.core.frame.DataFrame:
+        df = self.get_history_df()
+        return df[df.index.isin(ids) & df['isLast']]
+
+
+def get_context_reps(user) -> np.ndarray:
+    """コンテキストセッション表現取得（リングバッファを古い順に並べ替え）
+    """
+    context_reps = user.rep_store.get_context_session_reps(row=user.row)
+    return np.roll(context_reps, -(user.rep_store.session_head[user.row] + 1), axis=0)
+
+
+def assert_same_state(expected: ProposalSystem, actual: ProposalSystem) -> None:
+    assert expected.last_log_id == actual.last_log_id
+    assert expected.open_log_ids == actual.open_log_ids
+    # ユーザ表現（セッション切れによる構築はスナップショット復元時まで遅れるため，ユーザIXの順序は比較しない）
+    assert set(expected.uId_by_uIdx) == set(actual.uId_by_uIdx)
+    for uId in expected.uId_by_uIdx:
+        np.testing.assert_allclose(expected.rep_store.get_user_rep(uId=uId), actual.rep_store.get_user_rep(uId=uId), rtol=1e-5, atol=1e-6)
+    assert expected.users.keys() == actual.users.keys()
+    for uId, user in expected.users.items():
+        other = actual.users[uId]
+        assert (user.latest_sId, user.prv_bId) == (other.latest_sId, other.prv_bId)
+        np.testing.assert_allclose(get_context_reps(user), get_context_reps(other), rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_cf_books_ignore_unrelated_tombstones(seed, sbrs_config):
+    prop_sbrs = ProposalSystem(train_df=make_history(seed=seed), d2v=BookVectors(seed=seed, n_book=300))
+    prop_sbrs.learn()
+    k_book = prop_sbrs.params.search.k_book
+    users = [user for user in prop_sbrs.users.values() if user.latest_session_rep is not None]
+
+    def search_all():
+        return [prop_sbrs.search_cf_books(rtuser_rep=user.construct_rtuser_rep(), uId=user.uId, bId=user.prv_bId) for user in users]
+
+    expected = search_all()
+
+    # どのリアルタイムユーザ表現・ユーザ表現の近傍（k_book+1）にも含まれない書籍を削除
+    queries = np.vstack([user.construct_rtuser_rep() for user in users] + [prop_sbrs.user_reps])
+    related = np.unique(prop_sbrs.book_knn_model.search(queries, n_neighbors=k_book + 1))
+    unrelated = np.setdiff1d(np.arange(len(prop_sbrs.bId_by_bIdx)), related)
+    assert len(unrelated) > 0
+    for bIdx in unrelated:
+        prop_sbrs.delete_book(bId=prop_sbrs.bId_by_bIdx[bIdx])
+
+    for books, other in zip(expected, search_all()):
+        np.testing.assert_array_equal(books, other)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_snapshot_restore_matches_fresh_build(seed, sbrs_config, monkeypatch):
+    db = HistoryDB(history_df=make_history(seed=seed))
+    monkeypatch.setattr(backend.sbrs, 'get_history_df', db.get_history_df)
+    monkeypatch.setattr(backend.sbrs, 'get_closed_history_df', db.get_closed_history_df)
+    d2v = BookVectors(seed=seed)
+
+    db.t = 200
+    get_prop_sbrs(d2v=d2v)                  # 全履歴から学習 -> スナップショット保存
+    db.expire(n_user=3)                     # スナップショット保存後に末尾未確定ログのセッション切れ
+    db.t = 400
+    prop_sbrs = get_prop_sbrs(d2v=d2v)      # スナップショット復元 -> 末尾確定ログ反映 -> 差分学習
+    assert prop_sbrs.last_log_id == db.get_history_df().index.max()
+    db.t = 600
+    assert prop_sbrs.catch_up() == len(db.get_history_df(min_id=400))     # 差し替え直前の差分反映
+
+    fresh = ProposalSystem(train_df=db.get_history_df(), d2v=d2v)
+    fresh.learn()
+    assert fresh.n_constructed_user > 1
+    assert_same_state(expected=fresh, actual=prop_sbrs)
@@ -0,0 +1,82 @@
+from pathlib import Path
+import sys
+import multiprocessing
+
+parent_dir = str(Path(__file__).parent.parent.resolve())
+sys.path.append(parent_dir)
+from backend.tokenstore import TokenStore
+
+DOCS = [
+    ('4000000001', ['本', '読む', '図書館']),
+    ('4000000002', ['司書', '本']),
+    ('4000000003', []),
+    ('4000000004', ['推薦', '書籍', '本']),
+]
+
+
+def read_all(path: Path) -> dict:
+    return dict(TokenStore(path=path).iter_words())
+
+
+def test_round_trip_after_compact(tmp_path):
+    store = TokenStore(path=tmp_path)
+    assert store.append_many(items=DOCS) == len(DOCS)
+    store.append(isbn10='4000000002', words=['司書', '検索'])   # 置換
+    store.delete(isbn10='4000000001')
+    store.append(isbn10='4000000005', words=['検索', '新刊'])
+    expected = {'4000000002': ['司書', '検索'], '4000000004': ['推薦', '書籍', '本'], '4000000005': ['検索', '新刊']}
+    assert read_all(tmp_path) == expected
+    assert len(store) == 4  # 単語を含まない書籍説明を含む
+
+    vocab = store.vocab_path.read_text()
+    tokens_size = store.tokens_path.stat().st_size
+    assert store.compact() == 4
+    assert store.tokens_path.stat().st_size < tokens_size       # 置換・削除済書籍の単語ID列を除去
+    assert store.vocab_path.read_text() == vocab                # 語彙（単語ID）は不変
+
+    reloaded = TokenStore(path=tmp_path)
+    assert dict(reloaded.iter_words()) == expected
+    assert len(reloaded) == 4
+
+    # 読み込み直したストアへの追記も既存の単語IDを使う
+    reloaded.append(isbn10='4000000006', words=['本', '新語'])
+    assert store.vocab_path.read_text() == vocab + '新語\n'
+    assert read_all(tmp_path)['4000000006'] == ['本', '新語']
+
+
+def test_mark_built(tmp_path):
+    store = TokenStore(path=tmp_path)
+    store.append_many(items=DOCS)
+    assert not store.is_built()
+    store.mark_built()
+    assert TokenStore(path=tmp_path).is_built()
+
+    rebuilt_path = tmp_path / 'rebuilt'
+    rebuilt = TokenStore(path=rebuilt_path)
+    assert rebuilt.rebuild(items=DOCS[:2]) == 2
+    assert TokenStore(path=rebuilt_path).is_built()
+    assert read_all(rebuilt_path) == dict(DOCS[:2])
+
+
+def append_worker(path: Path, worker: int, n_doc: int) -> None:
+    store = TokenStore(path=path)
+    for i in range(n_doc):
+        # 全ワーカー共通の単語・ワーカー固有の単語を混ぜる（単語IDの割り当てが競合する）
+        store.append(isbn10='{0}-{1}'.format(worker, i), words=['共通{}'.format(i % 7), '固有{0}-{1}'.format(worker, i), '共通{}'.format(i % 3)])
+
+
+def test_concurrent_appends_share_vocab(tmp_path):
+    n_worker, n_doc = 4, 50
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=append_worker, args=(tmp_path, worker, n_doc)) for worker in range(n_worker)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+        assert p.exitcode == 0
+
+    vocab = TokenStore(path=tmp_path).vocab_path.read_text().split('\n')[:-1]
+    assert len(vocab) == len(set(vocab)) == 7 + n_worker * n_doc   # 単語の重複登録なし
+    expected = {'{0}-{1}'.format(worker, i): ['共通{}'.format(i % 7), '固有{0}-{1}'.format(worker, i), '共通{}'.format(i % 3)]
+                for worker in range(n_worker) for i in range(n_doc)}
+    assert read_all(tmp_path) == expected